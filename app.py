@@ -1,21 +1,41 @@
 import os
+import atexit
 import secrets
 import random
 from datetime import datetime, timedelta
 import logging
+import sys
+import time
 
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, session, send_from_directory
+import click
+from flask import Flask, Response, render_template, redirect, url_for, request, flash, jsonify, session, send_from_directory, \
+    stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from apscheduler.schedulers.background import BackgroundScheduler
 from itsdangerous import URLSafeTimedSerializer
-
-from models import db, User, Facility, EnergyData
-from utils import generate_mock_data, get_ai_recommendations, analyze_trends, get_trend_insights
-from ml_predictor import EnergyPredictor
-
-# Initialize the ML predictor
-predictor = EnergyPredictor()
+from sqlalchemy import select
+
+from models import db, User, Facility, EnergyData, JobWatermark
+from utils import generate_mock_data, get_ai_recommendations, analyze_trends, get_trend_insights, TrendAccumulator
+from model_store import ModelStore
+from ingest import ReadingError, BufferFull, IngestBuffer, build_reading, bulk_insert_readings
+from ingest_log import IngestLog, IngestLogError, LogReplayer, recover_orphaned_logs
+from migrations import prepare_new_database, run_migrations
+from rollups import HOUR, WATERMARK_NAME as ROLLUP_WATERMARK, choose_resolution, update_rollups, get_rollups, rollup_data_points, analyze_rollup_trends
+from retention import apply_retention
+from archive import archive_cold_data, history_summary, iter_history_chunks, HISTORY_COLUMNS
+from day_stats import record_day_stats, rebuild_day_stats, day_stats_ready, window_trends
+from storage import READER_BIND, apply_sqlite_profile, reader_url, use_reader, using_writer, stream_from_reader
+from downsampling import METHODS as DOWNSAMPLE_METHODS, downsample_columns, BucketAccumulator
+from latest_cache import LatestReadingCache
+from live_stream import LiveEventHub, StreamFull
+from shared_ring import SharedReadingRing
+from http_cache import ResponseCache, conditional_get, reading_watermark
+from energy_query import RESOLUTIONS as QUERY_RESOLUTIONS, QueryError, parse_time, parse_fields, query_energy
+from meter_import import MeterImportError, import_readings
+from export import FORMATS as EXPORT_FORMATS, iter_export, export_filename
+from block_encoding import pack_closed_blocks, WATERMARK_NAME as BLOCK_WATERMARK
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -25,8 +45,13 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
 
-# Configure the SQLAlchemy database
-database_url = os.environ.get("DATABASE_URL", "sqlite:///instance/energy_intelligence.db")
+# Ensure instance directory exists
+instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+if not os.path.exists(instance_path):
+    os.makedirs(instance_path)
+
+# Configure the SQLAlchemy database (SQLite in the instance folder unless DATABASE_URL is set)
+database_url = os.environ.get("DATABASE_URL") or f"sqlite:///{os.path.join(instance_path, 'energy_intelligence.db')}"
 # Fix PostgreSQL URL format for SQLAlchemy 1.4+
 if database_url and database_url.startswith("postgres://"):
     database_url = database_url.replace("postgres://", "postgresql://", 1)
@@ -36,24 +61,149 @@ if database_url and database_url.startswith("postgres://"):
     else:
         database_url += "?sslmode=disable"
 
-# Ensure instance directory exists
-instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
-if not os.path.exists(instance_path):
-    os.makedirs(instance_path)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(instance_path, 'energy_intelligence.db')}"
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True
 }
+if database_url.startswith("postgresql"):
+    # Each gunicorn worker gets its own pool; size it so workers * (size + overflow) fits max_connections
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_use_lifo": True  # idle connections beyond the working set can time out server-side
+    })
+
+# SQLite high-throughput profile: WAL, one serialized writer connection per process and
+# read-only reader engines for the dashboard, historical and ML routes
+app.config["SQLITE_HIGH_THROUGHPUT"] = os.environ.get("SQLITE_HIGH_THROUGHPUT", "false").lower() in ("1", "true", "yes")
+app.config["SQLITE_CACHE_MB"] = int(os.environ.get("SQLITE_CACHE_MB", 64))
+app.config["SQLITE_MMAP_MB"] = int(os.environ.get("SQLITE_MMAP_MB", 256))
+app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+app.config["SQLITE_READER_POOL"] = int(os.environ.get("SQLITE_READER_POOL", 4))
+sqlite_profile = app.config["SQLITE_HIGH_THROUGHPUT"] and database_url.startswith("sqlite:///")
+if sqlite_profile:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "pool_size": 1,
+        "max_overflow": 0,
+        "pool_timeout": app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000
+    })
+    app.config["SQLALCHEMY_BINDS"] = {
+        READER_BIND: {
+            "url": reader_url(database_url[len("sqlite:///"):]),
+            "pool_size": app.config["SQLITE_READER_POOL"],
+            "max_overflow": 0,
+            "pool_recycle": 300,
+            "pool_pre_ping": True
+        }
+    }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Hardware ingest settings
+app.config["HARDWARE_BATCH_MAX_READINGS"] = int(os.environ.get("HARDWARE_BATCH_MAX_READINGS", 500))
+# Write-behind mode: acknowledge readings once queued and group-commit them in the background
+app.config["INGEST_WRITE_BEHIND"] = os.environ.get("INGEST_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+app.config["INGEST_QUEUE_SIZE"] = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+app.config["INGEST_MAX_BATCH"] = int(os.environ.get("INGEST_MAX_BATCH", 500))
+app.config["INGEST_MAX_LATENCY_MS"] = int(os.environ.get("INGEST_MAX_LATENCY_MS", 200))
+# Durable ingest log: acknowledge readings once fsynced to disk and replay them into the database
+app.config["INGEST_LOG_DIR"] = os.environ.get("INGEST_LOG_DIR", "")
+app.config["INGEST_LOG_SEGMENT_BYTES"] = int(os.environ.get("INGEST_LOG_SEGMENT_BYTES", 64 * 1024 * 1024))
+app.config["INGEST_LOG_FSYNC_MS"] = int(os.environ.get("INGEST_LOG_FSYNC_MS", 20))
+app.config["INGEST_LOG_REPLAY_MS"] = int(os.environ.get("INGEST_LOG_REPLAY_MS", 500))
+# Per-facility daily statistics updated on every insert; /historical computes its statistics from them
+app.config["DAY_STATS_ENABLED"] = os.environ.get("DAY_STATS_ENABLED", "false").lower() in ("1", "true", "yes")
+# How often new readings are folded into the 1-minute/1-hour/1-day rollups
+app.config["ROLLUP_INTERVAL_SECONDS"] = int(os.environ.get("ROLLUP_INTERVAL_SECONDS", 60))
+# Most new readings a request folds in before reading the rollups; larger backlogs are left to the job
+app.config["ROLLUP_REQUEST_MAX_ROWS"] = int(os.environ.get("ROLLUP_REQUEST_MAX_ROWS", 10000))
+# PostgreSQL ids can commit out of order: the id-tracking jobs (rollups, block packing) only
+# process readings whose id was handed out at least this long ago.  Not used on SQLite.
+app.config["WATERMARK_SETTLE_SECONDS"] = int(os.environ.get("WATERMARK_SETTLE_SECONDS", 60))
+# Retention: raw readings for N days, 1-minute rollups for M months, hourly/daily rollups forever
+app.config["RETENTION_ENABLED"] = os.environ.get("RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+app.config["RETENTION_RAW_DAYS"] = int(os.environ.get("RETENTION_RAW_DAYS", 90))
+app.config["RETENTION_MINUTE_ROLLUP_MONTHS"] = int(os.environ.get("RETENTION_MINUTE_ROLLUP_MONTHS", 6))
+app.config["RETENTION_CHUNK_ROWS"] = int(os.environ.get("RETENTION_CHUNK_ROWS", 5000))
+app.config["RETENTION_INTERVAL_HOURS"] = float(os.environ.get("RETENTION_INTERVAL_HOURS", 6))
+# Cold archive: whole months older than ARCHIVE_AFTER_DAYS move to memory-mapped columnar segments
+app.config["ARCHIVE_DIR"] = os.environ.get("ARCHIVE_DIR", "")
+app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", 60))
+# Block packing: copy readings of closed time blocks into compressed energy_block rows
+app.config["BLOCK_PACKING_ENABLED"] = os.environ.get("BLOCK_PACKING_ENABLED", "false").lower() in ("1", "true", "yes")
+app.config["BLOCK_SECONDS"] = int(os.environ.get("BLOCK_SECONDS", 3600))
+
+# Charts are downsampled to this many points (override per request with ?points=)
+app.config["DASHBOARD_CHART_POINTS"] = int(os.environ.get("DASHBOARD_CHART_POINTS", 500))
+app.config["HISTORICAL_CHART_POINTS"] = int(os.environ.get("HISTORICAL_CHART_POINTS", 500))
+app.config["CHART_MAX_POINTS"] = int(os.environ.get("CHART_MAX_POINTS", 5000))
+# Longest window /historical accepts
+app.config["HISTORICAL_MAX_DAYS"] = int(os.environ.get("HISTORICAL_MAX_DAYS", 3650))
+
+# Rows read per chunk by the streaming export
+app.config["EXPORT_CHUNK_SIZE"] = int(os.environ.get("EXPORT_CHUNK_SIZE", 10000))
+
+# /api/energy page size (?limit=) default and cap
+app.config["ENERGY_API_PAGE_SIZE"] = int(os.environ.get("ENERGY_API_PAGE_SIZE", 1000))
+app.config["ENERGY_API_MAX_PAGE_SIZE"] = int(os.environ.get("ENERGY_API_MAX_PAGE_SIZE", 10000))
+
+# Latest-reading cache: how often to re-check the database for readings stored by other
+# processes (0 = never, only safe with a single worker process)
+app.config["LATEST_CACHE_REFRESH_SECONDS"] = float(os.environ.get("LATEST_CACHE_REFRESH_SECONDS", 5))
+if not app.config["LATEST_CACHE_REFRESH_SECONDS"] and int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+    # Every worker would keep serving the readings it ingested itself
+    logger.warning("LATEST_CACHE_REFRESH_SECONDS=0 with several workers (WEB_CONCURRENCY); using 5 seconds")
+    app.config["LATEST_CACHE_REFRESH_SECONDS"] = 5.0
+
+# Response cache of /historical, /ml-dashboard and /api/predictions, keyed by the data watermark
+app.config["RESPONSE_CACHE_ENABLED"] = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+app.config["RESPONSE_CACHE_SIZE"] = int(os.environ.get("RESPONSE_CACHE_SIZE", 128))
+app.config["RESPONSE_CACHE_TTL_SECONDS"] = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 60))
+
+# Consumption model: trained by a background job and saved here, never on a request
+app.config["MODEL_PATH"] = os.environ.get("MODEL_PATH", os.path.join(app.instance_path, "energy_model.json"))
+app.config["MODEL_TRAINING_INTERVAL_MINUTES"] = int(os.environ.get("MODEL_TRAINING_INTERVAL_MINUTES", 60))
+app.config["MODEL_TRAINING_DAYS"] = int(os.environ.get("MODEL_TRAINING_DAYS", 30))
+# Online mode: fold every received reading into the model between trainings, optionally
+# decaying older data with this half-life (0 = no decay)
+app.config["MODEL_ONLINE_UPDATES"] = os.environ.get("MODEL_ONLINE_UPDATES", "false").lower() in ("1", "true", "yes")
+app.config["MODEL_DECAY_HALF_LIFE_DAYS"] = float(os.environ.get("MODEL_DECAY_HALF_LIFE_DAYS", 0))
+
+# Live dashboard stream (Server-Sent Events)
+app.config["LIVE_STREAM_ENABLED"] = os.environ.get("LIVE_STREAM_ENABLED", "true").lower() in ("1", "true", "yes")
+app.config["LIVE_STREAM_BACKLOG"] = int(os.environ.get("LIVE_STREAM_BACKLOG", 100))
+app.config["LIVE_STREAM_CLIENT_QUEUE"] = int(os.environ.get("LIVE_STREAM_CLIENT_QUEUE", 100))
+app.config["LIVE_STREAM_HEARTBEAT_SECONDS"] = int(os.environ.get("LIVE_STREAM_HEARTBEAT_SECONDS", 15))
+app.config["LIVE_STREAM_MAX_SECONDS"] = int(os.environ.get("LIVE_STREAM_MAX_SECONDS", 120))
+# Open streams per process; each holds a worker thread, so keep this well below gunicorn's --threads
+# (further dashboards poll instead)
+app.config["LIVE_STREAM_MAX_CLIENTS"] = int(os.environ.get("LIVE_STREAM_MAX_CLIENTS", 8))
+
+# Shared-memory ring of recent readings, visible to every gunicorn worker
+app.config["SHARED_RING_ENABLED"] = os.environ.get("SHARED_RING_ENABLED", "false").lower() in ("1", "true", "yes")
+app.config["SHARED_RING_PATH"] = os.environ.get("SHARED_RING_PATH", os.path.join(app.instance_path, "readings.ring"))
+app.config["SHARED_RING_CAPACITY"] = int(os.environ.get("SHARED_RING_CAPACITY", 17280))  # 24h at one reading per 5s
+app.config["SHARED_RING_FACILITIES"] = int(os.environ.get("SHARED_RING_FACILITIES", 16))
+app.config["SHARED_RING_HOURS"] = int(os.environ.get("SHARED_RING_HOURS", 24))
+
 # Initialize the database
 db.init_app(app)
 
-# Create database tables
+# Create database tables and bring existing databases up to date
 with app.app_context():
+    if sqlite_profile:
+        pragma_options = {
+            'cache_mb': app.config["SQLITE_CACHE_MB"],
+            'mmap_mb': app.config["SQLITE_MMAP_MB"],
+            'busy_timeout_ms': app.config["SQLITE_BUSY_TIMEOUT_MS"]
+        }
+        apply_sqlite_profile(db.engine, **pragma_options)
+        apply_sqlite_profile(db.engines[READER_BIND], read_only=True, **pragma_options)
+        logger.info("SQLite high-throughput profile enabled (WAL, serialized writer, read-only readers)")
+    prepare_new_database(db.engine)
     db.create_all()
+    run_migrations(db.engine)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -74,6 +224,295 @@ def utility_processor():
 scheduler = BackgroundScheduler()
 scheduler.start()
 
+# Latest reading per facility, updated by the ingest endpoints
+latest_readings = LatestReadingCache(refresh_seconds=app.config["LATEST_CACHE_REFRESH_SECONDS"])
+
+# Optional shared ring: same interface as the cache, but shared by all worker processes
+shared_ring = None
+if app.config["SHARED_RING_ENABLED"]:
+    os.makedirs(os.path.dirname(app.config["SHARED_RING_PATH"]), exist_ok=True)
+    shared_ring = SharedReadingRing(
+        app.config["SHARED_RING_PATH"],
+        capacity=app.config["SHARED_RING_CAPACITY"],
+        slots=app.config["SHARED_RING_FACILITIES"],
+        fallback=latest_readings
+    )
+    with app.app_context():
+        shared_ring.rebuild_if_stale(hours=app.config["SHARED_RING_HOURS"])
+    latest_readings = shared_ring
+    logger.info(f"Shared reading ring enabled at {app.config['SHARED_RING_PATH']}")
+
+# Rendered responses of the expensive views, reused until a new reading arrives
+response_cache = ResponseCache(
+    max_entries=app.config["RESPONSE_CACHE_SIZE"] if app.config["RESPONSE_CACHE_ENABLED"] else 0,
+    ttl_seconds=app.config["RESPONSE_CACHE_TTL_SECONDS"]
+)
+
+# The fitted consumption predictor, shared with the other workers through MODEL_PATH
+model_store = ModelStore(app.config["MODEL_PATH"])
+
+# Fan-out of new readings to live dashboards
+live_events = LiveEventHub(
+    backlog_size=app.config["LIVE_STREAM_BACKLOG"],
+    client_queue_size=app.config["LIVE_STREAM_CLIENT_QUEUE"],
+    heartbeat_seconds=app.config["LIVE_STREAM_HEARTBEAT_SECONDS"],
+    max_clients=app.config["LIVE_STREAM_MAX_CLIENTS"]
+)
+
+# Optional write-behind buffer for hardware readings
+ingest_buffer = None
+if app.config["INGEST_WRITE_BEHIND"]:
+    ingest_buffer = IngestBuffer(
+        app,
+        max_size=app.config["INGEST_QUEUE_SIZE"],
+        max_batch=app.config["INGEST_MAX_BATCH"],
+        max_latency_ms=app.config["INGEST_MAX_LATENCY_MS"]
+    )
+    ingest_buffer.start(scheduler)
+    atexit.register(ingest_buffer.shutdown)
+    logger.info("Write-behind ingest buffer enabled")
+
+# Optional durable ingest log; takes precedence over the write-behind buffer
+ingest_log = None
+if app.config["INGEST_LOG_DIR"]:
+    ingest_log = IngestLog(
+        app.config["INGEST_LOG_DIR"],
+        segment_max_bytes=app.config["INGEST_LOG_SEGMENT_BYTES"],
+        fsync_interval_ms=app.config["INGEST_LOG_FSYNC_MS"]
+    )
+    log_replayer = LogReplayer(app, ingest_log.directory, log=ingest_log)
+
+    # Crash recovery: apply anything acknowledged but not yet loaded before the last exit
+    recovered = log_replayer.replay() + recover_orphaned_logs(app, app.config["INGEST_LOG_DIR"])
+    if recovered:
+        logger.info(f"Recovered {recovered} readings from the ingest log")
+
+    scheduler.add_job(
+        log_replayer.replay,
+        'interval',
+        seconds=app.config["INGEST_LOG_REPLAY_MS"] / 1000.0,
+        id='ingest-log-replay',
+        max_instances=1,
+        coalesce=True
+    )
+
+    def shutdown_ingest_log():
+        """Make the log durable and load what is left before exiting"""
+        ingest_log.close()
+        log_replayer.replay()
+
+    atexit.register(shutdown_ingest_log)
+    logger.info(f"Durable ingest log enabled in {ingest_log.directory}")
+
+
+def catch_up_rollups():
+    """
+    Fold at most ROLLUP_REQUEST_MAX_ROWS new readings into the rollups (for requests)
+    Never waits for the scheduled job if it is already running in this process
+    Returns: True if the rollups are now up to date
+    """
+    batch_size = app.config["ROLLUP_REQUEST_MAX_ROWS"]
+    processed = update_rollups(batch_size=batch_size, max_batches=1, wait=False)
+    return processed is not None and processed < batch_size
+
+
+def run_rollup_job():
+    """Scheduled job: fold readings inserted since the last run into the rollups"""
+    with app.app_context():
+        try:
+            processed = update_rollups()
+            if processed:
+                logger.debug(f"Rolled up {processed} new readings")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating rollups: {str(e)}")
+
+
+scheduler.add_job(
+    run_rollup_job,
+    'interval',
+    seconds=app.config["ROLLUP_INTERVAL_SECONDS"],
+    id='rollup-update',
+    max_instances=1,
+    coalesce=True
+)
+
+
+def run_day_stats_backfill():
+    """One-off job: build the day stats of the readings stored before they were enabled"""
+    with app.app_context():
+        try:
+            if not day_stats_ready():
+                rebuild_day_stats(complete_from=raw_complete_from())
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding day stats: {str(e)}")
+
+
+if app.config["DAY_STATS_ENABLED"]:
+    scheduler.add_job(
+        run_day_stats_backfill,
+        id='day-stats-backfill',
+        next_run_time=datetime.now() + timedelta(seconds=30),
+        max_instances=1
+    )
+
+
+def run_training_job():
+    """Scheduled job: retrain the consumption model if readings arrived since it was fitted"""
+    with app.app_context():
+        try:
+            update_rollups()
+            watermark = db.session.get(JobWatermark, ROLLUP_WATERMARK)
+            model = model_store.train(
+                watermark.last_id if watermark else 0,
+                lambda: get_training_data(days=app.config["MODEL_TRAINING_DAYS"]),
+                facility_id=get_default_facility_id()
+            )
+            if model:
+                logger.info(f"Trained model v{model.version} (score {model.validation_score:.1f})")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error training the model: {str(e)}")
+
+
+scheduler.add_job(
+    run_training_job,
+    'interval',
+    minutes=app.config["MODEL_TRAINING_INTERVAL_MINUTES"],
+    id='model-training',
+    next_run_time=datetime.now() + timedelta(seconds=10),
+    max_instances=1,
+    coalesce=True
+)
+
+
+def model_version():
+    """Version of the model serving this process: its training run and online update count"""
+    model = model_store.get()
+    return f'{model.version}.{model.revision}'
+
+
+def predictions_version():
+    """Version of what the predictions are computed from: the model and the hourly rollups"""
+    # The rollup job can advance without a new raw reading (e.g. catching up a backlog)
+    watermark = db.session.get(JobWatermark, ROLLUP_WATERMARK)
+    return f'{model_version()}.r{watermark.last_id if watermark else 0}'
+
+
+def update_model(readings):
+    """Fold newly received readings into the model when online updates are enabled"""
+    if app.config["MODEL_ONLINE_UPDATES"]:
+        model_store.update(readings, half_life_days=app.config["MODEL_DECAY_HALF_LIFE_DAYS"] or None)
+
+
+def retention_watermarks():
+    """Background jobs that must have processed a raw reading before retention deletes it"""
+    if app.config["BLOCK_PACKING_ENABLED"]:
+        return [ROLLUP_WATERMARK, BLOCK_WATERMARK]
+    return [ROLLUP_WATERMARK]
+
+
+def packed_before():
+    """
+    Time before which raw readings are read from the packed blocks, or None
+    Retention deletes packed readings from energy_data, so without the cold archive (which
+    serves those ranges itself) the raw readers fall back to the blocks past the cutoff.
+    """
+    if app.config["BLOCK_PACKING_ENABLED"] and app.config["RETENTION_ENABLED"] and not app.config["ARCHIVE_DIR"]:
+        return datetime.utcnow() - timedelta(days=app.config["RETENTION_RAW_DAYS"])
+    return None
+
+
+def raw_complete_from():
+    """
+    Time from which energy_data still holds every reading, or None
+    Retention deletes raw readings older than RETENTION_RAW_DAYS and the archive moves months
+    older than ARCHIVE_AFTER_DAYS, so only the rows after both cutoffs are complete.
+    """
+    now = datetime.utcnow()
+    cutoffs = []
+    if app.config["RETENTION_ENABLED"]:
+        cutoffs.append(now - timedelta(days=app.config["RETENTION_RAW_DAYS"]))
+    if app.config["ARCHIVE_DIR"]:
+        cutoffs.append(now - timedelta(days=app.config["ARCHIVE_AFTER_DAYS"]))
+    return max(cutoffs) if cutoffs else None
+
+
+def run_retention_job():
+    """Scheduled job: delete aged raw readings and 1-minute rollups, then reclaim space"""
+    with app.app_context():
+        try:
+            report = apply_retention(
+                raw_days=app.config["RETENTION_RAW_DAYS"],
+                minute_rollup_days=app.config["RETENTION_MINUTE_ROLLUP_MONTHS"] * 30,
+                chunk_size=app.config["RETENTION_CHUNK_ROWS"],
+                watermarks=retention_watermarks()
+            )
+            logger.info(f"Retention run: {report['raw_rows_deleted']} raw readings and "
+                        f"{report['minute_rollups_deleted']} 1-minute rollups removed, "
+                        f"{report['bytes_reclaimed']} bytes reclaimed in {report['elapsed_seconds']}s")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error applying retention policy: {str(e)}")
+
+
+if app.config["RETENTION_ENABLED"]:
+    scheduler.add_job(
+        run_retention_job,
+        'interval',
+        hours=app.config["RETENTION_INTERVAL_HOURS"],
+        id='retention',
+        max_instances=1,
+        coalesce=True
+    )
+
+
+def run_archive_job():
+    """Scheduled job: move cold readings into the columnar archive"""
+    with app.app_context():
+        try:
+            archived = archive_cold_data(app.config["ARCHIVE_DIR"], app.config["ARCHIVE_AFTER_DAYS"])
+            if archived:
+                logger.info(f"Archived {archived} cold readings")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error archiving cold readings: {str(e)}")
+
+
+if app.config["ARCHIVE_DIR"]:
+    scheduler.add_job(
+        run_archive_job,
+        'interval',
+        hours=24,
+        id='archive',
+        next_run_time=datetime.now() + timedelta(minutes=5),
+        max_instances=1,
+        coalesce=True
+    )
+
+
+def run_block_pack_job():
+    """Scheduled job: pack readings of closed time blocks into compressed blocks"""
+    with app.app_context():
+        try:
+            while pack_closed_blocks(block_seconds=app.config["BLOCK_SECONDS"]):
+                pass
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error packing closed blocks: {str(e)}")
+
+
+if app.config["BLOCK_PACKING_ENABLED"]:
+    scheduler.add_job(
+        run_block_pack_job,
+        'interval',
+        minutes=10,
+        id='block-pack',
+        max_instances=1,
+        coalesce=True
+    )
+
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -99,6 +538,20 @@ def create_default_facility():
             logger.info("Created default facility")
 
 
+def get_recent_reading(max_age_seconds=60):
+    """Latest reading (as a dict) if it arrived within max_age_seconds, served from the cache"""
+    latest = latest_readings.get()
+    if latest and latest['timestamp'] >= datetime.utcnow() - timedelta(seconds=max_age_seconds):
+        return latest
+    return None
+
+
+def get_default_facility_id():
+    """Return the id of the default facility, or None if none is configured"""
+    facility = Facility.query.first()
+    return facility.id if facility else None
+
+
 # Initialize the app with data
 with app.app_context():
     # Create database tables if they don't exist
@@ -305,39 +758,67 @@ def reset_password(token):
         return redirect(url_for('login'))
 
 
+def chart_points_arg(default):
+    """Chart point count requested with ?points=, clamped to a sane range"""
+    points = request.args.get('points', default, type=int)
+    return max(10, min(points, app.config["CHART_MAX_POINTS"]))
+
+
 @app.route('/dashboard')
 @login_required
+@use_reader
 def dashboard():
     """Render the main dashboard"""
     facility = Facility.query.first()
 
     # Get the latest energy data from the last 60 seconds for hardware status
-    sixty_seconds_ago = datetime.utcnow() - timedelta(seconds=60)
-    latest_data = EnergyData.query.filter(
-        EnergyData.timestamp >= sixty_seconds_ago
-    ).order_by(EnergyData.timestamp.desc()).first()
+    latest_data = get_recent_reading()
 
     # Only get recommendations if we have recent data
     recommendations = []
-    if latest_data and latest_data.timestamp:
+    if latest_data and latest_data['timestamp']:
         data_dict = {
-            'energy_produced': latest_data.energy_produced,
-            'energy_consumed': latest_data.energy_consumed,
-            'efficiency': latest_data.efficiency,
-            'current_load': latest_data.current_load
+            'energy_produced': latest_data['energy_produced'],
+            'energy_consumed': latest_data['energy_consumed'],
+            'efficiency': latest_data['efficiency'],
+            'current_load': latest_data['current_load']
         }
         recommendations = get_ai_recommendations(data_dict)
 
-    # Get data for the last 24 hours for the charts
+    # Get data for the last 24 hours for the charts (only the charted columns),
+    # from the shared ring when it covers the whole window
     one_day_ago = datetime.utcnow() - timedelta(days=1)
-    historical_data = EnergyData.query.filter(EnergyData.timestamp >= one_day_ago).order_by(EnergyData.timestamp).all()
+    chart_columns = ['energy_produced', 'energy_consumed', 'efficiency', 'current_load']
+    window = shared_ring.window(one_day_ago, chart_columns) if shared_ring else None
+    if window is None:
+        rows = db.session.execute(
+            select(EnergyData.timestamp, *[getattr(EnergyData, name) for name in chart_columns])
+            .where(EnergyData.timestamp >= one_day_ago)
+            .order_by(EnergyData.timestamp)
+        ).all()
+        if rows:
+            stamps, *values = zip(*rows)
+            window = stamps, dict(zip(chart_columns, values))
+
+    # Reduce each series to the target point count so page weight doesn't grow with reporting frequency
+    points = chart_points_arg(app.config["DASHBOARD_CHART_POINTS"])
+    method = request.args.get('downsample', 'lttb')
+    if method not in DOWNSAMPLE_METHODS:
+        method = 'lttb'
+
+    chart_timestamps, series = [], {'production': [], 'consumption': [], 'efficiency': [], 'load': []}
+    if window is not None and len(window[0]):
+        stamps, values = window
+        chart_timestamps, series = downsample_columns(
+            stamps, dict(zip(series, (values[name] for name in chart_columns))), points, method
+        )
 
     # Format data for the chart
-    timestamps = [data.timestamp.strftime('%H:%M') for data in historical_data]
-    production = [data.energy_produced for data in historical_data]
-    consumption = [data.energy_consumed for data in historical_data]
-    efficiency = [data.efficiency for data in historical_data]
-    load = [data.current_load for data in historical_data]
+    timestamps = [timestamp.strftime('%H:%M') for timestamp in chart_timestamps]
+    production = series['production']
+    consumption = series['consumption']
+    efficiency = series['efficiency']
+    load = series['load']
 
     return render_template(
         'dashboard.html',
@@ -352,40 +833,81 @@ def dashboard():
     )
 
 
+def historical_facility_id():
+    """Facility shown by /historical"""
+    return request.args.get('facility_id', type=int) or get_default_facility_id()
+
+
 @app.route('/historical')
 @login_required
+@use_reader
+@response_cache.cached(lambda: reading_watermark(latest_readings.get(historical_facility_id())),
+                       facility=historical_facility_id)
 def historical_analysis():
     """Render historical data analysis"""
     # Get timeframe from request, default to 7 days
-    days = int(request.args.get('days', 7))
+    days = max(1, min(int(request.args.get('days', 7)), app.config["HISTORICAL_MAX_DAYS"]))
+    facility_id = historical_facility_id()
 
     # Get historical data for the specified timeframe
     time_ago = datetime.utcnow() - timedelta(days=days)
-    historical_data = EnergyData.query.filter(EnergyData.timestamp >= time_ago).order_by(EnergyData.timestamp).all()
-
-    # Convert to list of dictionaries for analysis
-    data_points = []
-    for data in historical_data:
-        data_points.append({
-            'timestamp': data.timestamp,
-            'energy_produced': data.energy_produced,
-            'energy_consumed': data.energy_consumed,
-            'efficiency': data.efficiency,
-            'current_load': data.current_load
-        })
 
-    # Analyze data to find trends
-    trend_analysis = analyze_trends(data_points)
+    # Use the coarsest rollup that still gives a detailed chart for this window,
+    # unless raw readings were explicitly requested
+    resolution = None
+    if request.args.get('resolution') != 'raw':
+        resolution = choose_resolution(timedelta(days=days))
+
+    use_day_stats = app.config["DAY_STATS_ENABLED"] and day_stats_ready()
+    if resolution or use_day_stats:
+        # Fold in readings that arrived since the last scheduled rollup run, but leave a
+        # larger backlog (after a bulk import or an outage) to the scheduled job
+        with using_writer():
+            caught_up = catch_up_rollups()
+        # The day stats read the hourly rollups of the first day, which must be complete
+        use_day_stats = use_day_stats and caught_up
+
+    # Statistics from the per-day states (one row per day, hourly rollups for the first day)
+    trend_analysis = None
+    if use_day_stats:
+        trend_analysis = window_trends(app.config["ARCHIVE_DIR"], facility_id, time_ago, packed_before())
+
+    if resolution:
+        rollups = get_rollups(resolution, time_ago, facility_id=facility_id)
+        if trend_analysis is None:
+            peak_rollups = rollups if resolution <= HOUR else get_rollups(HOUR, time_ago, facility_id=facility_id)
+            trend_analysis = analyze_rollup_trends(rollups, peak_rollups)
+        data_points = rollup_data_points(rollups)
+    else:
+        # Raw readings, streamed in chunks from the cold archive and the live table so
+        # memory stays bounded by the chunk size and the number of chart points
+        end = datetime.utcnow()
+        trends = None
+        if trend_analysis is None:
+            trends = TrendAccumulator(*history_summary(app.config["ARCHIVE_DIR"], facility_id, time_ago, end,
+                                                       packed_before()))
+        chart = BucketAccumulator(time_ago, end, chart_points_arg(app.config["HISTORICAL_CHART_POINTS"]),
+                                  HISTORY_COLUMNS[1:])
+        for chunk in iter_history_chunks(app.config["ARCHIVE_DIR"], facility_id, time_ago, end,
+                                         packed_before=packed_before()):
+            if trends:
+                trends.update(chunk)
+            chart.update(chunk)
+
+        # Analyze data to find trends
+        if trends:
+            trend_analysis = trends.result()
+        data_points = chart.data_points()
 
     # Get recommendations based on trends
     insights = get_trend_insights(trend_analysis)
 
     # Format data for charts
-    timestamps = [data.timestamp.strftime('%m-%d %H:%M') for data in historical_data]
-    production = [data.energy_produced for data in historical_data]
-    consumption = [data.energy_consumed for data in historical_data]
-    efficiency = [data.efficiency for data in historical_data]
-    load = [data.current_load for data in historical_data]
+    timestamps = [d['timestamp'].strftime('%m-%d %H:%M') for d in data_points]
+    production = [d['energy_produced'] for d in data_points]
+    consumption = [d['energy_consumed'] for d in data_points]
+    efficiency = [d['efficiency'] for d in data_points]
+    load = [d['current_load'] for d in data_points]
 
     return render_template(
         'historical.html',
@@ -400,30 +922,35 @@ def historical_analysis():
     )
 
 
+def get_training_data(days=30):
+    """
+    Return per-bucket data points covering the last `days` days for the predictor
+    Uses the coarsest rollup that still resolves hour-of-day patterns; the
+    training job brings the rollups up to date first
+    """
+    window = timedelta(days=days)
+    resolution = min(choose_resolution(window) or HOUR, HOUR)
+
+    rollups = get_rollups(resolution, datetime.utcnow() - window, facility_id=get_default_facility_id())
+    return rollup_data_points(rollups)
+
+
+def get_recent_hours(hours=24):
+    """Return the hourly data points of the last `hours` hours, which anchor the predictions"""
+    rollups = get_rollups(HOUR, datetime.utcnow() - timedelta(hours=hours), facility_id=get_default_facility_id())
+    return rollup_data_points(rollups)[-hours:]
+
+
 @app.route('/ml-dashboard')
 @login_required
+@use_reader
+@response_cache.cached(lambda: reading_watermark(latest_readings.get()), version=predictions_version)
 def ml_dashboard():
     """Render ML dashboard with predictions"""
-    # Get historical data for training the model
-    days_for_training = 30
-    time_ago = datetime.utcnow() - timedelta(days=days_for_training)
-    historical_data = EnergyData.query.filter(EnergyData.timestamp >= time_ago).order_by(EnergyData.timestamp).all()
-
-    # Convert to list of dictionaries for the predictor
-    data_points = []
-    for data in historical_data:
-        data_points.append({
-            'timestamp': data.timestamp,
-            'energy_produced': data.energy_produced,
-            'energy_consumed': data.energy_consumed,
-            'efficiency': data.efficiency,
-            'current_load': data.current_load
-        })
-
-    # Train the predictor if we have enough data
-    model_score = 0
-    if len(data_points) > 24:
-        model_score = predictor.train(data_points)
+    # The model is trained in the background (run_training_job); only the last day is read here
+    data_points = get_recent_hours(24)
+    predictor = model_store.get()
+    model_score = predictor.validation_score or 0
 
     # Get predictions for the next 24 hours
     predictions = predictor.predict(data_points, horizon=24)
@@ -591,10 +1118,11 @@ def settings():
 
 @app.route('/api/data')
 @login_required
+@conditional_get(lambda: reading_watermark(latest_readings.get()))
 def get_data():
     """API endpoint to get the latest energy data"""
     # Get the latest data point
-    latest_data = EnergyData.query.order_by(EnergyData.timestamp.desc()).first()
+    latest_data = latest_readings.get()
 
     if not latest_data:
         return jsonify({
@@ -604,11 +1132,11 @@ def get_data():
 
     # Format data as JSON
     data = {
-        'timestamp': latest_data.timestamp.isoformat(),
-        'energy_produced': latest_data.energy_produced,
-        'energy_consumed': latest_data.energy_consumed,
-        'efficiency': latest_data.efficiency,
-        'current_load': latest_data.current_load
+        'timestamp': latest_data['timestamp'].isoformat(),
+        'energy_produced': latest_data['energy_produced'],
+        'energy_consumed': latest_data['energy_consumed'],
+        'efficiency': latest_data['efficiency'],
+        'current_load': latest_data['current_load']
     }
 
     return jsonify({
@@ -619,13 +1147,11 @@ def get_data():
 
 @app.route('/api/latest-hardware-data')
 @login_required
+@conditional_get(lambda: reading_watermark(get_recent_reading()))
 def get_latest_hardware_data():
     """API endpoint to get the latest hardware data including electrical parameters"""
     # Get the latest data from the last 60 seconds only
-    sixty_seconds_ago = datetime.utcnow() - timedelta(seconds=60)
-    latest_data = EnergyData.query.filter(
-        EnergyData.timestamp >= sixty_seconds_ago
-    ).order_by(EnergyData.timestamp.desc()).first()
+    latest_data = get_recent_reading()
 
     if not latest_data:
         return jsonify({
@@ -635,20 +1161,20 @@ def get_latest_hardware_data():
 
     # Format data as JSON with all electrical parameters
     data = {
-        'timestamp': latest_data.timestamp.isoformat(),
-        'energy_produced': latest_data.energy_produced,
-        'energy_consumed': latest_data.energy_consumed,
-        'efficiency': latest_data.efficiency,
-        'current_load': latest_data.current_load,
-        'voltage': latest_data.voltage,
-        'current': latest_data.current,
-        'current1': latest_data.current1,
-        'current2': latest_data.current2,
-        'current3': latest_data.current3,
-        'frequency': latest_data.frequency,
-        'power_factor': latest_data.power_factor,
-        'alert_message': latest_data.alert_message,
-        'alert_level': latest_data.alert_level
+        'timestamp': latest_data['timestamp'].isoformat(),
+        'energy_produced': latest_data['energy_produced'],
+        'energy_consumed': latest_data['energy_consumed'],
+        'efficiency': latest_data['efficiency'],
+        'current_load': latest_data['current_load'],
+        'voltage': latest_data['voltage'],
+        'current': latest_data['current'],
+        'current1': latest_data['current1'],
+        'current2': latest_data['current2'],
+        'current3': latest_data['current3'],
+        'frequency': latest_data['frequency'],
+        'power_factor': latest_data['power_factor'],
+        'alert_message': latest_data['alert_message'],
+        'alert_level': latest_data['alert_level']
     }
 
     return jsonify({
@@ -662,46 +1188,146 @@ def get_latest_hardware_data():
 def check_hardware_status():
     """API endpoint to check if hardware has sent recent data"""
     # Check if there's data from the last 60 seconds
-    sixty_seconds_ago = datetime.utcnow() - timedelta(seconds=60)
-    recent_data = EnergyData.query.filter(
-        EnergyData.timestamp >= sixty_seconds_ago
-    ).first()
+    recent_data = get_recent_reading()
 
     has_recent_data = recent_data is not None
 
     return jsonify({
         'status': 'success',
         'has_recent_data': has_recent_data,
-        'last_data_time': recent_data.timestamp.isoformat() if recent_data else None
+        'last_data_time': recent_data['timestamp'].isoformat() if recent_data else None
+    })
+
+
+@app.route('/api/energy')
+@login_required
+@use_reader
+def query_energy_data():
+    """API endpoint returning a facility's readings or rollups over a time range as columns"""
+    try:
+        facility_id = request.args.get('facility_id', type=int) or get_default_facility_id()
+        end = parse_time(request.args['end'], 'end') if request.args.get('end') else datetime.utcnow()
+        start = parse_time(request.args['start'], 'start') if request.args.get('start') else end - timedelta(days=1)
+        if start >= end:
+            raise QueryError('start must be before end')
+
+        resolution_name = request.args.get('resolution', 'raw')
+        if resolution_name not in QUERY_RESOLUTIONS:
+            raise QueryError(f'Invalid resolution: {resolution_name} (use one of {", ".join(QUERY_RESOLUTIONS)})')
+        resolution = QUERY_RESOLUTIONS[resolution_name]
+        fields = parse_fields(request.args.get('fields'), resolution)
+
+        limit = request.args.get('limit', app.config["ENERGY_API_PAGE_SIZE"], type=int)
+        limit = max(1, min(limit, app.config["ENERGY_API_MAX_PAGE_SIZE"]))
+
+        if resolution:
+            # Fold in readings that arrived since the last scheduled rollup run
+            with using_writer():
+                catch_up_rollups()
+        data, next_cursor = query_energy(facility_id, start, end, resolution, fields, limit,
+                                         request.args.get('cursor'), packed_before())
+    except QueryError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    return jsonify({
+        'status': 'success',
+        'facility_id': facility_id,
+        'resolution': resolution_name,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'fields': fields,
+        'count': len(data['timestamp']),
+        'data': data,
+        'next_cursor': next_cursor
+    })
+
+
+@app.route('/api/export')
+@login_required
+@use_reader
+def export_energy_data():
+    """API endpoint streaming a facility's readings over a time range as CSV or NDJSON"""
+    try:
+        facility_id = request.args.get('facility_id', type=int) or get_default_facility_id()
+        end = parse_time(request.args['end'], 'end') if request.args.get('end') else None
+        start = parse_time(request.args['start'], 'start') if request.args.get('start') else \
+            (end or datetime.utcnow()) - timedelta(days=30)
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            raise QueryError(f'Invalid format: {fmt} (use csv or ndjson)')
+    except QueryError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    compress = request.args.get('gzip', '').lower() in ("1", "true", "yes")
+    filename = export_filename(facility_id, start, end, fmt, compress)
+    body = iter_export(facility_id, start, end, fmt, compress, app.config["EXPORT_CHUNK_SIZE"], packed_before())
+    return Response(stream_with_context(stream_from_reader(body)),
+                    mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/api/stream/facility/<int:facility_id>')
+@login_required
+def stream_facility(facility_id):
+    """Server-Sent Events stream of new readings and alerts for a facility"""
+    if not app.config["LIVE_STREAM_ENABLED"]:
+        return jsonify({
+            'status': 'error',
+            'message': 'Live stream disabled'
+        }), 503
+
+    # Browsers send Last-Event-ID when reconnecting; events still in the backlog are replayed
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    try:
+        subscription = live_events.subscribe(facility_id, last_event_id)
+    except StreamFull as e:
+        # The dashboard falls back to polling when the stream cannot be opened
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503
+
+    # Fresh connections start from a snapshot of the current state
+    initial = []
+    if last_event_id is None:
+        latest = latest_readings.get(facility_id)
+        recent = latest and latest['timestamp'] >= datetime.utcnow() - timedelta(seconds=60)
+        initial.append(('status', {'has_recent_data': bool(recent)}))
+        if recent:
+            initial.append(('reading', latest))
+
+    # The stream must not hold a database connection while it waits for events
+    db.session.remove()
+    stream = live_events.stream(subscription, app.config["LIVE_STREAM_MAX_SECONDS"], initial)
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # disable proxy buffering (nginx)
     })
 
 
 @app.route('/api/predictions')
 @login_required
+@use_reader
+@conditional_get(lambda: reading_watermark(latest_readings.get()), version=predictions_version)
+@response_cache.cached(lambda: reading_watermark(latest_readings.get()), version=predictions_version)
 def get_predictions():
     """Get energy consumption predictions for the next 24 hours"""
-    # Get historical data for training the model
-    days_for_training = 30
-    time_ago = datetime.utcnow() - timedelta(days=days_for_training)
-    historical_data = EnergyData.query.filter(EnergyData.timestamp >= time_ago).order_by(EnergyData.timestamp).all()
-
-    # Convert to list of dictionaries for the predictor
-    data_points = []
-    for data in historical_data:
-        data_points.append({
-            'timestamp': data.timestamp,
-            'energy_produced': data.energy_produced,
-            'energy_consumed': data.energy_consumed,
-            'efficiency': data.efficiency,
-            'current_load': data.current_load
-        })
-
-    # Train the predictor if we have enough data
-    if len(data_points) > 24:
-        predictor.train(data_points)
+    # The model is trained in the background (run_training_job); only the last day is read here
+    data_points = get_recent_hours(24)
 
     # Get predictions for the next 24 hours
-    predictions = predictor.predict(data_points, horizon=24)
+    predictions = model_store.get().predict(data_points, horizon=24)
 
     # Generate timestamps for predictions
     last_timestamp = datetime.utcnow()
@@ -739,35 +1365,35 @@ def debug_test_hardware():
                 }), 404
 
             # Create test data
-            energy_data = EnergyData(
-                timestamp=datetime.utcnow(),
-                energy_produced=75.5,
-                energy_consumed=62.3,
-                efficiency=83.2,
-                current_load=35.8,
-                facility_id=facility.id,
-                voltage=220.5,
-                current=15.2,
-                current1=5.1,
-                current2=5.0,
-                current3=5.1,
-                frequency=50.0,
-                power_factor=0.95,
-                alert_message=None,
-                alert_level=None
-            )
+            reading = {
+                'timestamp': datetime.utcnow(),
+                'energy_produced': 75.5,
+                'energy_consumed': 62.3,
+                'efficiency': 83.2,
+                'current_load': 35.8,
+                'facility_id': facility.id,
+                'voltage': 220.5,
+                'current': 15.2,
+                'current1': 5.1,
+                'current2': 5.0,
+                'current3': 5.1,
+                'frequency': 50.0,
+                'power_factor': 0.95,
+                'alert_message': None,
+                'alert_level': None
+            }
 
-            db.session.add(energy_data)
-            db.session.commit()
+            reading['id'], = bulk_insert_readings([reading])
+            distribute_readings([reading])
 
             return jsonify({
                 'status': 'success',
                 'message': 'Test hardware data created',
                 'data': {
-                    'id': energy_data.id,
-                    'timestamp': energy_data.timestamp.isoformat(),
-                    'voltage': energy_data.voltage,
-                    'current': energy_data.current
+                    'id': reading['id'],
+                    'timestamp': reading['timestamp'].isoformat(),
+                    'voltage': reading['voltage'],
+                    'current': reading['current']
                 }
             })
 
@@ -848,29 +1474,29 @@ def debug_voltage_demo():
                 efficiency = 0
 
             # Create a new energy data record
-            energy_data = EnergyData(
-                timestamp=datetime.utcnow(),
-                energy_produced=energy_produced,
-                energy_consumed=energy_consumed,
-                efficiency=efficiency,
-                current_load=current_load,
-                facility_id=facility.id,
-                voltage=voltage,
-                current=current,
-                frequency=frequency,
-                power_factor=power_factor,
-                alert_message=alert_message,
-                alert_level=alert_level
-            )
+            reading = {
+                'timestamp': datetime.utcnow(),
+                'energy_produced': energy_produced,
+                'energy_consumed': energy_consumed,
+                'efficiency': efficiency,
+                'current_load': current_load,
+                'facility_id': facility.id,
+                'voltage': voltage,
+                'current': current,
+                'frequency': frequency,
+                'power_factor': power_factor,
+                'alert_message': alert_message,
+                'alert_level': alert_level
+            }
 
-            db.session.add(energy_data)
-            db.session.commit()
+            reading['id'], = bulk_insert_readings([reading])
+            distribute_readings([reading])
 
             response = {
                 'status': 'success',
                 'message': f'Voltage demo data generated ({condition})',
                 'data': {
-                    'timestamp': energy_data.timestamp.isoformat(),
+                    'timestamp': reading['timestamp'].isoformat(),
                     'voltage': voltage,
                     'current': current,
                     'frequency': frequency,
@@ -931,124 +1557,77 @@ def receive_hardware_data():
                 'message': 'Invalid API key'
             }), 401
 
-        # Validate the incoming data
+        # Validate the incoming data and compute derived fields
         data = request.json
-        if not data:
+        default_facility_id = None
+        if isinstance(data, dict) and not data.get('facility_id'):
+            default_facility_id = get_default_facility_id()
+
+        try:
+            reading = build_reading(data, default_facility_id, timestamp=datetime.utcnow())
+        except ReadingError as e:
             return jsonify({
                 'status': 'error',
-                'message': 'No data provided'
+                'message': str(e)
             }), 400
 
-        # Extract required sensor data fields
-        required_fields = ['energy_produced', 'energy_consumed', 'current_load']
-        for field in required_fields:
-            if field not in data:
+        if ingest_log:
+            # Durable log mode: acknowledge once the reading is fsynced; the replayer stores it
+            try:
+                ingest_log.wait_durable(ingest_log.append(reading))
+            except IngestLogError as e:
                 return jsonify({
                     'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }), 400
-
-        # Extract data fields with validation
-        energy_produced = float(data.get('energy_produced', 0))
-        energy_consumed = float(data.get('energy_consumed', 0))
-        current_load = float(data.get('current_load', 0))
-
-        # Extract optional but important electrical parameters
-        voltage = float(data.get('voltage', 0))
-        current = float(data.get('current', 0))  # Backward compatibility
-        current1 = float(data.get('current1', 0))  # Phase 1 current
-        current2 = float(data.get('current2', 0))  # Phase 2 current
-        current3 = float(data.get('current3', 0))  # Phase 3 current
-        frequency = float(data.get('frequency', 0))
-        power_factor = float(data.get('power_factor', 0))
-
-        # Calculate total current if individual phase currents are provided
-        if current1 > 0 or current2 > 0 or current3 > 0:
-            current = current1 + current2 + current3
-
-        # Calculate efficiency (as percentage for storage, will be converted to decimal in display)
-        if energy_produced > 0:
-            efficiency = min(100, (energy_consumed / energy_produced) * 100)
-        else:
-            efficiency = 0
+                    'message': str(e)
+                }), 503
 
-        # Get the facility ID from request or use the default
-        facility_id = data.get('facility_id')
-        if not facility_id:
-            # Get the default facility
-            facility = Facility.query.first()
-            if not facility:
+            response = {
+                'status': 'success',
+                'message': 'Data logged for storage',
+                'data_id': None
+            }
+        elif ingest_buffer:
+            # Write-behind mode: queue the reading and let the background flusher store it
+            try:
+                ingest_buffer.submit(reading)
+            except BufferFull as e:
                 return jsonify({
                     'status': 'error',
-                    'message': 'No facility configured'
-                }), 400
-            facility_id = facility.id
-
-        # Analyze voltage conditions and create alerts if necessary
-        alert_message = None
-        alert_level = None
-
-        if voltage > 0:  # Only check if voltage data is provided
-            # These thresholds would be configurable in a real system
-            nominal_voltage = 220  # This could be pulled from facility settings
-            high_voltage_threshold = nominal_voltage * 1.1  # 10% above nominal
-            low_voltage_threshold = nominal_voltage * 0.9   # 10% below nominal
-            critical_high_threshold = nominal_voltage * 1.15 # 15% above nominal
-            critical_low_threshold = nominal_voltage * 0.85  # 15% below nominal
-
-            if voltage >= critical_high_threshold:
-                alert_message = f"CRITICAL HIGH VOLTAGE DETECTED: {voltage:.1f}V"
-                alert_level = "critical"
-                logger.warning(f"Critical high voltage detected: {voltage:.1f}V")
-            elif voltage >= high_voltage_threshold:
-                alert_message = f"High voltage condition: {voltage:.1f}V"
-                alert_level = "warning"
-                logger.info(f"High voltage condition: {voltage:.1f}V")
-            elif voltage <= critical_low_threshold:
-                alert_message = f"CRITICAL LOW VOLTAGE DETECTED: {voltage:.1f}V"
-                alert_level = "critical"
-                logger.warning(f"Critical low voltage detected: {voltage:.1f}V")
-            elif voltage <= low_voltage_threshold:
-                alert_message = f"Low voltage condition: {voltage:.1f}V"
-                alert_level = "warning"
-                logger.info(f"Low voltage condition: {voltage:.1f}V")
-
-        # Create a new energy data record with additional electrical parameters
-        energy_data = EnergyData(
-            timestamp=datetime.utcnow(),
-            energy_produced=energy_produced,
-            energy_consumed=energy_consumed,
-            efficiency=efficiency,
-            current_load=current_load,
-            facility_id=facility_id,
-            voltage=voltage if voltage > 0 else None,
-            current=current if current > 0 else None,
-            current1=current1 if current1 > 0 else None,
-            current2=current2 if current2 > 0 else None,
-            current3=current3 if current3 > 0 else None,
-            frequency=frequency if frequency > 0 else None,
-            power_factor=power_factor if power_factor > 0 else None,
-            alert_message=alert_message,
-            alert_level=alert_level
-        )
+                    'message': str(e)
+                }), 429, {'Retry-After': '1'}
 
-        # Save to database
-        db.session.add(energy_data)
-        db.session.commit()
+            response = {
+                'status': 'success',
+                'message': 'Data queued for storage',
+                'data_id': None
+            }
+        else:
+            # Create a new energy data record with additional electrical parameters
+            energy_data = EnergyData(**reading)
 
-        logger.info(f"Received hardware data: produced={energy_produced}, consumed={energy_consumed}, voltage={voltage}")
+            # Save to database
+            db.session.add(energy_data)
+            record_day_stats([reading])
+            db.session.commit()
 
-        # Prepare response with alert information if applicable
-        response = {
-            'status': 'success',
-            'message': 'Data received successfully',
-            'data_id': energy_data.id
-        }
+            reading['id'] = energy_data.id
 
-        if alert_message:
+            # Prepare response with alert information if applicable
+            response = {
+                'status': 'success',
+                'message': 'Data received successfully',
+                'data_id': energy_data.id
+            }
+
+        distribute_readings([reading])
+
+        logger.info(f"Received hardware data: produced={reading['energy_produced']}, "
+                    f"consumed={reading['energy_consumed']}, voltage={reading['voltage']}")
+
+        if reading['alert_message']:
             response['alert'] = {
-                'message': alert_message,
-                'level': alert_level
+                'message': reading['alert_message'],
+                'level': reading['alert_level']
             }
 
         return jsonify(response)
@@ -1061,6 +1640,155 @@ def receive_hardware_data():
         }), 500
 
 
+def distribute_readings(readings):
+    """
+    Pass newly received readings to the online model, the latest-reading cache (or shared
+    ring) and the live dashboards; every insert path calls this once the readings are accepted
+    readings: reading dicts whose id is None while they wait in the ingest log or write-behind queue
+    """
+    # Model first: once the latest cache moves, responses are keyed by the new reading
+    update_model(readings)
+    latest_readings.update_many(readings)
+    publish_batch(readings)
+
+
+def publish_batch(readings):
+    """Push the newest reading of each facility in a batch, plus every alert, to live dashboards"""
+    newest = {}
+    for reading in readings:
+        if reading['alert_message']:
+            live_events.publish_reading(reading)
+        current = newest.get(reading['facility_id'])
+        if current is None or reading['timestamp'] >= current['timestamp']:
+            newest[reading['facility_id']] = reading
+    for reading in newest.values():
+        if not reading['alert_message']:
+            live_events.publish_reading(reading)
+
+
+@app.route('/api/hardware/data/batch', methods=['POST'])
+def receive_hardware_data_batch():
+    """API endpoint to receive a batch of buffered readings from IoT hardware sensors"""
+    try:
+        # Get API key from headers for authentication
+        api_key = request.headers.get('X-API-Key')
+
+        # Check if the API key is valid
+        if not api_key or api_key != os.environ.get('HARDWARE_API_KEY', 'dev_hardware_key'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Authentication failed'
+            }), 401
+
+        # Accept either a bare array or {"facility_id": ..., "readings": [...]}
+        payload = request.get_json(silent=True)
+        batch_facility_id = None
+        if isinstance(payload, dict):
+            batch_facility_id = payload.get('facility_id')
+            payload = payload.get('readings')
+
+        if not isinstance(payload, list) or not payload:
+            return jsonify({
+                'status': 'error',
+                'message': 'Expected a non-empty array of readings'
+            }), 400
+
+        max_readings = app.config['HARDWARE_BATCH_MAX_READINGS']
+        if len(payload) > max_readings:
+            return jsonify({
+                'status': 'error',
+                'message': f'Batch too large: {len(payload)} readings (maximum {max_readings})'
+            }), 413
+
+        # Resolve the default facility once for the whole batch
+        default_facility_id = batch_facility_id or get_default_facility_id()
+
+        # Validate every reading in one pass, keeping per-item results
+        results = []
+        readings = []
+        for index, item in enumerate(payload):
+            try:
+                # Device-side timestamps are honoured, defaulting to server time
+                readings.append(build_reading(item, default_facility_id))
+                results.append({'index': index, 'status': 'success'})
+            except ReadingError as e:
+                results.append({'index': index, 'status': 'error', 'message': str(e)})
+
+        # Store the valid readings like single ones: durable log, write-behind queue or one bulk insert
+        data_ids = [None] * len(readings)
+        stored = 'stored'
+        if readings and ingest_log:
+            try:
+                ingest_log.wait_durable(ingest_log.append_many(readings))
+            except IngestLogError as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 503
+            stored = 'logged for storage'
+        elif readings and ingest_buffer:
+            try:
+                ingest_buffer.submit_many(readings)
+            except BufferFull as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 429, {'Retry-After': '1'}
+            stored = 'queued for storage'
+        elif readings:
+            data_ids = bulk_insert_readings(readings)
+
+        distribute_readings([dict(reading, id=data_id) for data_id, reading in zip(data_ids, readings)])
+
+        accepted = iter(zip(data_ids, readings))
+        for result in results:
+            if result['status'] != 'success':
+                continue
+            data_id, reading = next(accepted)
+            result['data_id'] = data_id
+            if reading['alert_message']:
+                result['alert'] = {
+                    'message': reading['alert_message'],
+                    'level': reading['alert_level']
+                }
+
+        logger.info(f"Received hardware batch: {len(readings)} accepted, {len(payload) - len(readings)} rejected")
+
+        return jsonify({
+            'status': 'success' if readings else 'error',
+            'message': f'{len(readings)} of {len(payload)} readings {stored}',
+            'accepted': len(readings),
+            'rejected': len(payload) - len(readings),
+            'results': results
+        }), 200 if readings else 400
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error processing hardware batch: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+
+@app.route('/api/ingest/stats')
+@login_required
+def get_ingest_stats():
+    """API endpoint exposing ingest buffer / log, latest-reading cache, live stream and response cache counters"""
+    stats = {
+        'status': 'success',
+        'write_behind': bool(ingest_buffer),
+        'latest_cache': latest_readings.get_stats(),
+        'live_stream': live_events.get_stats(),
+        'response_cache': response_cache.get_stats()
+    }
+    if ingest_buffer:
+        stats['stats'] = ingest_buffer.get_stats()
+    if ingest_log:
+        stats['ingest_log'] = {'directory': ingest_log.directory, 'rejected': log_replayer.rejected}
+    return jsonify(stats)
+
+
 @app.route('/api/hardware/status', methods=['GET'])
 def get_hardware_status():
     """API endpoint to check hardware connectivity"""
@@ -1140,5 +1868,70 @@ def get_hardware_config():
         }), 500
 
 
+# Command line tools (run with `flask --app main <command>`)
+
+@app.cli.command('export-readings')
+@click.option('--facility-id', type=int, help='Facility to export (default: the first facility)')
+@click.option('--start', required=True, help='ISO-8601 start time (inclusive)')
+@click.option('--end', help='ISO-8601 end time (exclusive, default: now)')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip')
+@click.option('--output', '-o', default='-', help='Output file (default: stdout)')
+def export_readings_command(facility_id, start, end, fmt, compress, output):
+    """Stream a facility's readings over a time range to a CSV or NDJSON file"""
+    try:
+        start = parse_time(start, 'start')
+        end = parse_time(end, 'end') if end else None
+    except QueryError as e:
+        raise click.BadParameter(str(e))
+    facility_id = facility_id or get_default_facility_id()
+
+    started = time.perf_counter()
+    written = 0
+    target = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for data in iter_export(facility_id, start, end, fmt, compress, app.config["EXPORT_CHUNK_SIZE"],
+                                packed_before()):
+            target.write(data)
+            written += len(data)
+    finally:
+        if target is not sys.stdout.buffer:
+            target.close()
+    click.echo(f"Exported facility {facility_id}: {written / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s",
+               err=True)
+
+
+@app.cli.command('rebuild-day-stats')
+def rebuild_day_stats_command():
+    """Recompute the per-day statistics from the stored readings"""
+    started = time.perf_counter()
+    scanned = rebuild_day_stats(complete_from=raw_complete_from())
+    click.echo(f"Rebuilt day stats from {scanned} readings in {time.perf_counter() - started:.1f}s")
+
+
+@app.cli.command('import-readings')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--facility-id', type=int, help='Facility for rows without a facility_id column (default: the first)')
+@click.option('--chunk-size', type=int, default=50000, show_default=True)
+@click.option('--restart', is_flag=True, help='Ignore the progress of an earlier, interrupted run')
+def import_readings_command(path, facility_id, chunk_size, restart):
+    """Bulk import a CSV meter export; resumes an interrupted import of the same file"""
+    started = time.perf_counter()
+
+    def progress(rows_done, accepted, rejected):
+        elapsed = time.perf_counter() - started
+        click.echo(f"{rows_done} rows read, {accepted} imported, {rejected} rejected "
+                   f"({accepted / elapsed:,.0f} rows/s)", err=True)
+
+    try:
+        accepted, rejected, skipped = import_readings(path, facility_id, chunk_size, restart, progress)
+    except MeterImportError as e:
+        raise click.ClickException(str(e))
+
+    if skipped:
+        click.echo(f"Skipped {skipped} rows imported by an earlier run", err=True)
+    click.echo(f"Imported {accepted} readings, rejected {rejected} in {time.perf_counter() - started:.1f}s")
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
@@ -0,0 +1,401 @@
+"""
+Columnar cold archive for historical readings
+
+Readings older than a configurable age are moved out of energy_data into
+one segment file per facility and month.  A segment is a small JSON header
+followed by one contiguous, 64-byte aligned array per column, so it can be
+opened with numpy.memmap and analysed without copying or ORM overhead.
+
+The history readers also take packed_before: without an archive, readings
+before that time are read from the packed energy_block rows instead, since
+retention deletes them from the table once they are packed.
+"""
+import json
+import logging
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, func, tuple_
+
+from models import db, EnergyData, JobWatermark
+from block_encoding import iter_block_windows, load_block_columns, packed_end, packed_id, unpacked_filter
+from retention import delete_in_chunks
+from rollups import WATERMARK_NAME as ROLLUP_WATERMARK
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EARC'
+VERSION = 1
+# Magic, format version and header length precede the JSON header
+PREAMBLE = struct.Struct('<4sHI')
+ALIGNMENT = 64
+
+# Archived columns and their on-disk types; missing values are stored as NaN
+ARCHIVE_COLUMNS = [
+    ('timestamp', 'datetime64[us]'),
+    ('id', 'int64'),
+    ('energy_produced', 'float32'),
+    ('energy_consumed', 'float32'),
+    ('efficiency', 'float32'),
+    ('current_load', 'float32'),
+    ('voltage', 'float32'),
+    ('current', 'float32'),
+    ('current1', 'float32'),
+    ('current2', 'float32'),
+    ('current3', 'float32'),
+    ('frequency', 'float32'),
+    ('power_factor', 'float32'),
+    ('alert_level', 'int8'),
+]
+
+# alert_level is stored as a small code.  alert_message is not archived: it only depends on
+# the voltage, so readers that need it can call ingest.describe_voltage on the voltage column
+ALERT_LEVELS = [None, 'info', 'warning', 'critical']
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def segment_path(directory, facility_id, year, month):
+    """Return the path of the archive segment for a facility and month"""
+    return os.path.join(directory, f'facility-{facility_id}', f'{year:04d}-{month:02d}.seg')
+
+
+class ArchiveSegment:
+    """
+    A read-only, memory-mapped archive segment
+    Column arrays are numpy.memmap views into the file, sorted by timestamp.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'Not an archive segment: {path}')
+            self.header = json.loads(f.read(header_length))
+
+        self.facility_id = self.header['facility_id']
+        self.rows = self.header['rows']
+        self.columns = {}
+        for column in self.header['columns']:
+            if self.rows:
+                self.columns[column['name']] = np.memmap(
+                    path, dtype=column['dtype'], mode='r', offset=column['offset'], shape=(self.rows,)
+                )
+            else:
+                self.columns[column['name']] = np.empty(0, dtype=column['dtype'])
+
+    def time_slice(self, start=None, end=None):
+        """Return column views limited to start <= timestamp < end (no copy)"""
+        timestamps = self.columns['timestamp']
+        lo = 0 if start is None else np.searchsorted(timestamps, np.datetime64(start, 'us'), side='left')
+        hi = self.rows if end is None else np.searchsorted(timestamps, np.datetime64(end, 'us'), side='left')
+        return {name: values[lo:hi] for name, values in self.columns.items()}
+
+
+def write_segment(path, facility_id, columns):
+    """
+    Atomically write a segment file from a dict of column arrays
+    Rows are sorted by timestamp before writing.
+    """
+    order = np.argsort(columns['timestamp'], kind='stable')
+    rows = len(order)
+
+    header = {'version': VERSION, 'facility_id': facility_id, 'rows': rows, 'columns': []}
+    # Header size depends on the offsets it contains; reserve a generous fixed block
+    offset = _align(PREAMBLE.size + 4096)
+    arrays = []
+    for name, dtype in ARCHIVE_COLUMNS:
+        array = np.ascontiguousarray(np.asarray(columns[name])[order].astype(dtype))
+        header['columns'].append({'name': name, 'dtype': np.dtype(dtype).str, 'offset': offset})
+        arrays.append((offset, array))
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    if PREAMBLE.size + len(header_bytes) > arrays[0][0]:
+        raise ValueError('Archive header too large')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for array_offset, array in arrays:
+            f.seek(array_offset)
+            f.write(array.tobytes())
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_segments(directory, facility_id, start=None, end=None):
+    """Return the segment paths of a facility overlapping [start, end), oldest first"""
+    facility_dir = os.path.join(directory, f'facility-{facility_id}')
+    if not os.path.isdir(facility_dir):
+        return []
+
+    paths = []
+    for filename in sorted(os.listdir(facility_dir)):
+        if not filename.endswith('.seg'):
+            continue
+        year, month = (int(part) for part in filename[:-4].split('-'))
+        month_start = datetime(year, month, 1)
+        month_end = datetime(year + month // 12, month % 12 + 1, 1)
+        if (end is None or month_start < end) and (start is None or month_end > start):
+            paths.append(os.path.join(facility_dir, filename))
+    return paths
+
+
+def _rows_to_columns(rows):
+    """Convert (timestamp, id, metrics..., alert_level) tuples into archive column arrays"""
+    columns = {name: [] for name, _ in ARCHIVE_COLUMNS}
+    for row in rows:
+        for (name, _), value in zip(ARCHIVE_COLUMNS, row):
+            columns[name].append(value)
+
+    result = {
+        'timestamp': np.array(columns['timestamp'], dtype='datetime64[us]'),
+        'id': np.array(columns['id'], dtype=np.int64),
+        'alert_level': np.array([ALERT_LEVELS.index(level) if level in ALERT_LEVELS else 0
+                                 for level in columns['alert_level']], dtype=np.int8)
+    }
+    for name, dtype in ARCHIVE_COLUMNS:
+        if dtype == 'float32':
+            result[name] = np.array(columns[name], dtype=np.float64)  # None becomes NaN
+    return result
+
+
+def _already_archived(existing, columns):
+    """
+    Mask of the rows in columns that an existing segment already holds
+    Rows match on id and timestamp, since SQLite can hand out the id of a deleted row again
+    """
+    existing_ids = np.asarray(existing['id'])
+    if not len(existing_ids):
+        return np.zeros(len(columns['id']), dtype=bool)
+    order = np.argsort(existing_ids, kind='stable')
+    candidates = order[np.minimum(np.searchsorted(existing_ids, columns['id'], sorter=order), len(order) - 1)]
+    return (existing_ids[candidates] == columns['id']) & \
+        (np.asarray(existing['timestamp'])[candidates] == columns['timestamp'])
+
+
+def _select_columns():
+    return [getattr(EnergyData, name) for name, _ in ARCHIVE_COLUMNS]
+
+
+def archive_cold_data(directory, older_than_days, chunk_size=5000):
+    """
+    Move whole months of readings older than older_than_days into archive segments
+    Only readings already folded into the rollups are moved.  Late readings for an
+    already archived month are merged into its segment; rows whose id the segment
+    already holds with the same timestamp (left behind by a run interrupted before
+    its delete finished) are only deleted, never archived twice.
+    Must be called inside an application context.
+    Returns: number of readings archived
+    """
+    now = datetime.utcnow()
+    cutoff_day = datetime.fromordinal(now.toordinal() - older_than_days)
+    cutoff = datetime(cutoff_day.year, cutoff_day.month, 1)  # archive whole months only
+
+    watermark = db.session.get(JobWatermark, ROLLUP_WATERMARK)
+    rolled_up_id = watermark.last_id if watermark else 0
+    eligible = [EnergyData.timestamp < cutoff, EnergyData.id <= rolled_up_id]
+
+    archived = 0
+    facilities = db.session.execute(select(EnergyData.facility_id).where(*eligible).distinct()).scalars().all()
+    for facility_id in facilities:
+        oldest = db.session.execute(
+            select(func.min(EnergyData.timestamp)).where(EnergyData.facility_id == facility_id, *eligible)
+        ).scalar()
+        year, month = oldest.year, oldest.month
+
+        while datetime(year, month, 1) < cutoff:
+            month_start = datetime(year, month, 1)
+            month_end = datetime(year + month // 12, month % 12 + 1, 1)
+            month_filter = [
+                EnergyData.facility_id == facility_id,
+                EnergyData.timestamp >= month_start,
+                EnergyData.timestamp < month_end,
+                *eligible
+            ]
+            rows = db.session.execute(select(*_select_columns()).where(*month_filter)).all()
+
+            if rows:
+                columns = _rows_to_columns(rows)
+                path = segment_path(directory, facility_id, year, month)
+                new_rows = len(rows)
+                if os.path.exists(path):
+                    # Merge late readings into the existing segment
+                    existing = ArchiveSegment(path).columns
+                    new = ~_already_archived(existing, columns)
+                    new_rows = int(new.sum())
+                    if new_rows:
+                        columns = {name: np.concatenate([np.asarray(existing[name]), columns[name][new]])
+                                   for name, _ in ARCHIVE_COLUMNS}
+                if new_rows:
+                    write_segment(path, facility_id, columns)
+
+                # The segment is on disk; now remove the rows from the live table
+                delete_in_chunks(EnergyData, month_filter, chunk_size, pause=0.05)
+                archived += new_rows
+                logger.info(f"Archived {new_rows} readings of facility {facility_id} for {year:04d}-{month:02d}"
+                            + (f" ({len(rows) - new_rows} already archived)" if new_rows < len(rows) else ""))
+
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return archived
+
+
+def load_archive_columns(directory, facility_id, start=None, end=None):
+    """
+    Read archived readings of a facility in [start, end) as column arrays
+    A single segment is returned as memmap views; several are concatenated.
+    """
+    slices = [ArchiveSegment(path).time_slice(start, end)
+              for path in list_segments(directory, facility_id, start, end)]
+    slices = [s for s in slices if len(s['timestamp'])]
+    if not slices:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in ARCHIVE_COLUMNS}
+    if len(slices) == 1:
+        return slices[0]
+    return {name: np.concatenate([s[name] for s in slices]) for name, _ in ARCHIVE_COLUMNS}
+
+
+def load_history_columns(directory, facility_id, start, end=None, packed_before=None):
+    """
+    Stitch archived (or packed) and live readings of a facility in [start, end) into column
+    arrays sorted by timestamp (the layout accepted by analyze_trends and EnergyPredictor.train)
+    """
+    archived = load_archive_columns(directory, facility_id, start, end) if directory else None
+
+    live_filter = _live_filter(facility_id, start, end)
+    blocks_end = None if directory else packed_end(start, end, packed_before)
+    if blocks_end is not None:
+        packed = packed_id()
+        archived = load_block_columns(facility_id, start, blocks_end, packed)
+        live_filter.append(unpacked_filter(packed_before, packed))
+    live = _rows_to_columns(db.session.execute(
+        select(*_select_columns()).where(*live_filter).order_by(EnergyData.timestamp)
+    ).all())
+
+    if archived is None or not len(archived['timestamp']):
+        return live
+    if not len(live['timestamp']):
+        return archived
+
+    columns = {name: np.concatenate([np.asarray(archived[name]), live[name]]) for name, _ in ARCHIVE_COLUMNS}
+    # Late readings can sit in the live table next to an archived month, so re-sort
+    order = np.argsort(columns['timestamp'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+
+# Columns read by the streaming /historical pipeline
+HISTORY_COLUMNS = ['timestamp', 'energy_produced', 'energy_consumed', 'efficiency', 'current_load']
+
+
+def _live_filter(facility_id, start, end):
+    conditions = [EnergyData.facility_id == facility_id, EnergyData.timestamp >= start]
+    if end is not None:
+        conditions.append(EnergyData.timestamp < end)
+    return conditions
+
+
+def history_summary(directory, facility_id, start, end=None, packed_before=None):
+    """
+    Count and mean consumption of a facility's readings in [start, end), archive (or blocks) included
+    Computed by SQLite/numpy without loading the readings into Python objects.
+    Returns: (count, mean energy_consumed or None)
+    """
+    conditions = _live_filter(facility_id, start, end)
+    blocks_end = None if directory else packed_end(start, end, packed_before)
+    if blocks_end is not None:
+        packed = packed_id()
+        conditions.append(unpacked_filter(packed_before, packed))
+    count, total = db.session.execute(
+        select(func.count(EnergyData.id), func.sum(EnergyData.energy_consumed)).where(*conditions)
+    ).one()
+    count, total = count or 0, total or 0.0
+
+    if blocks_end is not None:
+        for columns in iter_block_windows(facility_id, start, blocks_end, packed):
+            consumed = columns['energy_consumed']
+            count += len(consumed)
+            total += float(np.nansum(consumed))
+
+    if directory:
+        for path in list_segments(directory, facility_id, start, end):
+            consumed = ArchiveSegment(path).time_slice(start, end)['energy_consumed']
+            count += len(consumed)
+            total += float(np.sum(consumed, dtype=np.float64))
+
+    return count, (total / count if count else None)
+
+
+def iter_history_chunks(directory, facility_id, start, end=None, chunk_size=20000, packed_before=None):
+    """
+    Yield a facility's readings in [start, end) as HISTORY_COLUMNS arrays of at most chunk_size rows
+    Archived months (sliced from the memory maps) or packed blocks come first, then the live
+    table is read with keyset pagination on (timestamp, id).  Late readings not yet merged into
+    an archived month or packed are yielded with the live rows.
+    """
+    conditions = _live_filter(facility_id, start, end)
+    if directory:
+        cold = (ArchiveSegment(path).time_slice(start, end)
+                for path in list_segments(directory, facility_id, start, end))
+    else:
+        blocks_end = packed_end(start, end, packed_before)
+        cold = ()
+        if blocks_end is not None:
+            packed = packed_id()
+            cold = iter_block_windows(facility_id, start, blocks_end, packed)
+            conditions.append(unpacked_filter(packed_before, packed))
+    for columns in cold:
+        for offset in range(0, len(columns['timestamp']), chunk_size):
+            yield {name: np.asarray(columns[name][offset:offset + chunk_size]) for name in HISTORY_COLUMNS}
+
+    selected = [getattr(EnergyData, name) for name in HISTORY_COLUMNS] + [EnergyData.id]
+    last_key = None
+    while True:
+        query = select(*selected).where(*conditions)
+        if last_key is not None:
+            query = query.where(tuple_(EnergyData.timestamp, EnergyData.id) > last_key)
+        rows = db.session.execute(
+            query.order_by(EnergyData.timestamp, EnergyData.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+
+        *values, ids = zip(*rows)
+        chunk = {'timestamp': np.array(values[0], dtype='datetime64[us]')}
+        for name, column in zip(HISTORY_COLUMNS[1:], values[1:]):
+            chunk[name] = np.array(column, dtype=np.float64)  # None becomes NaN
+        yield chunk
+
+        last_key = (rows[-1].timestamp, ids[-1])
+        if len(rows) < chunk_size:
+            return
+
+
+def columns_to_data_points(columns):
+    """Convert column arrays into the per-reading dicts used by the templates"""
+    return [
+        {
+            'timestamp': timestamp,
+            'energy_produced': produced,
+            'energy_consumed': consumed,
+            'efficiency': efficiency,
+            'current_load': load
+        }
+        for timestamp, produced, consumed, efficiency, load in zip(
+            np.asarray(columns['timestamp']).astype('datetime64[us]').astype(object),
+            np.asarray(columns['energy_produced'], dtype=np.float64).tolist(),
+            np.asarray(columns['energy_consumed'], dtype=np.float64).tolist(),
+            np.asarray(columns['efficiency'], dtype=np.float64).tolist(),
+            np.asarray(columns['current_load'], dtype=np.float64).tolist()
+        )
+    ]
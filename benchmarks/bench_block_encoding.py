@@ -0,0 +1,100 @@
+"""
+Benchmark the compressed block encoding against the raw energy_data table
+
+Reports bytes per reading (raw SQLite table and indexes vs. encoded blocks)
+and read throughput (SELECT of the raw rows vs. decoding the blocks).
+
+    python -m benchmarks.bench_block_encoding --rows 1000000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from sqlalchemy import select, text
+
+from models import EnergyData
+from block_encoding import COLUMN_SCALES, encode_block, decode_block
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, load_synthetic_rows, best_of, format_rate
+
+
+def raw_bytes(engine):
+    """Size of the SQLite file holding energy_data and its indexes"""
+    with engine.connect() as conn:
+        page_size = conn.execute(text('PRAGMA page_size')).scalar()
+        page_count = conn.execute(text('PRAGMA page_count')).scalar()
+    return page_size * page_count
+
+
+def read_raw(engine):
+    columns = [EnergyData.id, EnergyData.timestamp] + [getattr(EnergyData, name) for name, _ in COLUMN_SCALES]
+    with engine.connect() as conn:
+        return conn.execute(select(*columns)).all()
+
+
+def split_blocks(columns, block_seconds):
+    """Split synthetic column arrays into per-facility, per-window blocks"""
+    epoch = columns['timestamp'].astype('datetime64[s]').astype(np.int64)
+    keys = columns['facility_id'] * (1 << 40) + epoch // block_seconds
+    order = np.argsort(keys, kind='stable')
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+
+    blocks = []
+    for rows in np.split(order, boundaries):
+        # current1..3 are not reported by the synthetic single-phase meters
+        block = {name: columns[name][rows] if name in columns else np.full(len(rows), np.nan)
+                 for name, _ in COLUMN_SCALES}
+        block['timestamp'] = columns['timestamp'][rows]
+        block['id'] = rows + 1  # ids follow the insertion order
+        blocks.append(block)
+    return blocks
+
+
+def run(rows, block_seconds, repeat):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine)
+        columns = load_synthetic_rows(engine, rows, interval_s=5, facilities=3)
+        table_bytes = raw_bytes(engine)
+
+        blocks = split_blocks(columns, block_seconds)
+        started = time.perf_counter()
+        payloads = [encode_block(block) for block in blocks]
+        encode_seconds = time.perf_counter() - started
+        block_bytes = sum(len(payload) for payload in payloads)
+
+        raw_seconds, _ = best_of(lambda: read_raw(engine), repeat)
+        decode_seconds, decoded = best_of(lambda: [decode_block(payload) for payload in payloads], repeat)
+
+        # Values round-trip to the stored precision
+        worst = max(
+            float(np.nanmax(np.abs(decoded_block[name] - block[name])) * scale)
+            if not np.all(np.isnan(block[name])) else 0.0
+            for decoded_block, block in zip(decoded, blocks)
+            for name, scale in COLUMN_SCALES
+        )
+
+        print(f'\n{rows:,} rows, {len(blocks):,} blocks of {block_seconds}s')
+        print(f'{"":24} {"bytes/reading":>14} {"read":>12}')
+        print(f'{"raw table + indexes":24} {table_bytes / rows:14.1f} {format_rate(rows, raw_seconds):>12}')
+        print(f'{"encoded blocks":24} {block_bytes / rows:14.1f} {format_rate(rows, decode_seconds):>12}')
+        print(f'compression {table_bytes / block_bytes:.1f}x, encode {format_rate(rows, encode_seconds)}, '
+              f'max rounding error {worst:.2f} units of stored precision')
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='1000000', help='comma separated row counts')
+    parser.add_argument('--block-seconds', type=int, default=3600)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows, args.block_seconds, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark the /historical statistics from day stats against a scan of the readings
+
+Loads synthetic readings (one every 5 seconds), builds the day stats with
+rebuild_day_stats, then times window_trends against the streaming
+TrendAccumulator pipeline for windows of a few sizes.  The rollups are built
+first: window_trends reads the hourly rollups of the window's first day.
+
+    python -m benchmarks.bench_day_stats --rows 1000000
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from models import db
+from utils import TrendAccumulator
+from archive import history_summary, iter_history_chunks
+from rollups import update_rollups
+from day_stats import rebuild_day_stats, window_trends
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, load_synthetic_rows, best_of
+
+WINDOWS_DAYS = [1, 7, 30]
+
+
+def scan_trends(start):
+    trends = TrendAccumulator(*history_summary(None, 1, start))
+    for chunk in iter_history_chunks(None, 1, start):
+        trends.update(chunk)
+    return trends.result()
+
+
+def run(rows, repeat):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine)
+        load_synthetic_rows(engine, rows, interval_s=5, facilities=1)
+        engine.dispose()
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        app.config['DAY_STATS_ENABLED'] = True
+        db.init_app(app)
+
+        print(f'\n{rows:,} rows ({rows * 5 / 86400:.0f} days)')
+        with app.app_context():
+            update_rollups()
+            started = time.perf_counter()
+            rebuild_day_stats()
+            print(f'rebuild_day_stats: {time.perf_counter() - started:.2f}s')
+
+            print(f'{"window":>8} {"readings":>10} {"scan":>10} {"day stats":>10}')
+            for days in WINDOWS_DAYS:
+                start = datetime.utcnow() - timedelta(days=days)
+                readings = min(rows, days * 86400 // 5)
+                scan_seconds, _ = best_of(lambda: scan_trends(start), repeat)
+                stats_seconds, _ = best_of(lambda: window_trends(None, 1, start), repeat)
+                print(f'{days:>7}d {readings:>10,} {scan_seconds * 1000:8.1f}ms {stats_seconds * 1000:8.1f}ms')
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='1000000', help='comma separated row counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark the streaming export (rows/s, output size and peak memory)
+
+Streams every reading of a facility through iter_export as CSV and NDJSON,
+with and without gzip, discarding the output.  Peak memory is measured with
+tracemalloc on a second run and should stay flat as the row count grows.
+
+    python -m benchmarks.bench_export --rows 1000000
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from models import db
+from export import iter_export
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, load_synthetic_rows, format_rate
+
+
+def drain(fmt, compress, start, chunk_size):
+    size = 0
+    for data in iter_export(1, start, None, fmt, compress, chunk_size):
+        size += len(data)
+    return size
+
+
+def run(rows, chunk_size):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine)
+        load_synthetic_rows(engine, rows, interval_s=5, facilities=1)
+        engine.dispose()
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        db.init_app(app)
+        start = datetime.utcnow() - timedelta(seconds=5 * rows + 60)
+
+        print(f'\n{rows:,} rows, chunks of {chunk_size:,}')
+        print(f'{"format":14} {"rows/s":>12} {"time":>8} {"output":>10} {"peak memory":>12}')
+        with app.app_context():
+            for fmt in ('csv', 'ndjson'):
+                for compress in (False, True):
+                    started = time.perf_counter()
+                    size = drain(fmt, compress, start, chunk_size)
+                    elapsed = time.perf_counter() - started
+
+                    tracemalloc.start()
+                    drain(fmt, compress, start, chunk_size)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                    name = fmt + (' + gzip' if compress else '')
+                    print(f'{name:14} {format_rate(rows, elapsed):>12} {elapsed:7.2f}s '
+                          f'{size / 1e6:8.1f}MB {peak / 1e6:10.1f}MB')
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='1000000', help='comma separated row counts')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark peak memory of the raw /historical pipeline
+
+Compares the original approach (all rows as ORM objects, then a list of
+dicts and five chart lists), the stitched column arrays and the streaming
+pipeline (keyset-paginated chunks feeding TrendAccumulator and
+BucketAccumulator).  Peak memory is measured with tracemalloc.
+
+    python -m benchmarks.bench_historical_memory --rows 1000000
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from models import db, EnergyData
+from utils import analyze_trends, TrendAccumulator
+from downsampling import BucketAccumulator
+from archive import load_history_columns, columns_to_data_points, history_summary, iter_history_chunks, \
+    HISTORY_COLUMNS
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, load_synthetic_rows
+
+CHART_POINTS = 500
+
+
+def orm_pipeline(start, end):
+    rows = EnergyData.query.filter(
+        EnergyData.facility_id == 1, EnergyData.timestamp >= start
+    ).order_by(EnergyData.timestamp).all()
+    data_points = [
+        {
+            'timestamp': row.timestamp,
+            'energy_produced': row.energy_produced,
+            'energy_consumed': row.energy_consumed,
+            'efficiency': row.efficiency,
+            'current_load': row.current_load
+        }
+        for row in rows
+    ]
+    analysis = analyze_trends(data_points)
+    chart = [[d[name] for d in data_points] for name in HISTORY_COLUMNS]
+    return analysis, len(chart[0])
+
+
+def column_pipeline(start, end):
+    columns = load_history_columns(None, 1, start, end)
+    analysis = analyze_trends(columns)
+    data_points = columns_to_data_points(columns)
+    chart = [[d[name] for d in data_points] for name in HISTORY_COLUMNS]
+    return analysis, len(chart[0])
+
+
+def streaming_pipeline(start, end):
+    total, consumption_mean = history_summary(None, 1, start, end)
+    trends = TrendAccumulator(total, consumption_mean)
+    chart = BucketAccumulator(start, end, CHART_POINTS, HISTORY_COLUMNS[1:])
+    for chunk in iter_history_chunks(None, 1, start, end):
+        trends.update(chunk)
+        chart.update(chunk)
+    return trends.result(), len(chart.data_points())
+
+
+def measure(fn, *args):
+    """Time one run, then trace a second run for peak memory (tracemalloc slows it down)"""
+    started = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+    db.session.expunge_all()
+
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.rollback()
+    db.session.expunge_all()
+    return peak, elapsed, result
+
+
+def run(rows):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine)
+        load_synthetic_rows(engine, rows, interval_s=5, facilities=1)
+        engine.dispose()
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        db.init_app(app)
+        end = datetime.utcnow() + timedelta(seconds=1)
+        start = end - timedelta(seconds=5 * rows + 60)
+
+        print(f'\n{rows:,} rows')
+        print(f'{"pipeline":28} {"peak memory":>12} {"time":>9} {"chart points":>13}  consumption mean/std, trend')
+        with app.app_context():
+            for name, fn in (('ORM objects + dicts', orm_pipeline),
+                             ('column arrays', column_pipeline),
+                             ('streaming chunks', streaming_pipeline)):
+                peak, elapsed, (analysis, points) = measure(fn, start, end)
+                consumption = analysis['statistics']['consumption']
+                print(f'{name:28} {peak / 1e6:10.1f}MB {elapsed:8.2f}s {points:13,}  '
+                      f'{consumption["mean"]:.4f}/{consumption["std"]:.4f}, {analysis["trend"]}')
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='1000000', help='comma separated row counts')
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the bulk CSV import (rows/s into SQLite)
+
+Writes a synthetic meter export, then imports it with import_readings into a
+fresh database.  For comparison a sample of the same rows goes through the
+per-row path of /api/hardware/data (build_reading + insert_readings).
+
+    python -m benchmarks.bench_import --rows 100000,1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+from models import db, Facility
+from ingest import build_reading, insert_readings
+from meter_import import import_readings
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, synthetic_columns, format_rate
+
+
+def write_csv(rows, path):
+    columns = synthetic_columns(rows, facilities=1)
+    frame = pd.DataFrame({
+        'timestamp': np.datetime_as_string(columns['timestamp'], unit='s'),
+        'energy_produced': columns['energy_produced'].round(3),
+        'energy_consumed': columns['energy_consumed'].round(3),
+        'current_load': columns['current_load'].round(2),
+        'voltage': columns['voltage'].round(1),
+        'current1': (columns['current'] / 3).round(2),
+        'current2': (columns['current'] / 3).round(2),
+        'current3': (columns['current'] / 3).round(2),
+        'frequency': columns['frequency'].round(2),
+        'power_factor': columns['power_factor'].round(3),
+    })
+    frame.to_csv(path, index=False)
+    return frame
+
+
+def per_row(frame, sample):
+    """The /api/hardware/data path: one dict per row through build_reading"""
+    records = frame.head(sample).to_dict('records')
+    started = time.perf_counter()
+    insert_readings([build_reading(dict(record, facility_id=1), 1) for record in records])
+    db.session.commit()
+    return time.perf_counter() - started
+
+
+def run(rows, chunk_size, sample):
+    engine, path = temp_sqlite_engine()
+    fd, csv_path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        create_schema(engine)
+        engine.dispose()
+        frame = write_csv(rows, csv_path)
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        db.init_app(app)
+
+        print(f'\n{rows:,} rows ({os.path.getsize(csv_path) / 1e6:.1f}MB CSV), chunks of {chunk_size:,}')
+        with app.app_context():
+            db.session.add(Facility(name='Bench', location='-', capacity=100, solar_panels=1))
+            db.session.commit()
+
+            started = time.perf_counter()
+            accepted, rejected, _ = import_readings(csv_path, chunk_size=chunk_size)
+            elapsed = time.perf_counter() - started
+            print(f'{"import-readings":16} {format_rate(accepted, elapsed):>10} {elapsed:7.2f}s '
+                  f'({accepted:,} imported, {rejected:,} rejected)')
+
+            sample = min(sample, rows)
+            elapsed = per_row(frame, sample)
+            print(f'{"per-row ingest":16} {format_rate(sample, elapsed):>10} {elapsed:7.2f}s ({sample:,} row sample)')
+    finally:
+        os.remove(path)
+        os.remove(csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='100000,1000000', help='comma separated row counts')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=20000, help='rows sent through the per-row path')
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows, args.chunk_size, args.sample)
+
+
+if __name__ == '__main__':
+    main()
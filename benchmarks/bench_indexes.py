@@ -0,0 +1,84 @@
+"""
+Benchmark the energy_data hot queries before and after the index migration
+
+    python -m benchmarks.bench_indexes --rows 1000000,10000000
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import EnergyData
+from migrations import ensure_indexes, check_query_plans
+from benchmarks.common import parse_sizes, temp_sqlite_engine, create_schema, load_synthetic_rows, best_of
+
+
+def hot_queries(now):
+    """The route queries from app.py, expressed against the ORM model"""
+    sixty_seconds_ago = now - timedelta(seconds=60)
+    one_day_ago = now - timedelta(days=1)
+    seven_days_ago = now - timedelta(days=7)
+    return {
+        'latest (dashboard/latest-hardware-data)': select(EnergyData).where(
+            EnergyData.timestamp >= sixty_seconds_ago).order_by(EnergyData.timestamp.desc()).limit(1),
+        'latest overall (api/data)': select(EnergyData).order_by(EnergyData.timestamp.desc()).limit(1),
+        'status check (hardware-status-check)': select(EnergyData).where(
+            EnergyData.timestamp >= sixty_seconds_ago).limit(1),
+        '24h window (dashboard charts)': select(EnergyData).where(
+            EnergyData.timestamp >= one_day_ago).order_by(EnergyData.timestamp),
+        '7d window (historical)': select(EnergyData).where(
+            EnergyData.timestamp >= seven_days_ago).order_by(EnergyData.timestamp),
+        '24h facility window': select(EnergyData).where(
+            EnergyData.facility_id == 1, EnergyData.timestamp >= one_day_ago).order_by(EnergyData.timestamp),
+    }
+
+
+def time_queries(engine, now, repeat):
+    timings = {}
+    with Session(engine) as session:
+        for name, stmt in hot_queries(now).items():
+            seconds, _ = best_of(lambda: session.execute(stmt).all(), repeat)
+            session.expunge_all()
+            timings[name] = seconds
+    return timings
+
+
+def run(rows, repeat):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine, indexes=False)
+        # 5-second readings from 3 facilities ending now
+        load_synthetic_rows(engine, rows, interval_s=5, facilities=3)
+        now = datetime.utcnow()
+
+        before = time_queries(engine, now, repeat)
+        ensure_indexes(engine)
+        after = time_queries(engine, now, repeat)
+
+        print(f'\n{rows:,} rows')
+        print(f'{"query":42} {"before":>10} {"after":>10} {"speedup":>9}')
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f'{name:42} {before[name] * 1000:9.2f}ms {after[name] * 1000:9.2f}ms {speedup:8.1f}x')
+
+        for name, (uses_index, plan) in check_query_plans(engine).items():
+            print(f'  plan {name}: {" | ".join(plan)}')
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='1000000,10000000', help='comma separated row counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for rows in parse_sizes(args.rows):
+        run(rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
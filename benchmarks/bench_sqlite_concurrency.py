@@ -0,0 +1,144 @@
+"""
+Benchmark concurrent SQLite writers and readers with and without the high-throughput profile
+
+Writer processes insert batches of readings (like the batch endpoint under
+gunicorn) while reader processes run the 24-hour dashboard window.  Reports
+throughput, time spent waiting for the database lock and "database is
+locked" errors for the default rollback-journal setup and for the WAL profile.
+
+    python -m benchmarks.bench_sqlite_concurrency --rows 500000 --writers 4 --readers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from storage import sqlite_pragmas
+from benchmarks.common import temp_sqlite_engine, create_schema, load_synthetic_rows, ENERGY_COLUMNS
+
+WINDOW_QUERY = (
+    "SELECT timestamp, energy_produced, energy_consumed, efficiency, current_load "
+    "FROM energy_data WHERE timestamp >= ? ORDER BY timestamp"
+)
+
+
+def connect(path, profile, read_only, busy_timeout_ms):
+    if read_only and profile:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, isolation_level=None, timeout=busy_timeout_ms / 1000)
+    else:
+        conn = sqlite3.connect(path, isolation_level=None, timeout=busy_timeout_ms / 1000)
+    if profile:
+        for pragma in sqlite_pragmas(busy_timeout_ms=busy_timeout_ms, read_only=read_only):
+            conn.execute(pragma)
+    return conn
+
+
+def writer(path, profile, seconds, batch_size, busy_timeout_ms, results):
+    conn = connect(path, profile, False, busy_timeout_ms)
+    placeholders = ', '.join('?' for _ in ENERGY_COLUMNS)
+    sql = f'INSERT INTO energy_data ({", ".join(ENERGY_COLUMNS)}) VALUES ({placeholders})'
+    stats = {'role': 'writer', 'ops': 0, 'rows': 0, 'errors': 0, 'lock_wait': 0.0, 'max_latency': 0.0}
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        now = datetime.utcnow().isoformat(' ')
+        batch = [(now, 10.0, 12.0, 80.0, 55.0, 1, 221.0, 10.0, None, None, None, 50.0, 0.95, None, None)] * batch_size
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')  # waits here while another process holds the write lock
+            locked = time.perf_counter()
+            conn.executemany(sql, batch)
+            committing = time.perf_counter()
+            conn.execute('COMMIT')  # rollback-journal mode also waits here for readers to finish
+            finished = time.perf_counter()
+        except sqlite3.OperationalError:
+            stats['errors'] += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            continue
+        stats['ops'] += 1
+        stats['rows'] += batch_size
+        stats['lock_wait'] += (locked - started) + max(0.0, (finished - committing) - 0.001)
+        stats['max_latency'] = max(stats['max_latency'], finished - started)
+    conn.close()
+    results.put(stats)
+
+
+def reader(path, profile, seconds, busy_timeout_ms, results):
+    conn = connect(path, profile, True, busy_timeout_ms)
+    stats = {'role': 'reader', 'ops': 0, 'rows': 0, 'errors': 0, 'max_latency': 0.0}
+    since = (datetime.utcnow() - timedelta(days=1)).isoformat(' ')
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            rows = conn.execute(WINDOW_QUERY, (since,)).fetchall()
+        except sqlite3.OperationalError:
+            stats['errors'] += 1
+            continue
+        stats['ops'] += 1
+        stats['rows'] += len(rows)
+        stats['max_latency'] = max(stats['max_latency'], time.perf_counter() - started)
+    conn.close()
+    results.put(stats)
+
+
+def run(rows, writers, readers, seconds, batch_size, busy_timeout_ms, profile):
+    engine, path = temp_sqlite_engine()
+    try:
+        create_schema(engine)
+        load_synthetic_rows(engine, rows, interval_s=5, facilities=3)
+        engine.dispose()
+        if profile:
+            connect(path, True, False, busy_timeout_ms).close()  # switch the file to WAL once
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=writer, args=(path, profile, seconds, batch_size,
+                                                                   busy_timeout_ms, results))
+                     for _ in range(writers)]
+        processes += [multiprocessing.Process(target=reader, args=(path, profile, seconds, busy_timeout_ms, results))
+                      for _ in range(readers)]
+        for process in processes:
+            process.start()
+        stats = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        print(f'\n{"WAL profile" if profile else "default (rollback journal)"}: '
+              f'{writers} writers, {readers} readers, {seconds}s, {rows:,} existing rows')
+        for role in ('writer', 'reader'):
+            group = [s for s in stats if s['role'] == role]
+            if not group:
+                continue
+            ops = sum(s['ops'] for s in group)
+            # Readers never take the write lock; their waits show up as query latency
+            lock_wait = f'{sum(s["lock_wait"] for s in group):6.2f}s' if role == 'writer' else '     -'
+            print(f'  {role}s: {ops / seconds:8.1f} ops/s  {sum(s["rows"] for s in group) / seconds:10.0f} rows/s  '
+                  f'lock wait {lock_wait}  '
+                  f'max latency {max(s["max_latency"] for s in group) * 1000:7.1f}ms  '
+                  f'locked errors {sum(s["errors"] for s in group)}')
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=500000, help='readings loaded before the run')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--busy-timeout-ms', type=int, default=5000)
+    args = parser.parse_args()
+
+    for profile in (False, True):
+        run(args.rows, args.writers, args.readers, args.seconds, args.batch_size, args.busy_timeout_ms, profile)
+
+
+if __name__ == '__main__':
+    main()
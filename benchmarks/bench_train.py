@@ -0,0 +1,95 @@
+"""
+Benchmark EnergyPredictor.train against the previous per-group implementation
+
+Trains on hourly synthetic points (8k points is about a year) given as column
+arrays and as a list of reading dicts, and on the same columns with the
+previous implementation (a masked mean per hour and weekday, plus a second
+training on all but the last 24 points for the holdout score).  The largest
+difference between the two sets of factors and scores is printed as a check.
+
+    python -m benchmarks.bench_train --points 8000,100000,1000000
+"""
+import argparse
+
+import numpy as np
+
+from ml_predictor import EnergyPredictor, _hours_and_weekdays
+from benchmarks.common import parse_sizes, synthetic_columns, best_of, format_rate
+
+
+def reference_factors(consumption, hours, weekdays):
+    """Baseline and factors as the previous train() computed them"""
+    baseline = np.mean(consumption)
+    relative = consumption / max(1, baseline)
+    hourly = {int(hour): np.mean(relative[hours == hour]) for hour in np.unique(hours)}
+    daily = {int(day): np.mean(relative[weekdays == day]) for day in np.unique(weekdays)}
+    return baseline, hourly, daily
+
+
+def reference_train(columns):
+    """Previous train(): per-group masked means, then a second training for the holdout"""
+    consumption = np.asarray(columns['energy_consumed'], dtype=np.float64)
+    hours, weekdays = _hours_and_weekdays(columns)
+    baseline, hourly, daily = reference_factors(consumption, hours, weekdays)
+
+    train_baseline, train_hourly, train_daily = reference_factors(consumption[:-24], hours[:-24], weekdays[:-24])
+    predicted = np.array([
+        train_baseline * train_hourly.get(int(hour), 1.0) * train_daily.get(int(day), 1.0)
+        for hour, day in zip(hours[-24:], weekdays[-24:])
+    ])
+    actual = consumption[-24:]
+    score = max(0, 100 - np.mean(np.abs((actual - predicted) / actual)) * 100)
+    return baseline, hourly, daily, score
+
+
+def largest_difference(model, reference):
+    baseline, hourly, daily, score = reference
+    assert hourly.keys() == model.hourly_patterns.keys() and daily.keys() == model.daily_patterns.keys()
+    return max(
+        abs(model.baseline - baseline),
+        max(abs(model.hourly_patterns[hour] - factor) for hour, factor in hourly.items()),
+        max(abs(model.daily_patterns[day] - factor) for day, factor in daily.items()),
+        abs(model.validation_score - score)
+    )
+
+
+def train(data):
+    model = EnergyPredictor()
+    model.train(data)
+    return model
+
+
+def run(points, dict_max, repeat):
+    columns = synthetic_columns(points, interval_s=3600)
+    columns = {name: columns[name] for name in ('timestamp', 'energy_consumed')}
+
+    print(f'\n{points:,} points')
+    seconds, model = best_of(lambda: train(columns), repeat)
+    print(f'{"columns":10} {seconds * 1000:10.1f}ms {format_rate(points, seconds):>10}')
+
+    if points <= dict_max:
+        data_points = [
+            {'timestamp': timestamp, 'energy_consumed': consumed}
+            for timestamp, consumed in zip(columns['timestamp'].tolist(), columns['energy_consumed'].tolist())
+        ]
+        seconds, _ = best_of(lambda: train(data_points), repeat)
+        print(f'{"dicts":10} {seconds * 1000:10.1f}ms {format_rate(points, seconds):>10}')
+
+    seconds, reference = best_of(lambda: reference_train(columns), repeat)
+    print(f'{"previous":10} {seconds * 1000:10.1f}ms {format_rate(points, seconds):>10}')
+    print(f'largest difference from previous: {largest_difference(model, reference):.2e}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', default='8000,100000,1000000', help='comma separated point counts')
+    parser.add_argument('--dict-max', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for points in parse_sizes(args.points):
+        run(points, args.dict_max, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Micro-benchmark analyze_trends on column arrays and on a list of reading dicts
+
+The column entry point is timed at every size; the list-of-dicts wrapper
+(which transposes the dicts first) only up to --dict-max points, since ten
+million dicts alone need several GB.
+
+    python -m benchmarks.bench_trends --points 10000,1000000,10000000
+"""
+import argparse
+
+from utils import analyze_trends
+from benchmarks.common import parse_sizes, synthetic_columns, best_of, format_rate
+
+
+def run(points, dict_max, repeat):
+    columns = synthetic_columns(points)
+    columns = {name: columns[name] for name in ('timestamp', 'energy_produced', 'energy_consumed')}
+
+    print(f'\n{points:,} points')
+    seconds, _ = best_of(lambda: analyze_trends(columns), repeat)
+    print(f'{"columns":8} {seconds * 1000:10.1f}ms {format_rate(points, seconds):>10}')
+
+    if points <= dict_max:
+        data_points = [
+            {'timestamp': timestamp, 'energy_produced': produced, 'energy_consumed': consumed}
+            for timestamp, produced, consumed in zip(
+                columns['timestamp'].tolist(), columns['energy_produced'].tolist(),
+                columns['energy_consumed'].tolist()
+            )
+        ]
+        seconds, _ = best_of(lambda: analyze_trends(data_points), repeat)
+        print(f'{"dicts":8} {seconds * 1000:10.1f}ms {format_rate(points, seconds):>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', default='10000,1000000,10000000', help='comma separated point counts')
+    parser.add_argument('--dict-max', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for points in parse_sizes(args.points):
+        run(points, args.dict_max, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
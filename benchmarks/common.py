@@ -0,0 +1,137 @@
+"""
+Shared helpers for the benchmark scripts
+
+Benchmarks run against a throw-away SQLite database filled with synthetic
+readings.  Run them from the repository root, e.g.:
+
+    python -m benchmarks.bench_indexes --rows 1000000
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, inspect, text
+
+from models import db
+
+ENERGY_COLUMNS = [
+    'timestamp', 'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'facility_id', 'voltage', 'current', 'current1', 'current2', 'current3',
+    'frequency', 'power_factor', 'alert_message', 'alert_level'
+]
+
+
+def parse_sizes(value):
+    """Parse a comma separated list of row counts such as '1000000,10000000'"""
+    return [int(float(part)) for part in value.split(',') if part.strip()]
+
+
+def temp_sqlite_engine(directory=None):
+    """Create an engine on a new temporary SQLite file; returns (engine, path)"""
+    fd, path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    return create_engine(f'sqlite:///{path}'), path
+
+
+def create_schema(engine, indexes=True):
+    """Create the application tables, optionally without the energy_data indexes"""
+    db.metadata.create_all(engine)
+    if not indexes:
+        drop_energy_indexes(engine)
+
+
+def drop_energy_indexes(engine):
+    """Drop every index on energy_data (to measure the unindexed baseline)"""
+    with engine.begin() as conn:
+        for index in inspect(engine).get_indexes('energy_data'):
+            conn.execute(text(f'DROP INDEX {index["name"]}'))
+
+
+def synthetic_columns(n, start=None, interval_s=5, facilities=1, seed=0):
+    """
+    Generate n synthetic readings as a dict of NumPy arrays
+    Timestamps are datetime64[us], spaced interval_s apart and ending now
+    """
+    rng = np.random.default_rng(seed)
+    if start is None:
+        start = datetime.utcnow() - timedelta(seconds=interval_s * n)
+    timestamps = np.datetime64(start, 'us') + np.arange(n, dtype=np.int64) * np.int64(interval_s * 1_000_000)
+    hours = (timestamps.astype('datetime64[h]').astype(np.int64) % 24).astype(np.float64)
+
+    # Daylight production curve and a noisy consumption profile
+    produced = np.clip(50 * np.sin((hours - 6) / 12 * np.pi), 0, None) + rng.uniform(0, 5, n)
+    consumed = 60 + 10 * np.sin(hours / 24 * 2 * np.pi) + rng.normal(0, 5, n)
+    voltage = 220 + rng.normal(0, 4, n)
+
+    return {
+        'timestamp': timestamps,
+        'energy_produced': produced,
+        'energy_consumed': consumed,
+        'efficiency': np.where(produced > 0, np.minimum(100, consumed / np.maximum(produced, 1e-9) * 100), 0),
+        'current_load': np.clip(consumed, 30, 95),
+        'facility_id': (np.arange(n) % facilities + 1).astype(np.int64),
+        'voltage': voltage,
+        'current': rng.uniform(8, 15, n),
+        'frequency': 50 + rng.normal(0, 0.05, n),
+        'power_factor': rng.uniform(0.85, 0.98, n),
+    }
+
+
+def load_synthetic_rows(engine, n, chunk_size=200_000, **kwargs):
+    """Bulk load n synthetic readings into energy_data through the raw DB-API connection"""
+    columns = synthetic_columns(n, **kwargs)
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    stamps = np.char.replace(np.datetime_as_string(columns['timestamp'], unit='us'), 'T', ' ')
+    placeholders = ', '.join('?' for _ in ENERGY_COLUMNS)
+    sql = f'INSERT INTO energy_data ({", ".join(ENERGY_COLUMNS)}) VALUES ({placeholders})'
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for offset in range(0, n, chunk_size):
+            chunk = slice(offset, offset + chunk_size)
+            rows = zip(
+                stamps[chunk].tolist(),
+                columns['energy_produced'][chunk].tolist(),
+                columns['energy_consumed'][chunk].tolist(),
+                columns['efficiency'][chunk].tolist(),
+                columns['current_load'][chunk].tolist(),
+                columns['facility_id'][chunk].tolist(),
+                columns['voltage'][chunk].tolist(),
+                columns['current'][chunk].tolist(),
+                [None] * len(stamps[chunk]),
+                [None] * len(stamps[chunk]),
+                [None] * len(stamps[chunk]),
+                columns['frequency'][chunk].tolist(),
+                columns['power_factor'][chunk].tolist(),
+                [None] * len(stamps[chunk]),
+                [None] * len(stamps[chunk]),
+            )
+            cursor.executemany(sql, rows)
+            raw.commit()
+    finally:
+        raw.close()
+    return columns
+
+
+def best_of(fn, repeat=5):
+    """Run fn repeat times and return (best seconds, last result)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def format_rate(count, seconds):
+    """Format a throughput figure such as '1.2M/s'"""
+    rate = count / seconds if seconds else float('inf')
+    if rate >= 1e6:
+        return f'{rate / 1e6:.1f}M/s'
+    if rate >= 1e3:
+        return f'{rate / 1e3:.1f}k/s'
+    return f'{rate:.0f}/s'
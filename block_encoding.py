@@ -0,0 +1,348 @@
+"""
+Compressed time-series block encoding for energy readings
+
+A block holds the readings of one facility over a closed time window.
+Timestamps are stored as delta-of-delta integers and each measurement as a
+scaled integer (fixed precision per column) that is delta encoded; every
+integer stream is packed at the narrowest width that fits and the whole body
+is zlib compressed.  Voltage, frequency and power factor barely change
+between samples, so their deltas mostly fit in a single byte.
+
+Encoding and decoding are vectorized with NumPy (diff / cumsum), so a block
+of a few thousand readings is processed without a Python-level loop.
+
+Blocks also keep each reading's id, so once retention has deleted packed raw
+rows, the raw readers (/historical, the export and /api/energy) serve the
+range before the retention cutoff from the blocks with the same
+(timestamp, id) order and keys as the table.
+"""
+import itertools
+import logging
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, func, or_, update
+
+from models import db, EnergyData, EnergyBlock, JobWatermark
+from watermarks import settled_id
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EBLK'
+VERSION = 2  # version 1 blocks have no id stream; their readings decode with id 0
+# Magic, version and reading count
+BLOCK_HEADER = struct.Struct('<4sBI')
+
+# Measurement columns and the precision they are stored with (scale = 1 / precision)
+COLUMN_SCALES = [
+    ('energy_produced', 1000),   # 0.001 kWh
+    ('energy_consumed', 1000),
+    ('efficiency', 1000),        # 0.001 %
+    ('current_load', 1000),
+    ('voltage', 100),            # 0.01 V
+    ('current', 1000),           # 1 mA
+    ('current1', 1000),
+    ('current2', 1000),
+    ('current3', 1000),
+    ('frequency', 1000),         # 0.001 Hz
+    ('power_factor', 10000),
+]
+
+# alert_level is stored as a small code; alert messages are re-derived from voltage (export.block_rows)
+ALERT_LEVELS = [None, 'info', 'warning', 'critical']
+
+# Integer widths, indexed by the width code stored in front of each stream
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+WATERMARK_NAME = 'block_pack'
+
+
+def _pack_ints(values):
+    """Serialize an int64 array at the narrowest signed width that holds every value"""
+    values = np.asarray(values, dtype=np.int64)
+    code = 0
+    if len(values):
+        low, high = values.min(), values.max()
+        code = next(i for i, int_type in enumerate(INT_TYPES)
+                    if np.iinfo(int_type).min <= low and high <= np.iinfo(int_type).max)
+    return struct.pack('<BI', code, len(values)) + values.astype(INT_TYPES[code]).tobytes()
+
+
+def _unpack_ints(buffer, offset):
+    """Inverse of _pack_ints; returns (int64 array, new offset)"""
+    code, count = struct.unpack_from('<BI', buffer, offset)
+    offset += 5
+    int_type = INT_TYPES[code]
+    values = np.frombuffer(buffer, dtype=int_type, count=count, offset=offset).astype(np.int64)
+    return values, offset + count * np.dtype(int_type).itemsize
+
+
+def encode_timestamps(timestamps):
+    """Delta-of-delta encode a datetime64 array (microsecond resolution)"""
+    micros = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64)
+    if len(micros) == 0:
+        return _pack_ints([])
+    # First timestamp, first delta, then the change in delta for every following reading
+    deltas = np.diff(micros)
+    return _pack_ints(np.concatenate([micros[:1], deltas[:1], np.diff(deltas)]))
+
+
+def decode_timestamps(buffer, offset, count):
+    """Inverse of encode_timestamps; returns (datetime64[us] array, new offset)"""
+    packed, offset = _unpack_ints(buffer, offset)
+    if count == 0:
+        return np.empty(0, dtype='datetime64[us]'), offset
+    first = packed[:1]
+    deltas = np.cumsum(packed[1:])  # first delta followed by the delta-of-deltas
+    micros = np.concatenate([first, first + np.cumsum(deltas)])
+    return micros.view('datetime64[us]'), offset
+
+
+def encode_values(values, scale):
+    """Scaled-integer delta encode a float array; NaN marks missing readings"""
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    all_valid = bool(valid.all())
+
+    scaled = np.round(values[valid] * scale).astype(np.int64)
+    deltas = np.diff(scaled, prepend=np.int64(0))  # first element keeps the absolute value
+
+    parts = [struct.pack('<B', 1 if all_valid else 0)]
+    if not all_valid:
+        parts.append(np.packbits(valid).tobytes())
+    parts.append(_pack_ints(deltas))
+    return b''.join(parts)
+
+
+def decode_values(buffer, offset, count, scale):
+    """Inverse of encode_values; returns (float64 array, new offset)"""
+    all_valid = buffer[offset]
+    offset += 1
+    if all_valid:
+        valid = None
+    else:
+        bitmap_size = (count + 7) // 8
+        bitmap = np.frombuffer(buffer, dtype=np.uint8, count=bitmap_size, offset=offset)
+        valid = np.unpackbits(bitmap, count=count).astype(bool)
+        offset += bitmap_size
+
+    deltas, offset = _unpack_ints(buffer, offset)
+    decoded = np.cumsum(deltas) / scale
+    if valid is None:
+        return decoded, offset
+
+    values = np.full(count, np.nan)
+    values[valid] = decoded
+    return values, offset
+
+
+def encode_block(columns):
+    """
+    Encode one block of readings
+    columns: dict with 'timestamp' (datetime64, sorted), the COLUMN_SCALES columns
+    as float arrays (NaN = missing) and optionally 'id' and 'alert_level' codes
+    Returns: compressed bytes
+    """
+    count = len(columns['timestamp'])
+    ids = np.asarray(columns.get('id', np.zeros(count)), dtype=np.int64)
+    # The first id on its own, so the deltas after it keep a narrow width
+    parts = [encode_timestamps(columns['timestamp']), _pack_ints(ids[:1]), _pack_ints(np.diff(ids))]
+    for name, scale in COLUMN_SCALES:
+        parts.append(encode_values(columns[name], scale))
+
+    alert_codes = np.asarray(columns.get('alert_level', np.zeros(count)), dtype=np.int8)
+    parts.append(alert_codes.tobytes())
+
+    body = zlib.compress(b''.join(parts), 6)
+    return BLOCK_HEADER.pack(MAGIC, VERSION, count) + body
+
+
+def decode_block(payload):
+    """Decode bytes produced by encode_block into a dict of column arrays"""
+    magic, version, count = BLOCK_HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError('Not an encoded energy block')
+    body = zlib.decompress(payload[BLOCK_HEADER.size:])
+
+    columns = {}
+    columns['timestamp'], offset = decode_timestamps(body, 0, count)
+    if version == 1:
+        columns['id'] = np.zeros(count, dtype=np.int64)
+    else:
+        first_id, offset = _unpack_ints(body, offset)
+        id_deltas, offset = _unpack_ints(body, offset)
+        columns['id'] = np.cumsum(np.concatenate([first_id, id_deltas]))
+    for name, scale in COLUMN_SCALES:
+        columns[name], offset = decode_values(body, offset, count, scale)
+    columns['alert_level'] = np.frombuffer(body, dtype=np.int8, count=count, offset=offset).copy()
+    return columns
+
+
+def _rows_to_block_columns(rows):
+    """Convert (id, timestamp, measurements..., alert_level) tuples into block column arrays"""
+    ids, timestamps, *values, alert_levels = zip(*rows)
+    columns = {
+        'id': np.array(ids, dtype=np.int64),
+        'timestamp': np.array(timestamps, dtype='datetime64[us]'),
+        'alert_level': np.array([ALERT_LEVELS.index(level) if level in ALERT_LEVELS else 0
+                                 for level in alert_levels], dtype=np.int8)
+    }
+    for (name, _), column in zip(COLUMN_SCALES, values):
+        columns[name] = np.array(column, dtype=np.float64)  # None becomes NaN
+    return columns
+
+
+def pack_closed_blocks(block_seconds=3600, batch_size=50000):
+    """
+    Copy readings of closed time blocks into compressed energy_block rows
+
+    Only rows whose block has ended are packed.  The job advances an id
+    watermark up to (but not including) the first row that still belongs
+    to the open block, so readings uploaded late with old device timestamps
+    are packed on a later run as an extra block for the same window.
+    Ids above watermarks.settled_id() are left for a later run as well.
+    Readings dated after the open block (a device clock running ahead) are
+    packed right away, so they can never hold the watermark back.
+    Must be called inside an application context.
+    Returns: number of readings packed
+    """
+    now_seconds = int((datetime.utcnow() - datetime(1970, 1, 1)).total_seconds())
+    cutoff = datetime.utcfromtimestamp(now_seconds // block_seconds * block_seconds)
+
+    watermark = db.session.get(JobWatermark, WATERMARK_NAME)
+    if watermark is None:
+        watermark = JobWatermark(name=WATERMARK_NAME, last_id=0)
+        db.session.add(watermark)
+        db.session.flush()
+    last_id = watermark.last_id
+
+    # Rows before the first reading of the open block are all closed (or future-dated)
+    first_open_id = db.session.execute(
+        select(func.min(EnergyData.id)).where(
+            EnergyData.id > last_id,
+            EnergyData.timestamp >= cutoff,
+            EnergyData.timestamp < cutoff + timedelta(seconds=block_seconds)
+        )
+    ).scalar()
+    upper_id = first_open_id - 1 if first_open_id else db.session.execute(select(func.max(EnergyData.id))).scalar()
+    settled = settled_id()
+    if upper_id and settled is not None:
+        upper_id = min(upper_id, settled)
+    if not upper_id or upper_id <= last_id:
+        db.session.commit()
+        return 0
+
+    upper_id = min(upper_id, last_id + batch_size)
+    columns_to_read = [EnergyData.id, EnergyData.timestamp] + \
+        [getattr(EnergyData, name) for name, _ in COLUMN_SCALES] + [EnergyData.alert_level]
+    rows = db.session.execute(
+        select(*columns_to_read, EnergyData.facility_id)
+        .where(EnergyData.id > last_id, EnergyData.id <= upper_id)
+        .order_by(EnergyData.facility_id, EnergyData.timestamp)
+    ).all()
+
+    # Group rows by facility and block window, then encode each group
+    blocks = {}
+    for row in rows:
+        epoch = int((row.timestamp - datetime(1970, 1, 1)).total_seconds())
+        blocks.setdefault((row.facility_id, epoch // block_seconds * block_seconds), []).append(tuple(row)[:-1])
+
+    new_blocks = []
+    for (facility_id, block_start), block_rows in blocks.items():
+        columns = _rows_to_block_columns(block_rows)
+        start = datetime.utcfromtimestamp(block_start)
+        new_blocks.append(EnergyBlock(
+            facility_id=facility_id,
+            block_start=start,
+            block_end=start + timedelta(seconds=block_seconds),
+            reading_count=len(block_rows),
+            first_id=int(columns['id'].min()),
+            last_id=int(columns['id'].max()),
+            payload=encode_block(columns)
+        ))
+    db.session.add_all(new_blocks)
+
+    # Compare-and-set, as for the rollups, so two workers never pack the same rows
+    moved = db.session.execute(
+        update(JobWatermark)
+        .where(JobWatermark.name == WATERMARK_NAME, JobWatermark.last_id == last_id)
+        .values(last_id=upper_id, updated_at=datetime.utcnow())
+    ).rowcount
+    if not moved:
+        db.session.rollback()
+        return 0
+
+    db.session.commit()
+    logger.info(f"Packed {len(rows)} readings into {len(new_blocks)} blocks")
+    return len(rows)
+
+
+def packed_id():
+    """Highest EnergyData id packed into blocks"""
+    watermark = db.session.get(JobWatermark, WATERMARK_NAME)
+    return watermark.last_id if watermark else 0
+
+
+def packed_end(start, end, packed_before):
+    """End of the part of [start, end) read from the blocks, or None when the blocks are not read"""
+    if packed_before is None or start >= packed_before:
+        return None
+    return packed_before if end is None else min(end, packed_before)
+
+
+def unpacked_filter(packed_before, packed):
+    """
+    Condition selecting the raw readings that the blocks (read up to packed_before and id packed)
+    do not hold: everything from packed_before on, and readings packed after packed was read
+    """
+    return or_(EnergyData.timestamp >= packed_before, EnergyData.id > packed)
+
+
+def _empty_block_columns():
+    columns = {name: np.empty(0) for name, _ in COLUMN_SCALES}
+    columns['timestamp'] = np.empty(0, dtype='datetime64[us]')
+    columns['id'] = np.empty(0, dtype=np.int64)
+    columns['alert_level'] = np.empty(0, dtype=np.int8)
+    return columns
+
+
+def iter_block_windows(facility_id, start, end=None, max_id=None):
+    """
+    Yield the packed readings of a facility in [start, end), one block window at a time
+    A window's blocks (late readings add extra blocks) are merged and sorted by
+    (timestamp, id).  max_id leaves out readings packed after packed_id() returned it.
+    """
+    query = select(EnergyBlock.block_start, EnergyBlock.payload).where(
+        EnergyBlock.facility_id == facility_id, EnergyBlock.block_end > start
+    )
+    if end is not None:
+        query = query.where(EnergyBlock.block_start < end)
+    if max_id is not None:
+        query = query.where(EnergyBlock.first_id <= max_id)
+    result = db.session.execute(
+        query.order_by(EnergyBlock.block_start, EnergyBlock.id).execution_options(yield_per=100)
+    )
+
+    for _, blocks in itertools.groupby(result, key=lambda block: block.block_start):
+        decoded = [decode_block(block.payload) for block in blocks]
+        columns = {name: np.concatenate([block[name] for block in decoded]) for name in decoded[0]}
+        timestamps = columns['timestamp']
+        selected = timestamps >= np.datetime64(start, 'us')
+        if end is not None:
+            selected &= timestamps < np.datetime64(end, 'us')
+        if max_id is not None:
+            selected &= columns['id'] <= max_id
+        columns = {name: values[selected] for name, values in columns.items()}
+        if len(columns['id']):
+            order = np.lexsort((columns['id'], columns['timestamp']))
+            yield {name: values[order] for name, values in columns.items()}
+
+
+def load_block_columns(facility_id, start, end=None, max_id=None):
+    """Decode the packed readings of a facility in [start, end) into (timestamp, id)-sorted column arrays"""
+    windows = list(iter_block_windows(facility_id, start, end, max_id))
+    if not windows:
+        return _empty_block_columns()
+    return {name: np.concatenate([window[name] for window in windows]) for name in windows[0]}
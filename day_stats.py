@@ -0,0 +1,369 @@
+"""
+Per-facility daily statistics maintained on ingest
+
+Every insert path folds its readings into one energy_day_stats row per
+facility and UTC day: Welford mean and variance, min and max of production
+and consumption, plus the readings and consumption per hour of day.  Day
+states merge exactly (Chan's parallel update), so the /historical analysis of
+a window reads one row per day instead of every reading.
+
+Stats are only kept while DAY_STATS_ENABLED is set; rebuild_day_stats()
+backfills them from energy_data and marks them ready.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import delete, insert, select, text, tuple_, update
+
+from models import db, EnergyData, EnergyDayStats, EnergyRollup, JobWatermark
+from archive import load_history_columns
+from rollups import HOUR
+from utils import analyze_trends
+
+logger = logging.getLogger(__name__)
+
+STATS = {'production': 'energy_produced', 'consumption': 'energy_consumed'}
+
+WATERMARK_NAME = 'day_stats'
+
+EPOCH_DAY = date(1970, 1, 1)
+MICROS_PER_HOUR = 3_600_000_000
+MICROS_PER_DAY = 24 * MICROS_PER_HOUR
+
+
+def day_stats_enabled():
+    return has_app_context() and current_app.config.get('DAY_STATS_ENABLED', False)
+
+
+def day_stats_ready():
+    """True once rebuild_day_stats has backfilled the stats of the existing readings"""
+    return db.session.get(JobWatermark, WATERMARK_NAME) is not None
+
+
+def aggregate_days(facility_ids, timestamps, produced, consumed):
+    """
+    Day states of a block of readings, one per (facility, UTC day)
+    Returns: dict of arrays keyed like the EnergyDayStats columns (hour_* as n x 24 arrays)
+    """
+    facility_ids = np.asarray(facility_ids, dtype=np.int64)
+    micros = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64)
+    produced = np.asarray(produced, dtype=np.float64)
+    consumed = np.asarray(consumed, dtype=np.float64)
+
+    # Facility ids and day numbers both fit in 32 bits, so pack them into one sort key
+    keys = (facility_ids << 32) | (micros // MICROS_PER_DAY)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    size = len(unique_keys)
+    counts = np.bincount(inverse, minlength=size)
+
+    states = {'facility_id': unique_keys >> 32, 'day': unique_keys & 0xFFFFFFFF, 'count': counts}
+    for key, values in (('production', produced), ('consumption', consumed)):
+        mean = np.bincount(inverse, weights=values, minlength=size) / counts
+        states[f'{key}_mean'] = mean
+        # Deviations from the day's own mean: the two-pass equivalent of Welford's update
+        states[f'{key}_m2'] = np.bincount(inverse, weights=(values - mean[inverse]) ** 2, minlength=size)
+        minimum = np.full(size, np.inf)
+        maximum = np.full(size, -np.inf)
+        np.minimum.at(minimum, inverse, values)
+        np.maximum.at(maximum, inverse, values)
+        states[f'{key}_min'] = minimum
+        states[f'{key}_max'] = maximum
+
+    cells = inverse * 24 + micros // MICROS_PER_HOUR % 24
+    states['hour_counts'] = np.bincount(cells, minlength=size * 24).reshape(size, 24)
+    states['hour_consumed'] = np.bincount(cells, weights=consumed, minlength=size * 24).reshape(size, 24)
+    return states
+
+
+def _empty_state(facility_id, day):
+    """Column values of a new, empty EnergyDayStats row"""
+    state = {
+        'facility_id': facility_id,
+        'day': day,
+        'count': 0,
+        'hour_counts': np.zeros(24, dtype=np.int64).tobytes(),
+        'hour_consumed': np.zeros(24, dtype=np.float64).tobytes()
+    }
+    for key in STATS:
+        state.update({f'{key}_mean': 0.0, f'{key}_m2': 0.0, f'{key}_min': None, f'{key}_max': None})
+    return state
+
+
+def _merge_state(state, aggregates, i):
+    """Fold day i of an aggregate_days() result into a dict of EnergyDayStats column values"""
+    count = int(aggregates['count'][i])
+    total = state['count'] + count
+    for key in STATS:
+        # Chan et al.: combine two (count, mean, M2) states without revisiting the readings
+        mean = float(aggregates[f'{key}_mean'][i])
+        delta = mean - state[f'{key}_mean']
+        state[f'{key}_m2'] += float(aggregates[f'{key}_m2'][i]) + delta * delta * state['count'] * count / total
+        state[f'{key}_mean'] += delta * count / total
+
+        low = float(aggregates[f'{key}_min'][i])
+        high = float(aggregates[f'{key}_max'][i])
+        if state[f'{key}_min'] is None or low < state[f'{key}_min']:
+            state[f'{key}_min'] = low
+        if state[f'{key}_max'] is None or high > state[f'{key}_max']:
+            state[f'{key}_max'] = high
+    state['count'] = total
+
+    hour_counts = np.frombuffer(state['hour_counts'], dtype=np.int64) + aggregates['hour_counts'][i]
+    hour_consumed = np.frombuffer(state['hour_consumed'], dtype=np.float64) + aggregates['hour_consumed'][i]
+    state['hour_counts'] = hour_counts.astype(np.int64).tobytes()
+    state['hour_consumed'] = hour_consumed.tobytes()
+
+
+def _day(number):
+    return EPOCH_DAY + timedelta(days=int(number))
+
+
+def apply_day_stats(facility_ids, timestamps, produced, consumed):
+    """Fold a block of inserted readings into the day stats of the current session (no commit)"""
+    if len(facility_ids) == 0:
+        return
+
+    aggregates = aggregate_days(facility_ids, timestamps, produced, consumed)
+    days = [_day(number) for number in aggregates['day']]
+    table = EnergyDayStats.__table__
+
+    # Lock the rows this block touches; concurrent ingest requests update the same day
+    rows = db.session.execute(
+        select(table).where(
+            table.c.facility_id.in_({int(f) for f in aggregates['facility_id']}),
+            table.c.day >= min(days),
+            table.c.day <= max(days)
+        ).with_for_update()
+    ).mappings()
+    existing = {(row['facility_id'], row['day']): dict(row) for row in rows}
+
+    inserts = []
+    updates = []
+    for i, day in enumerate(days):
+        facility_id = int(aggregates['facility_id'][i])
+        state = existing.get((facility_id, day))
+        if state is None:
+            state = _empty_state(facility_id, day)
+            inserts.append(state)
+        else:
+            updates.append(state)
+        _merge_state(state, aggregates, i)
+
+    if inserts:
+        db.session.execute(insert(EnergyDayStats), inserts)
+    if updates:
+        db.session.execute(update(EnergyDayStats), updates)
+
+
+def record_day_stats(readings):
+    """Fold inserted reading dicts into the day stats (no-op unless DAY_STATS_ENABLED)"""
+    if not readings or not day_stats_enabled():
+        return
+    apply_day_stats(
+        [reading['facility_id'] for reading in readings],
+        [reading['timestamp'] for reading in readings],
+        [reading['energy_produced'] for reading in readings],
+        [reading['energy_consumed'] for reading in readings]
+    )
+
+
+def rebuild_day_stats(chunk_size=50000, complete_from=None):
+    """
+    Recompute the stats of every day that has readings in energy_data and mark the stats ready
+    complete_from: time before which retention or the archive may have removed readings; days
+    before the first midnight at or after it are skipped and keep their stats, since a partly
+    deleted day would otherwise be replaced by the stats of its remaining readings
+    Returns: number of readings scanned
+    """
+    # Write first: that takes SQLite's write lock, so no ingest can slip in between the scan and the replace
+    watermark = db.session.get(JobWatermark, WATERMARK_NAME)
+    if watermark is None:
+        watermark = JobWatermark(name=WATERMARK_NAME, last_id=0)
+        db.session.add(watermark)
+    watermark.updated_at = datetime.utcnow()
+    db.session.flush()
+    if db.session.connection().dialect.name == 'postgresql':
+        db.session.execute(text('LOCK TABLE energy_day_stats IN EXCLUSIVE MODE'))
+
+    conditions = []
+    if complete_from is not None:
+        first_day = datetime.combine(complete_from.date(), time())
+        if first_day < complete_from:
+            first_day += timedelta(days=1)
+        conditions.append(EnergyData.timestamp >= first_day)
+
+    states = {}
+    scanned = last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(EnergyData.id, EnergyData.facility_id, EnergyData.timestamp,
+                   EnergyData.energy_produced, EnergyData.energy_consumed)
+            .where(EnergyData.id > last_id, *conditions).order_by(EnergyData.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        ids, facility_ids, timestamps, produced, consumed = zip(*rows)
+        aggregates = aggregate_days(facility_ids, timestamps, produced, consumed)
+        for i, number in enumerate(aggregates['day']):
+            key = (int(aggregates['facility_id'][i]), _day(number))
+            state = states.setdefault(key, _empty_state(*key))
+            _merge_state(state, aggregates, i)
+        scanned += len(rows)
+        last_id = ids[-1]
+
+    keys = list(states)
+    for offset in range(0, len(keys), 500):
+        db.session.execute(
+            delete(EnergyDayStats)
+            .where(tuple_(EnergyDayStats.facility_id, EnergyDayStats.day).in_(keys[offset:offset + 500]))
+        )
+    if states:
+        db.session.execute(insert(EnergyDayStats), list(states.values()))
+
+    watermark.last_id = last_id
+    db.session.commit()
+    logger.info(f"Rebuilt day stats of {len(states)} facility-days from {scanned} readings")
+    return scanned
+
+
+def _rows_to_states(rows):
+    """EnergyDayStats rows (oldest first) as the arrays aggregate_days returns"""
+    states = {
+        'count': np.array([row['count'] for row in rows], dtype=np.int64),
+        'hour_counts': np.array([np.frombuffer(row['hour_counts'], dtype=np.int64) for row in rows],
+                                dtype=np.int64).reshape(-1, 24),
+        'hour_consumed': np.array([np.frombuffer(row['hour_consumed'], dtype=np.float64) for row in rows],
+                                  dtype=np.float64).reshape(-1, 24)
+    }
+    for key in STATS:
+        for name in ('mean', 'm2', 'min', 'max'):
+            states[f'{key}_{name}'] = np.array([row[f'{key}_{name}'] for row in rows], dtype=np.float64)
+    return states
+
+
+def _rollup_states(rollups):
+    """Hourly EnergyRollup rows as states shaped like day states (one row per hour bucket)"""
+    n = len(rollups)
+    counts = np.array([rollup.count for rollup in rollups], dtype=np.int64)
+    hours = [rollup.bucket_start.hour for rollup in rollups]
+    states = {
+        'count': counts,
+        'hour_counts': np.zeros((n, 24), dtype=np.int64),
+        'hour_consumed': np.zeros((n, 24), dtype=np.float64)
+    }
+    states['hour_counts'][np.arange(n), hours] = counts
+    states['hour_consumed'][np.arange(n), hours] = [rollup.energy_consumed_sum for rollup in rollups]
+
+    for key, metric in STATS.items():
+        count = np.array([getattr(rollup, f'{metric}_count') for rollup in rollups], dtype=np.float64)
+        total = np.array([getattr(rollup, f'{metric}_sum') for rollup in rollups], dtype=np.float64)
+        sumsq = np.array([getattr(rollup, f'{metric}_sumsq') for rollup in rollups], dtype=np.float64)
+        states[f'{key}_mean'] = total / count
+        states[f'{key}_m2'] = np.maximum(sumsq - total * total / count, 0.0)
+        states[f'{key}_min'] = np.array([getattr(rollup, f'{metric}_min') for rollup in rollups], dtype=np.float64)
+        states[f'{key}_max'] = np.array([getattr(rollup, f'{metric}_max') for rollup in rollups], dtype=np.float64)
+    return states
+
+
+def window_states(directory, facility_id, start, packed_before=None):
+    """
+    Day states of a facility from start up to now, oldest first
+    Whole days come from energy_day_stats.  The rest of start's day is made of the hourly rollups
+    of its whole hours and the readings of the partial hour after start (archive or blocks included).
+    """
+    first_day = datetime.combine(start.date(), time())
+    if first_day < start:
+        first_day += timedelta(days=1)
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+
+    table = EnergyDayStats.__table__
+    rows = db.session.execute(
+        select(table).where(table.c.facility_id == facility_id, table.c.day >= first_day.date())
+        .order_by(table.c.day)
+    ).mappings().all()
+    parts = [_rows_to_states(rows)]
+
+    if first_hour < first_day:
+        rollups = EnergyRollup.query.filter(
+            EnergyRollup.facility_id == facility_id,
+            EnergyRollup.resolution == HOUR,
+            EnergyRollup.bucket_start >= first_hour,
+            EnergyRollup.bucket_start < first_day,
+            EnergyRollup.count > 0
+        ).order_by(EnergyRollup.bucket_start).all()
+        parts.insert(0, _rollup_states(rollups))
+
+    head = load_history_columns(directory, facility_id, start, min(first_hour, first_day), packed_before)
+    if len(head['timestamp']):
+        parts.insert(0, aggregate_days(np.full(len(head['timestamp']), facility_id), head['timestamp'],
+                                       head['energy_produced'], head['energy_consumed']))
+
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[-1]}
+
+
+def analyze_day_states(states):
+    """
+    Equivalent of utils.analyze_trends computed from day states in O(days)
+    The trend halves are split at hour granularity, and peak hours count the readings of
+    hour buckets whose mean consumption is above the window mean (as analyze_rollup_trends does).
+    """
+    counts = states['count'].astype(np.float64)
+    total = counts.sum()
+    if not total:
+        return analyze_trends([])
+
+    statistics = {}
+    for key in STATS:
+        means = states[f'{key}_mean']
+        mean = (counts * means).sum() / total
+        # Chan's merge over all days at once: within-day M2 plus the spread of the day means
+        m2 = states[f'{key}_m2'].sum() + (counts * (means - mean) ** 2).sum()
+        statistics[key] = {
+            'mean': float(mean),
+            'max': float(states[f'{key}_max'].max()),
+            'min': float(states[f'{key}_min'].min()),
+            'std': float(np.sqrt(m2 / total))
+        }
+
+    hour_counts = states['hour_counts'].ravel()
+    hour_consumed = states['hour_consumed'].ravel()
+
+    # Trend: compare consumption before and after the hour bucket holding the median reading
+    trend = 'neutral'
+    if total > 1:
+        first = np.cumsum(hour_counts) - hour_counts < total // 2
+        first_count, second_count = hour_counts[first].sum(), hour_counts[~first].sum()
+        if first_count and second_count:
+            first_mean = hour_consumed[first].sum() / first_count
+            second_mean = hour_consumed[~first].sum() / second_count
+            if second_mean > first_mean * 1.05:
+                trend = 'increasing'
+            elif first_mean > second_mean * 1.05:
+                trend = 'decreasing'
+
+    # Peak hours, listed in order of first appearance like analyze_trends
+    hours = np.tile(np.arange(24), len(counts))
+    occupied = hour_counts > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        above = occupied & (hour_consumed / hour_counts > statistics['consumption']['mean'])
+    above_mean = np.bincount(hours[above], weights=hour_counts[above], minlength=24)
+    present, first_seen = np.unique(hours[occupied], return_index=True)
+    peak_hours = {int(hour): int(above_mean[hour]) for hour in present[np.argsort(first_seen)]}
+
+    return {
+        'statistics': statistics,
+        'trend': trend,
+        'peak_hours': peak_hours
+    }
+
+
+def window_trends(directory, facility_id, start, packed_before=None):
+    """
+    Trend analysis of a facility's readings from start up to now, from the day stats
+    The hourly rollups must be up to date (see rollups.update_rollups).
+    """
+    return analyze_day_states(window_states(directory, facility_id, start, packed_before))
@@ -0,0 +1,152 @@
+"""
+Server-side downsampling of chart series
+
+Charts never need more points than the canvas has pixels, so long series are
+reduced before rendering.  Two methods are available:
+- lttb: Largest-Triangle-Three-Buckets, keeps the visual shape of the line
+- minmax: the lowest and highest reading of each bucket, so spikes always survive
+Several series sharing one time axis are reduced to a common set of indices.
+BucketAccumulator builds per-bucket means from readings streamed in chunks.
+"""
+import numpy as np
+
+METHODS = ['lttb', 'minmax']
+
+
+def _fill_missing(y):
+    """Replace NaN with the series mean so missing readings are never picked as extremes"""
+    y = np.asarray(y, dtype=np.float64)
+    missing = np.isnan(y)
+    if missing.all():
+        return np.zeros_like(y)
+    if missing.any():
+        y = np.where(missing, np.nanmean(y), y)
+    return y
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps
+    x must be increasing; the first and last points are always kept
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = _fill_missing(y)
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Area of the triangle formed by the previous pick, each candidate and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax_indices(y, threshold):
+    """Indices of the minimum and maximum reading of each of threshold // 2 buckets"""
+    n = len(y)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+
+    y = _fill_missing(y)
+    buckets = threshold // 2
+    bucket_ids = np.arange(n) * buckets // n
+    # Sort by bucket, then value: the first and last entry of each bucket are its min and max
+    order = np.lexsort((y, bucket_ids))
+    counts = np.bincount(bucket_ids, minlength=buckets)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    return np.unique(np.concatenate([order[starts], order[ends - 1], [0, n - 1]]))
+
+
+def downsample_indices(x, series, threshold, method='lttb'):
+    """
+    Common indices for several series sharing the time axis x
+    Each series gets an equal share of the threshold; the union of the picks is returned sorted.
+    """
+    n = len(x)
+    if threshold >= n or not series:
+        return np.arange(n)
+
+    share = max(threshold // len(series), 3)
+    picks = []
+    for y in series:
+        if method == 'minmax':
+            picks.append(minmax_indices(y, share))
+        else:
+            picks.append(lttb_indices(x, y, share))
+    return np.unique(np.concatenate(picks))
+
+
+def downsample_columns(timestamps, columns, threshold, method='lttb'):
+    """
+    Reduce column arrays that share the datetime64 timestamps to about threshold points
+    Returns: (timestamps, dict of value lists with None for missing readings)
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    values = {name: np.asarray(column, dtype=np.float64) for name, column in columns.items()}
+    x = timestamps.astype(np.int64) / 1e6
+
+    keep = downsample_indices(x, list(values.values()), threshold, method)
+    kept = {
+        name: [None if np.isnan(v) else v for v in column[keep].tolist()]
+        for name, column in values.items()
+    }
+    return timestamps[keep].astype(object), kept
+
+
+class BucketAccumulator:
+    """
+    Streaming chart series: per-bucket means over a fixed time range
+    Memory is O(buckets) however many readings are fed in.
+    """
+
+    def __init__(self, start, end, buckets, names):
+        self.start = np.datetime64(start, 'us')
+        span = max(int((np.datetime64(end, 'us') - self.start).astype(np.int64)), 1)
+        self.width = max(span // buckets, 1)  # microseconds
+        self.buckets = buckets
+        self.counts = np.zeros(buckets, dtype=np.int64)
+        self.sums = {name: np.zeros(buckets) for name in names}
+        self.valid = {name: np.zeros(buckets, dtype=np.int64) for name in names}
+
+    def update(self, columns):
+        """Fold in one chunk of column arrays holding 'timestamp' and the series"""
+        offsets = (np.asarray(columns['timestamp'], dtype='datetime64[us]') - self.start).astype(np.int64)
+        ids = np.clip(offsets // self.width, 0, self.buckets - 1)
+        self.counts += np.bincount(ids, minlength=self.buckets)
+        for name, sums in self.sums.items():
+            values = np.asarray(columns[name], dtype=np.float64)
+            valid = ~np.isnan(values)
+            sums += np.bincount(ids[valid], weights=values[valid], minlength=self.buckets)
+            self.valid[name] += np.bincount(ids[valid], minlength=self.buckets)
+
+    def data_points(self):
+        """Non-empty buckets as per-reading dicts (timestamp = bucket start)"""
+        filled = np.flatnonzero(self.counts)
+        starts = (self.start + filled * np.timedelta64(int(self.width), 'us')).astype(object)
+        means = {
+            name: [total / count if count else None
+                   for total, count in zip(self.sums[name][filled].tolist(), self.valid[name][filled].tolist())]
+            for name in self.sums
+        }
+        return [
+            dict({'timestamp': start}, **{name: means[name][i] for name in means})
+            for i, start in enumerate(starts)
+        ]
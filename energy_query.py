@@ -0,0 +1,135 @@
+"""
+Time-range query API over readings and rollups
+
+Backs /api/energy: one facility, a [start, end) window, a resolution (raw
+readings or the 1m/1h/1d rollups), a projection of fields and a page size.
+Results are columnar (one array per field) and paginated with an opaque
+keyset cursor on (timestamp, id), so every page is an index range scan no
+matter how deep it is.  With packed_before set, raw readings before it are
+merged in from the energy_block rows, as in the export.
+"""
+import base64
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, tuple_
+
+from models import db, EnergyData, EnergyRollup, ROLLUP_METRICS
+from rollups import MINUTE, HOUR, DAY
+from block_encoding import packed_end, packed_id, unpacked_filter
+from export import block_rows
+
+RESOLUTIONS = {'raw': None, '1m': MINUTE, '1h': HOUR, '1d': DAY}
+
+RAW_FIELDS = [
+    'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor',
+    'alert_message', 'alert_level'
+]
+# Rollups: the bucket mean of each metric, its extremes as <metric>_min/_max, and the reading count
+ROLLUP_FIELDS = ROLLUP_METRICS + [f'{m}_{s}' for m in ROLLUP_METRICS for s in ('min', 'max')] + ['count']
+
+DEFAULT_FIELDS = ['energy_produced', 'energy_consumed', 'efficiency', 'current_load']
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class QueryError(ValueError):
+    """Raised for invalid query parameters"""
+
+
+def parse_time(value, name):
+    """Parse an ISO-8601 query parameter into a naive UTC datetime"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise QueryError(f'Invalid {name}: {value}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_fields(value, resolution):
+    """Comma separated field list, validated against the resolution"""
+    allowed = RAW_FIELDS if resolution is None else ROLLUP_FIELDS
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise QueryError(f'Unknown field(s) for this resolution: {", ".join(unknown)}')
+    return list(dict.fromkeys(fields))
+
+
+def encode_cursor(timestamp, row_id):
+    micros = (timestamp - EPOCH) // timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(f'{micros}:{row_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the (timestamp, id) key after which the next page starts"""
+    try:
+        micros, row_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        return EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise QueryError('Invalid cursor')
+
+
+def _rollup_column(field):
+    """SQL expression of a rollup field"""
+    if field == 'count' or field.endswith(('_min', '_max')):
+        return getattr(EnergyRollup, field)
+    # Mean over the non-null readings of the bucket; NULL when there were none
+    count = getattr(EnergyRollup, f'{field}_count')
+    return getattr(EnergyRollup, f'{field}_sum') / db.func.nullif(count, 0)
+
+
+def query_energy(facility_id, start, end, resolution=None, fields=None, limit=1000, cursor=None,
+                 packed_before=None):
+    """
+    One page of a facility's readings (resolution None) or rollup buckets in [start, end)
+    packed_before: read raw readings before this time from the packed blocks
+    Returns: (dict with a 'timestamp' list and one list per field, next page cursor or None)
+    """
+    fields = fields or list(DEFAULT_FIELDS)
+    if resolution is None:
+        model = EnergyData
+        time_column = EnergyData.timestamp
+        columns = [getattr(EnergyData, field) for field in fields]
+        conditions = [EnergyData.facility_id == facility_id]
+    else:
+        model = EnergyRollup
+        time_column = EnergyRollup.bucket_start
+        columns = [_rollup_column(field) for field in fields]
+        conditions = [EnergyRollup.facility_id == facility_id, EnergyRollup.resolution == resolution]
+    conditions += [time_column >= start, time_column < end]
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        conditions.append(tuple_(time_column, model.id) > after)
+
+    blocks_start = after[0] if after else start
+    blocks_end = packed_end(blocks_start, end, packed_before) if resolution is None else None
+    if blocks_end is not None:
+        packed = packed_id()
+        conditions.append(unpacked_filter(packed_before, packed))
+
+    # One extra row tells whether another page follows
+    rows = db.session.execute(
+        select(time_column, model.id, *columns).where(*conditions)
+        .order_by(time_column, model.id).limit(limit + 1)
+    ).all()
+    if blocks_end is not None:
+        packed_rows = block_rows(facility_id, blocks_start, blocks_end, ['timestamp', 'id', *fields], packed)
+        if after:
+            packed_rows = (row for row in packed_rows if (row[0], row[1]) > after)
+        rows = list(itertools.islice(heapq.merge(packed_rows, rows, key=lambda row: (row[0], row[1])), limit + 1))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    data = {'timestamp': [row[0].isoformat() for row in rows]}
+    for i, field in enumerate(fields):
+        data[field] = [row[i + 2] for row in rows]
+
+    next_cursor = encode_cursor(rows[-1][0], rows[-1][1]) if has_more else None
+    return data, next_cursor
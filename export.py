@@ -0,0 +1,155 @@
+"""
+Streaming bulk export of readings as CSV or NDJSON
+
+Rows are read with keyset pagination on (timestamp, id) and encoded one
+chunk at a time, optionally through a gzip compressor, so an export of any
+size holds at most one chunk in memory.  The same generator backs the
+/api/export endpoint and the `flask export-readings` command.
+
+With packed_before set, readings before it come from the energy_block rows
+(retention may have deleted them from the table) merged with the table rows
+the blocks do not hold, in the same (timestamp, id) order.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+import zlib
+
+import numpy as np
+from sqlalchemy import select, tuple_
+
+from models import db, EnergyData
+from block_encoding import ALERT_LEVELS, iter_block_windows, packed_end, packed_id, unpacked_filter
+from ingest import describe_voltage
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+EXPORT_FIELDS = [
+    'id', 'timestamp', 'facility_id', 'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor',
+    'alert_message', 'alert_level'
+]
+
+
+def block_rows(facility_id, start, end, fields, max_id):
+    """
+    Yield the packed readings of a facility in [start, end) as tuples of fields, in (timestamp, id) order
+    Missing values are None, like NULLs read from the table; alert messages are re-derived from the voltage.
+    """
+    for columns in iter_block_windows(facility_id, start, end, max_id):
+        values = []
+        for field in fields:
+            if field == 'timestamp':
+                values.append(columns['timestamp'].astype(object).tolist())
+            elif field == 'id':
+                values.append(columns['id'].tolist())
+            elif field == 'facility_id':
+                values.append(itertools.repeat(facility_id))
+            elif field == 'alert_level':
+                values.append([ALERT_LEVELS[code] for code in columns['alert_level'].tolist()])
+            elif field == 'alert_message':
+                values.append([None if np.isnan(voltage) else describe_voltage(voltage)[0]
+                               for voltage in columns['voltage'].tolist()])
+            else:
+                column = columns[field].astype(object)
+                column[np.isnan(columns[field])] = None
+                values.append(column.tolist())
+        yield from zip(*values)
+
+
+def _iter_table_rows(facility_id, start, end, chunk_size, extra_conditions=()):
+    columns = [getattr(EnergyData, name) for name in EXPORT_FIELDS]
+    conditions = [EnergyData.facility_id == facility_id, EnergyData.timestamp >= start, *extra_conditions]
+    if end is not None:
+        conditions.append(EnergyData.timestamp < end)
+
+    # Core execution on the session's connection skips the ORM result machinery
+    connection = db.session.connection()
+    last_key = None
+    while True:
+        query = select(*columns).where(*conditions)
+        if last_key is not None:
+            query = query.where(tuple_(EnergyData.timestamp, EnergyData.id) > last_key)
+        rows = connection.execute(query.order_by(EnergyData.timestamp, EnergyData.id).limit(chunk_size)).all()
+        if not rows:
+            return
+        yield rows
+        last_key = (rows[-1].timestamp, rows[-1].id)
+        if len(rows) < chunk_size:
+            return
+
+
+def iter_rows(facility_id, start, end, chunk_size=10000, packed_before=None):
+    """Yield lists of at most chunk_size EXPORT_FIELDS tuples in (timestamp, id) order"""
+    blocks_end = packed_end(start, end, packed_before)
+    if blocks_end is None:
+        yield from _iter_table_rows(facility_id, start, end, chunk_size)
+        return
+
+    packed = packed_id()
+    table_rows = itertools.chain.from_iterable(
+        _iter_table_rows(facility_id, start, end, chunk_size, [unpacked_filter(packed_before, packed)])
+    )
+    rows = heapq.merge(block_rows(facility_id, start, blocks_end, EXPORT_FIELDS, packed), table_rows,
+                       key=lambda row: (row[1], row[0]))
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _encode_csv(rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    # NULLs become empty cells
+    writer.writerows((row[0], row[1].isoformat(), *row[2:]) for row in rows)
+    return buffer.getvalue()
+
+
+def _encode_ndjson(rows, header):
+    lines = []
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['timestamp'] = row[1].isoformat()
+        lines.append(json.dumps(record))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def iter_export(facility_id, start, end=None, fmt='csv', compress=False, chunk_size=10000, packed_before=None):
+    """
+    Yield the export as bytes, one encoded chunk at a time
+    Must be consumed inside an application context (use stream_with_context for responses).
+    """
+    encode = _encode_csv if fmt == 'csv' else _encode_ndjson
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+
+    header = True
+    for rows in iter_rows(facility_id, start, end, chunk_size, packed_before):
+        data = encode(rows, header).encode()
+        header = False
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+
+    if header and fmt == 'csv':
+        # No rows: still emit the header line
+        data = ','.join(EXPORT_FIELDS).encode() + b'\n'
+        yield compressor.compress(data) if compressor else data
+    if compressor:
+        yield compressor.flush()
+
+
+def export_filename(facility_id, start, end, fmt, compress):
+    end_part = end.strftime('%Y%m%d') if end else 'now'
+    name = f"energy_facility{facility_id}_{start.strftime('%Y%m%d')}-{end_part}.{fmt}"
+    return name + '.gz' if compress else name
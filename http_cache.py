@@ -0,0 +1,157 @@
+"""
+Conditional GET (ETag / Last-Modified) and a response cache for the expensive views
+
+A view's response only changes when a new reading arrives (or, for
+predictions, when the model is retrained), so the data watermark (the
+latest reading's id and timestamp) and the model version make a strong
+ETag.  Both come from memory, so a client whose copy is current gets a 304
+before the view touches the database or the predictor.
+
+The same watermark keys ResponseCache: other clients asking for a page that
+was rendered since the last reading get the stored response instead of a
+recomputation.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app, request, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def reading_watermark(reading):
+    """(token, last_modified) of the data a reading represents, or None if there is no reading"""
+    if not reading:
+        return None
+    micros = (reading['timestamp'] - EPOCH) // timedelta(microseconds=1)
+    return f"{reading.get('facility_id') or 0}.{reading.get('id') or 0}.{micros}", reading['timestamp']
+
+
+def conditional_get(watermark, version=None):
+    """
+    Answer If-None-Match with 304 when the watermark hasn't moved
+    watermark(): (token, last_modified) of the data the view reads, or None to always run the view
+    version(): optional version of whatever turns that data into the response (e.g. the model);
+    read once, before the view, like the response cache key: a body served from the cache (or
+    rendered while the training job swaps the model) is never tagged with a newer version.
+    Last-Modified is sent but never validates: it has one-second resolution, and a newer reading
+    (or a new version) in the same second would get a 304, so If-Modified-Since alone never does.
+    Only 200 responses are tagged.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            state = watermark()
+            if state is None:
+                return view(*args, **kwargs)
+            token, last_modified = state
+
+            etag = f'{token}.m{version()}' if version else token
+            if not is_resource_modified(request.environ, etag=etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Let browsers keep the body but revalidate on every poll
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU of rendered responses keyed by (route, facility, parameters, user, watermark)
+    A new reading moves the watermark, so outdated entries are never hit again and age out of the
+    LRU; the TTL bounds how long a response outlives the time window it was computed for.
+    max_entries=0 disables caching.
+    """
+
+    def __init__(self, max_entries=128, ttl_seconds=60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key):
+        """Stored value for key, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def cached(self, watermark, facility=None, version=None):
+        """
+        Serve a view from the cache while the data watermark hasn't moved
+        watermark(): (token, last_modified) of the data the view reads, or None to always run the view
+        facility(): optional facility the view renders, when it isn't a query parameter
+        version(): optional version of whatever else the response depends on (e.g. the model); part of
+        the key, so a retrained model is never answered with a page rendered by the previous one
+        Only 200 responses are stored.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                state = watermark() if self.max_entries else None
+                if state is None:
+                    return view(*args, **kwargs)
+
+                # Pages include the signed-in user's name, so users never share entries
+                key = (
+                    request.endpoint,
+                    facility() if facility else None,
+                    tuple(sorted(request.args.items(multi=True))),
+                    current_user.get_id(),
+                    state[0],
+                    version() if version else None
+                )
+                cached = self.get(key)
+                if cached is not None:
+                    body, status, headers = cached
+                    return current_app.response_class(body, status=status, headers=headers)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    headers = [(name, value) for name, value in response.headers if name.lower() != 'set-cookie']
+                    self.put(key, (response.get_data(), response.status_code, headers))
+                return response
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """Return a snapshot of the cache counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
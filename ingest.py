@@ -0,0 +1,385 @@
+"""
+Ingest helpers shared by the hardware data endpoints
+"""
+import io
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from models import db, EnergyData
+from day_stats import record_day_stats
+
+logger = logging.getLogger(__name__)
+
+# Voltage thresholds (these would be configurable in a real system)
+NOMINAL_VOLTAGE = 220  # This could be pulled from facility settings
+HIGH_VOLTAGE_THRESHOLD = NOMINAL_VOLTAGE * 1.1    # 10% above nominal
+LOW_VOLTAGE_THRESHOLD = NOMINAL_VOLTAGE * 0.9     # 10% below nominal
+CRITICAL_HIGH_THRESHOLD = NOMINAL_VOLTAGE * 1.15  # 15% above nominal
+CRITICAL_LOW_THRESHOLD = NOMINAL_VOLTAGE * 0.85   # 15% below nominal
+
+REQUIRED_FIELDS = ['energy_produced', 'energy_consumed', 'current_load']
+ELECTRICAL_FIELDS = ['voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor']
+
+
+class ReadingError(ValueError):
+    """Raised when a hardware reading fails validation"""
+
+
+def describe_voltage(voltage):
+    """
+    Alert for a voltage reading, without logging (e.g. for readings already stored)
+    Returns: (alert_message, alert_level), both None for normal readings
+    """
+    if not voltage or voltage <= 0:  # Only check if voltage data is provided
+        return None, None
+
+    if voltage >= CRITICAL_HIGH_THRESHOLD:
+        return f"CRITICAL HIGH VOLTAGE DETECTED: {voltage:.1f}V", "critical"
+    if voltage >= HIGH_VOLTAGE_THRESHOLD:
+        return f"High voltage condition: {voltage:.1f}V", "warning"
+    if voltage <= CRITICAL_LOW_THRESHOLD:
+        return f"CRITICAL LOW VOLTAGE DETECTED: {voltage:.1f}V", "critical"
+    if voltage <= LOW_VOLTAGE_THRESHOLD:
+        return f"Low voltage condition: {voltage:.1f}V", "warning"
+    return None, None
+
+
+def classify_voltage(voltage):
+    """
+    Classify a voltage reading against the alert thresholds
+    Returns: (alert_message, alert_level), both None for normal readings
+    """
+    alert_message, alert_level = describe_voltage(voltage)
+    if alert_level == 'critical':
+        logger.warning(f"Critical {'high' if voltage > NOMINAL_VOLTAGE else 'low'} voltage detected: {voltage:.1f}V")
+    elif alert_level == 'warning':
+        logger.info(alert_message)
+    return alert_message, alert_level
+
+
+def parse_timestamp(value):
+    """
+    Parse a device-side timestamp (ISO-8601 string or Unix epoch seconds)
+    Returns a naive UTC datetime, matching how EnergyData timestamps are stored
+    """
+    if value is None or value == '':
+        return datetime.utcnow()
+
+    try:
+        if isinstance(value, (int, float)):
+            parsed = datetime.fromtimestamp(float(value), tz=timezone.utc)
+        else:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (ValueError, OverflowError, OSError):
+        raise ReadingError(f'Invalid timestamp: {value}')
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_reading(data, default_facility_id=None, timestamp=None):
+    """
+    Validate a single hardware payload and compute the derived fields
+    Returns: dict of EnergyData column values ready for insertion
+    Raises: ReadingError if the payload is invalid
+    """
+    if not isinstance(data, dict) or not data:
+        raise ReadingError('No data provided')
+
+    # Extract required sensor data fields
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise ReadingError(f'Missing required field: {field}')
+
+    try:
+        values = {field: float(data.get(field, 0)) for field in REQUIRED_FIELDS + ELECTRICAL_FIELDS}
+    except (TypeError, ValueError) as e:
+        raise ReadingError(f'Invalid numeric value: {str(e)}')
+
+    # Calculate total current if individual phase currents are provided
+    if values['current1'] > 0 or values['current2'] > 0 or values['current3'] > 0:
+        values['current'] = values['current1'] + values['current2'] + values['current3']
+
+    # Calculate efficiency (as percentage for storage, will be converted to decimal in display)
+    if values['energy_produced'] > 0:
+        efficiency = min(100, (values['energy_consumed'] / values['energy_produced']) * 100)
+    else:
+        efficiency = 0
+
+    facility_id = data.get('facility_id') or default_facility_id
+    if not facility_id:
+        raise ReadingError('No facility configured')
+
+    if timestamp is None:
+        timestamp = parse_timestamp(data.get('timestamp'))
+
+    # Analyze voltage conditions and create alerts if necessary
+    alert_message, alert_level = classify_voltage(values['voltage'])
+
+    reading = {
+        'timestamp': timestamp,
+        'energy_produced': values['energy_produced'],
+        'energy_consumed': values['energy_consumed'],
+        'efficiency': efficiency,
+        'current_load': values['current_load'],
+        'facility_id': facility_id,
+        'alert_message': alert_message,
+        'alert_level': alert_level
+    }
+    # Unreported electrical parameters are stored as NULL
+    for field in ELECTRICAL_FIELDS:
+        reading[field] = values[field] if values[field] > 0 else None
+
+    return reading
+
+
+# Batches at least this large are loaded with COPY on PostgreSQL
+COPY_MIN_ROWS = 100
+
+
+def _copy_value(value):
+    """Format a value for COPY ... FROM STDIN (text format)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+def _copy_readings(readings):
+    """
+    Load readings with PostgreSQL COPY in the current transaction
+    Ids are reserved from the sequence first so they can be returned in input order.
+    They only become visible at commit, possibly after higher ids (see watermarks.py).
+    """
+    connection = db.session.connection()
+    ids = connection.execute(
+        text("SELECT nextval(pg_get_serial_sequence('energy_data', 'id')) FROM generate_series(1, :n)"),
+        {'n': len(readings)}
+    ).scalars().all()
+
+    columns = sorted(set().union(*readings))
+    buffer = io.StringIO()
+    for data_id, reading in zip(ids, readings):
+        values = [data_id] + [reading.get(column) for column in columns]
+        buffer.write('\t'.join(_copy_value(value) for value in values))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY energy_data (id, {", ".join(columns)}) FROM STDIN', buffer)
+    finally:
+        cursor.close()
+    return ids
+
+
+def insert_readings(readings):
+    """
+    Insert many readings in the current transaction (no commit)
+    Uses COPY on PostgreSQL (psycopg2) and a single executemany elsewhere.
+    Returns: list of new EnergyData ids, in the same order as the input
+    """
+    if not readings:
+        return []
+
+    dialect = db.session.connection().dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2' and len(readings) >= COPY_MIN_ROWS:
+        ids = _copy_readings(readings)
+    else:
+        stmt = insert(EnergyData).returning(EnergyData.id, sort_by_parameter_order=True)
+        ids = db.session.scalars(stmt, readings).all()
+
+    record_day_stats(readings)
+    return ids
+
+
+def bulk_insert_readings(readings):
+    """
+    Insert many readings and commit once
+    Returns: list of new EnergyData ids, in the same order as the input
+    """
+    ids = insert_readings(readings)
+    if ids:
+        db.session.commit()
+    return ids
+
+
+# Errors that mean the database is unavailable (connection lost, locked, pool exhausted)
+# rather than that the readings are bad; batches failing with these are retried as a whole
+RETRYABLE_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+
+class BufferFull(Exception):
+    """Raised when the write-behind buffer cannot accept more readings"""
+
+
+class IngestBuffer:
+    """
+    Write-behind buffer for hardware readings
+
+    Readings are validated by the request handler and queued in a bounded
+    in-process queue; a background job drains the queue with bulk inserts
+    whenever max_latency_ms has elapsed or max_batch readings are waiting.
+    A batch that fails because the database is unavailable is retried; one
+    that fails on its data is bisected and only the failing readings are
+    dead-lettered (logged and counted), so they never block the queue.
+    """
+    FLUSH_JOB_ID = 'ingest-buffer-flush'
+
+    def __init__(self, app, max_size=10000, max_batch=500, max_latency_ms=200):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_latency_ms = max_latency_ms
+        self.queue = queue.Queue(maxsize=max_size)
+        self.scheduler = None
+
+        # Readings taken off the queue whose insert failed with a retryable error; retried first
+        self._retry = []
+        self._flush_lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._flush_pending = False
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'dead_lettered': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self, scheduler):
+        """Register the periodic flush job on the application scheduler"""
+        self.scheduler = scheduler
+        scheduler.add_job(
+            self.flush,
+            'interval',
+            seconds=self.max_latency_ms / 1000.0,
+            id=self.FLUSH_JOB_ID,
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+
+    def submit(self, reading):
+        """
+        Queue a validated reading for storage
+        Raises: BufferFull if the queue is at capacity
+        """
+        self.submit_many([reading])
+
+    def submit_many(self, readings):
+        """
+        Queue validated readings for storage, all or none of them
+        Raises: BufferFull if the queue has no room for all of them
+        """
+        # Only submitters add to the queue, so the room checked here can only grow before the puts
+        with self._submit_lock:
+            if self.queue.maxsize and self.queue.maxsize - self.queue.qsize() < len(readings):
+                with self._stats_lock:
+                    self.stats['rejected'] += len(readings)
+                raise BufferFull(f'Ingest queue full ({self.queue.qsize()} of {self.queue.maxsize} readings pending)')
+            for reading in readings:
+                self.queue.put_nowait(reading)
+        with self._stats_lock:
+            self.stats['enqueued'] += len(readings)
+
+        # Flush early once a full batch is waiting instead of waiting for the timer
+        if self.scheduler and not self._flush_pending and self.queue.qsize() >= self.max_batch:
+            self._flush_pending = True
+            self.scheduler.add_job(self.flush, id=f'{self.FLUSH_JOB_ID}-now', replace_existing=True)
+
+    def flush(self):
+        """Drain the queue into the database in batches of at most max_batch readings"""
+        with self._flush_lock:
+            self._flush_pending = False
+            while True:
+                batch = self._retry
+                self._retry = []
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+
+                started = time.perf_counter()
+                try:
+                    stored = self._store(batch)
+                except RETRYABLE_ERRORS as e:
+                    self._count('flush_errors')
+                    logger.error(f"Error flushing ingest buffer ({len(self._retry)} readings): {str(e)}")
+                    return
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with self._stats_lock:
+                    self.stats['flushed'] += stored
+                    self.stats['flushes'] += 1
+                    self.stats['last_flush_ms'] = elapsed_ms
+                    self.stats['total_flush_ms'] += elapsed_ms
+                    self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], elapsed_ms)
+
+    def _store(self, batch):
+        """
+        Insert a batch, splitting it in halves on data errors until the bad readings are isolated
+        Returns: number of readings stored
+        Raises: one of RETRYABLE_ERRORS, after putting the unstored readings in _retry
+        """
+        stored = 0
+        pending = [batch]
+        while pending:
+            part = pending.pop()
+            try:
+                with self.app.app_context():
+                    bulk_insert_readings(part)
+                stored += len(part)
+            except RETRYABLE_ERRORS:
+                with self.app.app_context():
+                    db.session.rollback()
+                self._retry = part + [reading for rest in reversed(pending) for reading in rest]
+                raise
+            except Exception as e:
+                with self.app.app_context():
+                    db.session.rollback()
+                if len(part) == 1:
+                    self._count('dead_lettered')
+                    logger.error(f"Dead-lettered reading that cannot be stored ({str(e)}): {part[0]!r}")
+                else:
+                    middle = len(part) // 2
+                    pending += [part[middle:], part[:middle]]
+        return stored
+
+    def shutdown(self):
+        """Flush everything still buffered; called when the process exits"""
+        if self.scheduler and self.scheduler.get_job(self.FLUSH_JOB_ID):
+            self.scheduler.remove_job(self.FLUSH_JOB_ID)
+        self.flush()
+        if self._retry:
+            logger.error(f"Ingest buffer shut down with {len(self._retry)} unsaved readings")
+
+    def get_stats(self):
+        """Return a snapshot of the buffer counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize() + len(self._retry)
+        stats['queue_capacity'] = self.queue.maxsize
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
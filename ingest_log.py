@@ -0,0 +1,364 @@
+"""
+Durable append-only log for hardware readings
+
+Readings are appended to length-prefixed segment files and fsynced in
+batches by a timer thread; a request is acknowledged only once its record
+is on disk.  The replayer loads logged readings into energy_data in bulk and
+stores how far it got in the ingest_checkpoint table in the same
+transaction, so after a crash it resumes from the last committed offset
+without dropping or double-inserting readings.
+
+A record that can never be inserted (e.g. it violates a constraint) is
+moved to the writer directory's reject file, in the same record format,
+and the checkpoint advances past it instead of stalling every replay.
+"""
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from models import db, IngestCheckpoint
+from ingest import RETRYABLE_ERRORS, insert_readings
+
+logger = logging.getLogger(__name__)
+
+# Record header: payload length and CRC32 of the payload, both big-endian
+RECORD_HEADER = struct.Struct('>II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+REJECT_FILE = 'rejects.log'
+
+
+class IngestLogError(Exception):
+    """Raised when a reading cannot be made durable in the ingest log"""
+
+
+def segment_path(directory, index):
+    """Return the file path of segment number index"""
+    return os.path.join(directory, f'{SEGMENT_PREFIX}{index:010d}{SEGMENT_SUFFIX}')
+
+
+def list_segments(directory):
+    """Return the segment numbers present in directory, oldest first"""
+    indexes = []
+    for filename in os.listdir(directory):
+        if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX):
+            indexes.append(int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+    return sorted(indexes)
+
+
+def encode_record(record):
+    """Serialize a reading (plus any extra fields) as a length-prefixed, checksummed record"""
+    record = dict(record)
+    record['timestamp'] = record['timestamp'].isoformat()
+    payload = json.dumps(record).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path, start=0, end=None):
+    """
+    Read records from a segment file starting at byte offset start
+    Yields: (reading dict, byte offset just past the record)
+
+    Reading stops at end, at end of file, or at the first truncated or
+    corrupt record (a torn write from a crash, which was never acknowledged).
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while end is None or position < end:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                logger.warning(f"Ignoring torn record at {path}:{position}")
+                return
+            position += RECORD_HEADER.size + length
+
+            record = json.loads(payload)
+            record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+            yield record, position
+
+
+class IngestLog:
+    """
+    Append-only segment log with group fsync
+
+    Each process writes to its own sub-directory (writer-0, writer-1, ...)
+    guarded by an exclusive lock, so several gunicorn workers can share one
+    base directory.  A new segment is started on every open, which keeps
+    torn tails from a previous crash out of the active segment.
+    """
+
+    def __init__(self, base_dir, segment_max_bytes=64 * 1024 * 1024, fsync_interval_ms=20):
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.directory, self._lock_file = self._acquire_directory(base_dir)
+        self.name = os.path.basename(self.directory)
+
+        existing = list_segments(self.directory)
+        self.segment_index = existing[-1] + 1 if existing else 0
+        self._file = open(segment_path(self.directory, self.segment_index), 'ab')
+
+        # Positions are (segment, byte offset) tuples, which compare in log order
+        self._written = (self.segment_index, 0)
+        self._durable = (self.segment_index, 0)
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._sync_loop, name='ingest-log-fsync', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _acquire_directory(base_dir):
+        """Lock the first writer directory not held by another process"""
+        os.makedirs(base_dir, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(base_dir, f'writer-{slot}')
+            os.makedirs(directory, exist_ok=True)
+            lock_file = open(os.path.join(directory, 'LOCK'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return directory, lock_file
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+
+    def append(self, reading):
+        """
+        Append a reading to the active segment
+        Returns: the log position just past the record, for wait_durable()
+        """
+        return self.append_many([reading])
+
+    def append_many(self, readings):
+        """
+        Append readings to the active segment in one write (a batch never spans segments)
+        Returns: the log position just past the last record, for wait_durable()
+        """
+        data = b''.join(encode_record(reading) for reading in readings)
+
+        with self._cond:
+            if self._closed:
+                raise IngestLogError('Ingest log is closed')
+            if self._file.tell() >= self.segment_max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._written = (self.segment_index, self._file.tell())
+            return self._written
+
+    def wait_durable(self, position, timeout=5.0):
+        """Block until the log has been fsynced at least up to position"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._durable >= position, timeout):
+                raise IngestLogError('Timed out waiting for ingest log fsync')
+
+    def durable_position(self):
+        """Return the position up to which the log is known to be on disk"""
+        with self._cond:
+            return self._durable
+
+    def close(self):
+        """Fsync outstanding records and release the writer directory"""
+        with self._cond:
+            if self._closed:
+                return
+            self._sync()
+            self._closed = True
+            self._file.close()
+        self._thread.join(timeout=1.0)
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+    def _sync(self):
+        """Flush and fsync the active segment; caller holds the lock"""
+        if self._written > self._durable:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._durable = self._written
+            self._cond.notify_all()
+
+    def _rotate(self):
+        """Close the active segment and start the next one; caller holds the lock"""
+        self._sync()
+        self._file.close()
+        self.segment_index += 1
+        self._file = open(segment_path(self.directory, self.segment_index), 'ab')
+        self._written = self._durable = (self.segment_index, 0)
+
+    def _sync_loop(self):
+        """Timer thread: fsync whatever was appended since the last tick"""
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._cond:
+                if self._closed:
+                    return
+                try:
+                    self._sync()
+                except OSError as e:
+                    logger.error(f"Ingest log fsync failed: {str(e)}")
+
+
+class LogReplayer:
+    """
+    Loads logged readings into energy_data and deletes applied segments
+
+    With a live IngestLog only records that are already fsynced are applied;
+    without one (recovering a directory left by a dead process) every
+    complete record in every segment is applied.
+    """
+
+    def __init__(self, app, directory, log=None, batch_size=1000):
+        self.app = app
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        self.log = log
+        self.batch_size = batch_size
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _limit(self):
+        """Return the log position replay must not read past"""
+        if self.log is not None:
+            return self.log.durable_position()
+        segments = list_segments(self.directory)
+        return (segments[-1] + 1 if segments else 0), 0
+
+    def replay(self):
+        """
+        Apply every durable record past the committed offset
+        Returns: number of readings inserted
+        """
+        with self._lock, self.app.app_context():
+            checkpoint = db.session.get(IngestCheckpoint, self.name)
+            if checkpoint is None:
+                # Committed up front so a failed batch's rollback can't discard it
+                checkpoint = IngestCheckpoint(name=self.name, segment=0, position=0)
+                db.session.add(checkpoint)
+                db.session.commit()
+
+            limit_segment, limit_position = self._limit()
+            applied = 0
+
+            for index in list_segments(self.directory):
+                if index < checkpoint.segment or index > limit_segment:
+                    continue
+
+                start = checkpoint.position if index == checkpoint.segment else 0
+                end = limit_position if index == limit_segment else None
+
+                batch = []
+                position = start
+                for record, position in read_records(segment_path(self.directory, index), start, end):
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        applied += self._apply(checkpoint, batch, index, position)
+                        batch = []
+
+                if index < limit_segment:
+                    # Segment is closed; everything readable in it has been applied
+                    applied += self._apply(checkpoint, batch, index + 1, 0)
+                elif batch or position != start:
+                    applied += self._apply(checkpoint, batch, index, position)
+
+            if db.session.dirty or db.session.new:
+                db.session.commit()
+
+            # Applied segments are no longer needed
+            for index in list_segments(self.directory):
+                if index < checkpoint.segment:
+                    os.remove(segment_path(self.directory, index))
+
+            if applied:
+                logger.debug(f"Replayed {applied} readings from ingest log {self.name}")
+            return applied
+
+    def _apply(self, checkpoint, batch, segment, position):
+        """
+        Insert a batch and advance the checkpoint in one transaction
+        Records the database rejects are quarantined in the reject file and skipped;
+        if the database itself is unavailable, nothing is applied and the error is raised.
+        """
+        try:
+            insert_readings(batch)
+        except RETRYABLE_ERRORS:
+            db.session.rollback()
+            raise
+        except Exception:
+            db.session.rollback()
+            rejects = self._find_rejects(batch)
+            self._quarantine(rejects)
+            rejected = {id(record) for record, _ in rejects}
+            batch = [record for record in batch if id(record) not in rejected]
+            insert_readings(batch)
+
+        checkpoint.segment = segment
+        checkpoint.position = position
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(batch)
+
+    def _find_rejects(self, batch):
+        """
+        Return (record, error) for the records of batch that cannot be inserted
+        Halves of the batch are tried in transactions that are always rolled back.
+        """
+        try:
+            insert_readings(batch)
+            return []
+        except RETRYABLE_ERRORS:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                return [(batch[0], str(e))]
+        finally:
+            db.session.rollback()
+        middle = len(batch) // 2
+        return self._find_rejects(batch[:middle]) + self._find_rejects(batch[middle:])
+
+    def _quarantine(self, rejects):
+        """Append rejected records to the reject file and fsync it before the checkpoint moves"""
+        with open(os.path.join(self.directory, REJECT_FILE), 'ab') as f:
+            for record, error in rejects:
+                logger.error(f"Quarantined ingest log record that cannot be stored ({error})")
+                f.write(encode_record(dict(record, reject_reason=error)))
+            f.flush()
+            os.fsync(f.fileno())
+        self.rejected += len(rejects)
+
+
+def recover_orphaned_logs(app, base_dir):
+    """
+    Replay writer directories not locked by any live process
+    (e.g. left behind when the number of gunicorn workers was reduced)
+    Returns: number of readings inserted
+    """
+    applied = 0
+    if not os.path.isdir(base_dir):
+        return applied
+
+    for entry in sorted(os.listdir(base_dir)):
+        directory = os.path.join(base_dir, entry)
+        if not entry.startswith('writer-') or not list_segments(directory):
+            continue
+        with open(os.path.join(directory, 'LOCK'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Owned by a running writer
+            try:
+                applied += LogReplayer(app, directory).replay()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return applied
@@ -0,0 +1,103 @@
+"""
+In-process cache of the latest reading per facility
+
+The ingest endpoints push every stored reading into the cache, so the
+dashboard and the polling APIs can answer "what is the latest reading" without
+a query.  The database is only consulted on a cold start, or every
+refresh_seconds when other processes (e.g. further gunicorn workers) ingest too.
+"""
+import threading
+import time
+
+from models import EnergyData
+
+READING_FIELDS = [
+    'id', 'timestamp', 'facility_id', 'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor',
+    'alert_message', 'alert_level'
+]
+
+# Key of the "latest reading of any facility" entry
+ALL_FACILITIES = None
+
+
+def reading_to_dict(row):
+    """Plain dict of an EnergyData row"""
+    return {field: getattr(row, field) for field in READING_FIELDS}
+
+
+def _is_newer(reading, current):
+    if current is None:
+        return True
+    if reading['timestamp'] != current['timestamp']:
+        return reading['timestamp'] > current['timestamp']
+    # Same timestamp: prefer the row inserted last
+    return (reading.get('id') or 0) >= (current.get('id') or 0)
+
+
+class LatestReadingCache:
+    """Thread-safe map of facility id -> latest reading dict"""
+
+    def __init__(self, refresh_seconds=0):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._checked = {}  # key -> monotonic time the database was last consulted
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, reading):
+        """Record a stored reading (a dict of EnergyData columns; id may be None when queued)"""
+        with self._lock:
+            for key in (reading.get('facility_id'), ALL_FACILITIES):
+                if _is_newer(reading, self._latest.get(key)):
+                    self._latest[key] = dict(reading)
+
+    def update_many(self, readings):
+        for reading in readings:
+            self.update(reading)
+
+    def _needs_load(self, key):
+        checked = self._checked.get(key)
+        if checked is None:
+            return True
+        return bool(self.refresh_seconds) and time.monotonic() - checked > self.refresh_seconds
+
+    def _load(self, key):
+        """Query the latest row for key; must be called inside an application context"""
+        query = EnergyData.query
+        if key is not ALL_FACILITIES:
+            query = query.filter(EnergyData.facility_id == key)
+        row = query.order_by(EnergyData.timestamp.desc()).first()
+        with self._lock:
+            self._checked[key] = time.monotonic()
+            if row is not None:
+                reading = reading_to_dict(row)
+                for cache_key in {key, row.facility_id}:
+                    if _is_newer(reading, self._latest.get(cache_key)):
+                        self._latest[cache_key] = reading
+
+    def get(self, facility_id=ALL_FACILITIES):
+        """Latest reading dict of a facility (or of any facility), or None if there is none"""
+        with self._lock:
+            needs_load = self._needs_load(facility_id)
+            if needs_load:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if needs_load:
+            self._load(facility_id)
+        with self._lock:
+            reading = self._latest.get(facility_id)
+            return dict(reading) if reading else None
+
+    def get_stats(self):
+        with self._lock:
+            return {'facilities': len([k for k in self._latest if k is not ALL_FACILITIES]),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._latest.clear()
+            self._checked.clear()
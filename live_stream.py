@@ -0,0 +1,176 @@
+"""
+Server-Sent Events hub for live facility readings
+
+The ingest endpoints publish every new reading (and any voltage alert) to the
+hub; each connected dashboard has a bounded queue that the SSE response drains.
+A short per-facility backlog lets a reconnecting client replay what it missed
+using the Last-Event-ID header.  Clients that fall too far behind are dropped
+and simply reconnect.
+
+Every open stream holds a worker thread, so the hub accepts at most
+max_clients subscribers per process; further dashboards are refused and
+fall back to polling, which keeps threads free for the other requests.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Queued in place of an event when a slow client is disconnected
+DROPPED = object()
+
+
+def format_event(event_id, event_type, data):
+    """Encode one SSE message"""
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=_json_default)}\n\n'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        # Stored timestamps are naive UTC; mark them so browsers don't read them as local time
+        return value.isoformat() + 'Z' if value.tzinfo is None else value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+class StreamFull(Exception):
+    """Raised when the hub already serves its maximum number of clients"""
+
+
+class Subscription:
+    """One connected client"""
+
+    def __init__(self, facility_id, queue_size):
+        self.facility_id = facility_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class LiveEventHub:
+    """Fan-out of facility events to SSE subscribers, with a replay backlog per facility"""
+
+    def __init__(self, backlog_size=100, client_queue_size=100, heartbeat_seconds=15, max_clients=None):
+        self.backlog_size = backlog_size
+        self.client_queue_size = client_queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._backlog = {}
+        self._subscribers = {}
+        self.published = 0
+        self.dropped_clients = 0
+        self.refused_clients = 0
+        self._clients = 0
+
+    def publish(self, facility_id, event_type, data):
+        """Send an event to every subscriber of the facility; returns its event id"""
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            event = (event_id, event_type, data)
+            self._backlog.setdefault(facility_id, deque(maxlen=self.backlog_size)).append(event)
+            self.published += 1
+
+            for subscription in list(self._subscribers.get(facility_id, ())):
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    # Slow consumer: disconnect it rather than buffer without bound
+                    self._drop(subscription)
+        return event_id
+
+    def publish_reading(self, reading):
+        """Publish a stored reading and, if it raised one, its voltage alert"""
+        facility_id = reading.get('facility_id')
+        self.publish(facility_id, 'reading', reading)
+        if reading.get('alert_message'):
+            self.publish(facility_id, 'alert', {
+                'timestamp': reading['timestamp'],
+                'message': reading['alert_message'],
+                'level': reading['alert_level'],
+                'voltage': reading.get('voltage')
+            })
+
+    def _drop(self, subscription):
+        subscription.dropped = True
+        self._remove(subscription)
+        self.dropped_clients += 1
+        logger.info(f"Dropped slow live stream client of facility {subscription.facility_id}")
+        # Make room for the marker so the stream wakes up and closes
+        try:
+            subscription.queue.get_nowait()
+        except queue.Empty:
+            pass
+        subscription.queue.put_nowait(DROPPED)
+
+    def subscribe(self, facility_id, last_event_id=None):
+        """
+        Register a client; events after last_event_id still in the backlog are queued for replay
+        Returns: Subscription
+        Raises: StreamFull if max_clients streams are already open
+        """
+        subscription = Subscription(facility_id, self.client_queue_size)
+        with self._lock:
+            if self.max_clients is not None and self._clients >= self.max_clients:
+                self.refused_clients += 1
+                raise StreamFull(f'Live stream full ({self.max_clients} clients connected)')
+            # Ids restart with the process; an unknown id means nothing can be replayed
+            if last_event_id is not None and last_event_id < self._next_id:
+                for event in self._backlog.get(facility_id, ()):
+                    if event[0] > last_event_id and not subscription.queue.full():
+                        subscription.queue.put_nowait(event)
+            self._subscribers.setdefault(facility_id, set()).add(subscription)
+            self._clients += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        """Forget a subscriber (once, whether it was dropped or closed); caller holds the lock"""
+        subscribers = self._subscribers.get(subscription.facility_id, set())
+        if subscription in subscribers:
+            subscribers.discard(subscription)
+            self._clients -= 1
+
+    def stream(self, subscription, max_seconds=300, initial=()):
+        """
+        Generator of SSE text for a subscription
+        initial: (event_type, data) pairs sent first without an id (e.g. a snapshot)
+        Ends after max_seconds so worker threads are recycled; browsers reconnect on their own.
+        """
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield 'retry: 3000\n\n'
+            for event_type, data in initial:
+                yield f'event: {event_type}\ndata: {json.dumps(data, default=_json_default)}\n\n'
+
+            while time.monotonic() < deadline:
+                try:
+                    event = subscription.queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ': heartbeat\n\n'
+                    continue
+                if event is DROPPED:
+                    yield 'event: dropped\ndata: {}\n\n'
+                    return
+                yield format_event(*event)
+        finally:
+            self.unsubscribe(subscription)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'clients': self._clients,
+                'max_clients': self.max_clients,
+                'published': self.published,
+                'dropped_clients': self.dropped_clients,
+                'refused_clients': self.refused_clients
+            }
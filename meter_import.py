@@ -0,0 +1,237 @@
+"""
+Bulk import of historical meter exports
+
+Reads a CSV in chunks with pandas and applies the same validation and
+derived fields as build_reading (efficiency, summed phase currents, voltage
+alerts) column-wise with NumPy, then inserts each chunk in one transaction.
+Progress (data rows consumed) is committed with every chunk in
+job_watermark, so an interrupted import resumes where it stopped and
+re-running a finished import only imports the rows appended since.  The
+rows are counted as the parser returns them, not as file lines (blank lines
+are dropped, quoted fields may span lines), so a resumed import parses the
+consumed rows again and drops them instead of skipping lines.
+
+Columns are matched by name: timestamp, energy_produced, energy_consumed and
+current_load are required; facility_id and the electrical fields
+(voltage, current, current1-3, frequency, power_factor) are optional.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from models import db, Facility, JobWatermark
+from ingest import REQUIRED_FIELDS, ELECTRICAL_FIELDS, HIGH_VOLTAGE_THRESHOLD, LOW_VOLTAGE_THRESHOLD, \
+    describe_voltage, insert_readings
+from day_stats import apply_day_stats, day_stats_enabled
+
+logger = logging.getLogger(__name__)
+
+INSERT_COLUMNS = [
+    'timestamp', 'facility_id', 'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor',
+    'alert_message', 'alert_level'
+]
+CSV_COLUMNS = ['timestamp', 'facility_id'] + REQUIRED_FIELDS + ELECTRICAL_FIELDS
+
+
+class MeterImportError(ValueError):
+    """Raised when a file can't be imported at all"""
+
+
+def file_key(path):
+    """
+    Watermark name identifying a file by its path, header and first data row
+    Appending rows keeps the key, so the rows consumed stay the resume point.
+    """
+    digest = hashlib.sha1(os.path.realpath(path).encode())
+    with open(path, 'rb') as f:
+        for _ in range(2):
+            digest.update(f.readline(1 << 20))
+    return f'import:{digest.hexdigest()[:20]}'
+
+
+def _timestamps(values):
+    """ISO-8601 strings or Unix epoch seconds -> naive UTC datetime64[us] (NaT if invalid)"""
+    if pd.api.types.is_numeric_dtype(values):
+        parsed = pd.to_datetime(values, unit='s', errors='coerce', utc=True)
+    else:
+        parsed = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+    return parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[us]')
+
+
+def _numeric(frame, name, rejected):
+    """Column as float64; present but unparseable cells reject their row, missing cells are NaN"""
+    if name not in frame:
+        return np.full(len(frame), np.nan)
+    raw = frame[name]
+    values = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64)
+    rejected |= np.isnan(values) & raw.notna().to_numpy()
+    return values
+
+
+def prepare_chunk(frame, default_facility_id, facility_ids):
+    """
+    Validate a chunk and compute the derived fields like build_reading does
+    Returns: (dict of INSERT_COLUMNS arrays for the accepted rows, number of rejected rows)
+    """
+    n = len(frame)
+    rejected = np.zeros(n, dtype=bool)
+
+    columns = {'timestamp': _timestamps(frame['timestamp'])}
+    rejected |= np.isnat(columns['timestamp'])
+
+    for name in REQUIRED_FIELDS:
+        columns[name] = _numeric(frame, name, rejected)
+        rejected |= np.isnan(columns[name])
+
+    # Unreported electrical parameters count as 0 and are stored as NULL
+    electrical = {name: np.nan_to_num(_numeric(frame, name, rejected)) for name in ELECTRICAL_FIELDS}
+    phases = electrical['current1'] + electrical['current2'] + electrical['current3']
+    electrical['current'] = np.where(
+        (electrical['current1'] > 0) | (electrical['current2'] > 0) | (electrical['current3'] > 0),
+        phases, electrical['current']
+    )
+    for name, values in electrical.items():
+        columns[name] = np.where(values > 0, values, np.nan)
+
+    produced, consumed = columns['energy_produced'], columns['energy_consumed']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['efficiency'] = np.where(produced > 0, np.minimum(100, consumed / produced * 100), 0.0)
+
+    facility = _numeric(frame, 'facility_id', rejected)
+    facility = np.where(np.isnan(facility), default_facility_id or 0, facility).astype(np.int64)
+    rejected |= ~np.isin(facility, list(facility_ids))
+    columns['facility_id'] = facility
+
+    # Only out-of-band voltages can raise an alert; describe them with the ingest rules
+    voltage = columns['voltage']
+    candidates = np.flatnonzero((voltage >= HIGH_VOLTAGE_THRESHOLD) | (voltage <= LOW_VOLTAGE_THRESHOLD))
+    messages = np.full(n, None, dtype=object)
+    levels = np.full(n, None, dtype=object)
+    for i in candidates:
+        messages[i], levels[i] = describe_voltage(float(voltage[i]))
+    columns['alert_message'] = messages
+    columns['alert_level'] = levels
+
+    keep = ~rejected
+    return {name: values[keep] for name, values in columns.items()}, int(rejected.sum())
+
+
+def _nullable(values):
+    """List with NaN replaced by None"""
+    if values.dtype == object:
+        return values.tolist()
+    return np.where(np.isnan(values), None, values.astype(object)).tolist()
+
+
+def sqlite_rows(columns):
+    """Parameter tuples in INSERT_COLUMNS order, timestamps in the text format SQLAlchemy writes"""
+    stamps = np.char.replace(np.datetime_as_string(columns['timestamp'], unit='us'), 'T', ' ').tolist()
+    # SQLite binds NaN as NULL, so float columns can go in as they are
+    values = [stamps] + [columns[name].tolist() for name in INSERT_COLUMNS[1:]]
+    return list(zip(*values))
+
+
+def insert_chunk(columns, rows=None):
+    """Insert prepared columns in the current transaction (rows: their sqlite_rows, if already built)"""
+    count = len(columns['timestamp'])
+    if not count:
+        return
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        # Straight to the driver, no per-row bind processing
+        placeholders = ', '.join('?' for _ in INSERT_COLUMNS)
+        connection.exec_driver_sql(
+            f'INSERT INTO energy_data ({", ".join(INSERT_COLUMNS)}) VALUES ({placeholders})',
+            rows if rows is not None else sqlite_rows(columns)
+        )
+        if day_stats_enabled():
+            apply_day_stats(columns['facility_id'], columns['timestamp'],
+                            columns['energy_produced'], columns['energy_consumed'])
+        return
+
+    # Other databases: reuse the ingest path (COPY on PostgreSQL)
+    stamps = columns['timestamp'].astype(object)
+    values = {name: _nullable(columns[name]) for name in INSERT_COLUMNS[2:]}
+    insert_readings([
+        dict({'timestamp': stamps[i], 'facility_id': int(columns['facility_id'][i])},
+             **{name: values[name][i] for name in values})
+        for i in range(count)
+    ])
+
+
+def import_readings(path, facility_id=None, chunk_size=50000, restart=False, progress=None):
+    """
+    Import a CSV of readings, one transaction per chunk
+    Must be called inside an application context.
+    progress(rows_done, accepted, rejected) is called after every chunk.
+    Returns: (accepted, rejected, skipped) row counts; skipped rows were imported by an earlier run
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    missing = [name for name in ['timestamp'] + REQUIRED_FIELDS if name not in header]
+    if missing:
+        raise MeterImportError(f'Missing required column(s): {", ".join(missing)}')
+
+    facility_ids = set(db.session.execute(select(Facility.id)).scalars())
+    if facility_id is not None and facility_id not in facility_ids:
+        raise MeterImportError(f'Unknown facility: {facility_id}')
+    if facility_id is None and 'facility_id' not in header:
+        facility_id = min(facility_ids) if facility_ids else None
+
+    key = file_key(path)
+    watermark = db.session.get(JobWatermark, key)
+    if watermark is None:
+        watermark = JobWatermark(name=key, last_id=0)  # last_id = data rows consumed
+        db.session.add(watermark)
+    elif restart:
+        watermark.last_id = 0
+    db.session.commit()
+    skipped = watermark.last_id
+    if skipped:
+        logger.info(f"Resuming import of {path} after {skipped} rows")
+
+    reader = pd.read_csv(path, usecols=lambda name: name in CSV_COLUMNS, chunksize=chunk_size)
+    sqlite = db.session.connection().dialect.name == 'sqlite'
+    to_skip = skipped
+
+    def next_chunk():
+        nonlocal to_skip
+        for frame in reader:
+            if to_skip:
+                dropped = min(to_skip, len(frame))
+                frame = frame.iloc[dropped:]
+                to_skip -= dropped
+            if len(frame):
+                break
+        else:
+            return None
+        columns, chunk_rejected = prepare_chunk(frame, facility_id, facility_ids)
+        return len(frame), columns, chunk_rejected, sqlite_rows(columns) if sqlite else None
+
+    # Parse and prepare the next chunk on a worker thread while this one is inserted
+    # (the CSV parser and SQLite both release the GIL for most of their work)
+    accepted = rejected = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(next_chunk)
+        while True:
+            chunk = pending.result()
+            if chunk is None:
+                break
+            pending = pool.submit(next_chunk)
+
+            consumed, columns, chunk_rejected, rows = chunk
+            insert_chunk(columns, rows)
+            watermark.last_id += consumed
+            db.session.commit()  # rows and progress together
+
+            accepted += len(columns['timestamp'])
+            rejected += chunk_rejected
+            if progress:
+                progress(watermark.last_id, accepted, rejected)
+
+    return accepted, rejected, skipped
@@ -0,0 +1,185 @@
+"""
+Schema migrations for databases created by older versions of the app
+
+db.create_all() only creates missing tables; it never adds indexes to a
+table that already exists, so indexes are built here and the planner is
+checked afterwards to make sure the hot queries actually use them.  Nor does
+it change a table's definition, so a SQLite energy_data table created
+without AUTOINCREMENT is rebuilt here.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable, MetaData
+
+from models import db, EnergyData
+
+logger = logging.getLogger(__name__)
+
+# Hot queries from app.py, used to verify the query plans after migrating
+HOT_QUERIES = {
+    'latest_reading': (
+        "SELECT id FROM energy_data WHERE timestamp >= :since ORDER BY timestamp DESC LIMIT 1"
+    ),
+    'time_window': (
+        "SELECT id FROM energy_data WHERE timestamp >= :since ORDER BY timestamp"
+    ),
+    'facility_window': (
+        "SELECT id FROM energy_data WHERE facility_id = :facility_id AND timestamp >= :since "
+        "ORDER BY timestamp"
+    ),
+}
+
+
+def prepare_new_database(engine):
+    """
+    Apply settings that can only be chosen before the first table is created
+    (incremental auto-vacuum lets the retention job shrink SQLite files)
+    """
+    if engine.dialect.name != 'sqlite' or inspect(engine).get_table_names():
+        return
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+        # VACUUM writes the setting into the (still empty) database header
+        conn.execute(text('VACUUM'))
+
+
+# Indexes that only exist on PostgreSQL. A BRIN index on the append-ordered timestamp
+# column is a few pages in size and lets large time-range scans skip whole blocks.
+POSTGRES_INDEXES = {
+    'ix_energy_data_timestamp_brin': 'CREATE INDEX ix_energy_data_timestamp_brin ON energy_data USING brin (timestamp)',
+}
+
+
+def ensure_postgres_indexes(engine):
+    """
+    Create the PostgreSQL-only indexes that are missing
+    Returns: list of created index names
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    existing = {index['name'] for index in inspect(engine).get_indexes('energy_data')}
+    created = []
+    for name, ddl in POSTGRES_INDEXES.items():
+        if name in existing:
+            continue
+        logger.info(f"Building index {name} on energy_data")
+        with engine.begin() as conn:
+            conn.execute(text(ddl))
+        created.append(name)
+    return created
+
+
+def ensure_indexes(engine):
+    """
+    Create any index declared on the models that is missing from the database
+    Returns: list of created index names
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info(f"Building index {index.name} on {table.name}")
+            index.create(bind=engine)
+            created.append(index.name)
+
+    if created:
+        # Refresh planner statistics so the new indexes are chosen
+        with engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+
+    return created
+
+
+def explain(engine, sql, params=None):
+    """Return the query plan for sql as a list of text lines"""
+    if engine.dialect.name == 'sqlite':
+        statement = f'EXPLAIN QUERY PLAN {sql}'
+        column = -1  # detail column
+    else:
+        statement = f'EXPLAIN {sql}'
+        column = 0
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(statement), params or {}).fetchall()
+    return [str(row[column]) for row in rows]
+
+
+def check_query_plans(engine):
+    """
+    Verify the hot energy_data queries are served by an index
+    Returns: dict mapping query name to (uses_index, plan lines)
+    """
+    params = {'since': datetime.utcnow() - timedelta(days=1), 'facility_id': 1}
+    results = {}
+    for name, sql in HOT_QUERIES.items():
+        plan = explain(engine, sql, params)
+        plan_text = ' '.join(plan)
+        # SQLite reports "SCAN energy_data" and Postgres "Seq Scan" for full table scans
+        uses_index = 'USING' in plan_text.upper() or 'INDEX' in plan_text.upper()
+        if not uses_index:
+            logger.warning(f"Query '{name}' is not using an index: {plan_text}")
+        results[name] = (uses_index, plan)
+    return results
+
+
+def ensure_sqlite_autoincrement(engine):
+    """
+    Rebuild a SQLite energy_data table created without AUTOINCREMENT
+    Without it SQLite hands the ids of deleted rows at the end of the table out again, and the
+    background jobs, which track readings by id, would skip the new readings that got them.
+    The rows are copied to a new table, which replaces the old one; its indexes are recreated
+    by ensure_indexes().  The id sequence starts past every id a job has already processed.
+    Returns: True if the table was rebuilt
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        ddl = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'energy_data'")
+        ).scalar()
+    if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+        return False
+
+    table = EnergyData.__table__
+    metadata = MetaData()
+    db.metadata.tables['facility'].to_metadata(metadata)  # resolves the facility_id foreign key
+    rebuilt = table.to_metadata(metadata, name='energy_data_rebuilt')
+    columns = ', '.join(column.name for column in table.columns)
+    logger.info("Rebuilding energy_data with AUTOINCREMENT ids")
+    with engine.begin() as conn:
+        conn.execute(CreateTable(rebuilt))
+        conn.execute(text(f'INSERT INTO energy_data_rebuilt ({columns}) SELECT {columns} FROM energy_data'))
+        last_id = conn.execute(text('SELECT max(id) FROM energy_data')).scalar() or 0
+        if inspect(conn).has_table('job_watermark'):
+            # Import watermarks count file rows, not ids
+            processed = conn.execute(
+                text("SELECT max(last_id) FROM job_watermark WHERE name NOT LIKE 'import:%'")
+            ).scalar()
+            last_id = max(last_id, processed or 0)
+        conn.execute(text('DROP TABLE energy_data'))
+        conn.execute(text('ALTER TABLE energy_data_rebuilt RENAME TO energy_data'))
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'energy_data'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('energy_data', :seq)"), {'seq': last_id})
+    return True
+
+
+def run_migrations(engine):
+    """Apply all pending migrations to an existing database"""
+    ensure_sqlite_autoincrement(engine)
+    created = ensure_indexes(engine) + ensure_postgres_indexes(engine)
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+        for name, (uses_index, plan) in check_query_plans(engine).items():
+            logger.info(f"Query plan for {name}: {' | '.join(plan)}")
+    return created
@@ -4,6 +4,47 @@ ML Predictor module for energy consumption forecasting
 import numpy as np
 from datetime import datetime, timedelta
 
+def _column(data, name):
+    """Return one field of either a list of reading dicts or a dict of column arrays"""
+    if isinstance(data, dict):
+        return data[name]
+    return [d[name] for d in data]
+
+
+def _factor_array(sums, counts, baseline):
+    """Mean of each group relative to the baseline; 1.0 for groups without readings"""
+    factors = np.ones(len(sums))
+    present = counts > 0
+    factors[present] = sums[present] / counts[present] / max(1, baseline)
+    return factors
+
+
+def _factors(sums, counts, baseline):
+    """{group: factor} for the groups (hours or weekdays) that have readings"""
+    factors = _factor_array(sums, counts, baseline)
+    return {int(group): float(factors[group]) for group in np.flatnonzero(counts)}
+
+
+def _hours_and_weekdays(data):
+    """Return hour-of-day and weekday (Monday=0) arrays for the readings' timestamps"""
+    if isinstance(data, dict):
+        timestamps = np.asarray(data['timestamp']).astype('datetime64[s]')
+        hours = timestamps.astype('datetime64[h]').astype(np.int64) % 24
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekdays = (timestamps.astype('datetime64[D]').astype(np.int64) + 3) % 7
+        return hours, weekdays
+    hours = np.array([d['timestamp'].hour for d in data], dtype=np.int64)
+    weekdays = np.array([d['timestamp'].weekday() for d in data], dtype=np.int64)
+    return hours, weekdays
+
+
+def _last_timestamp(data):
+    """Timestamp of the last reading as a datetime"""
+    if isinstance(data, dict):
+        return np.datetime64(data['timestamp'][-1], 'us').item()
+    return data[-1]['timestamp']
+
+
 class EnergyPredictor:
     """
     Simple energy consumption predictor using historical data patterns
@@ -14,87 +55,128 @@ class EnergyPredictor:
         self.daily_patterns = None
         self.baseline = None
         self.validation_score = None
+        self.version = 0  # bumped on every training run; part of the predictions ETag
+        self.revision = 0  # bumped on every online update of this in-memory model; part of the ETag too
+        self.trained_at = None
+        self.watermark = None  # data watermark the model was trained up to (see model_store.py)
+        self.facility_id = None  # facility whose readings the model was trained on
+        
+        # Running consumption sums and (time-weighted) counts per hour of day and weekday,
+        # kept so update() can fold in new readings without re-reading the history
+        self.hour_sums = None
+        self.hour_counts = None
+        self.day_sums = None
+        self.day_counts = None
+        self.last_timestamp = None
     
-    def train(self, historical_data):
+    def train(self, historical_data, validate=True):
         """
         Train the predictor on historical energy data
-        Returns: validation score (mean absolute percentage error)
+        Accepts a list of reading dicts or a dict of column arrays
+        ('timestamp' as datetime64 and 'energy_consumed'), e.g. from the archive
+        validate=False skips the holdout check
+        Returns: validation score (100 - mean absolute percentage error on the last 24 points)
         """
-        if len(historical_data) < 24:
+        if len(_column(historical_data, 'energy_consumed')) < 24:
             return 0
         
-        # Extract consumption values and timestamps
-        consumption = np.array([d['energy_consumed'] for d in historical_data])
-        timestamps = [d['timestamp'] for d in historical_data]
-        
-        # Calculate baseline (average consumption)
-        self.baseline = np.mean(consumption)
-        
-        # Extract hourly patterns (how consumption varies by hour of day)
-        self.hourly_patterns = {}
-        for i, ts in enumerate(timestamps):
-            hour = ts.hour
-            if hour not in self.hourly_patterns:
-                self.hourly_patterns[hour] = []
-            
-            # Store relative value (compared to baseline)
-            self.hourly_patterns[hour].append(consumption[i] / max(1, self.baseline))
+        # Extract consumption values and the hour/weekday of each timestamp
+        consumption = np.asarray(_column(historical_data, 'energy_consumed'), dtype=np.float64)
+        hours, weekdays = _hours_and_weekdays(historical_data)
         
-        # Average hourly patterns
-        for hour in self.hourly_patterns:
-            if self.hourly_patterns[hour]:
-                self.hourly_patterns[hour] = np.mean(self.hourly_patterns[hour])
-            else:
-                self.hourly_patterns[hour] = 1.0
+        # Per hour of day and per weekday: consumption sums and reading counts
+        hour_sums = np.bincount(hours, weights=consumption, minlength=24)
+        hour_counts = np.bincount(hours, minlength=24).astype(np.float64)
+        day_sums = np.bincount(weekdays, weights=consumption, minlength=7)
+        day_counts = np.bincount(weekdays, minlength=7).astype(np.float64)
         
-        # Extract daily patterns (how consumption varies by day of week)
-        self.daily_patterns = {}
-        for i, ts in enumerate(timestamps):
-            day = ts.weekday()
-            if day not in self.daily_patterns:
-                self.daily_patterns[day] = []
-            
-            # Store relative value (compared to baseline)
-            self.daily_patterns[day].append(consumption[i] / max(1, self.baseline))
-        
-        # Average daily patterns
-        for day in self.daily_patterns:
-            if self.daily_patterns[day]:
-                self.daily_patterns[day] = np.mean(self.daily_patterns[day])
-            else:
-                self.daily_patterns[day] = 1.0
+        # Calculate baseline (average consumption); the hourly and daily patterns
+        # (mean consumption of each hour / weekday) are stored relative to it
+        self.baseline = np.mean(consumption)
+        self.hourly_patterns = _factors(hour_sums, hour_counts, self.baseline)
+        self.daily_patterns = _factors(day_sums, day_counts, self.baseline)
         
-        # Simple validation: predict last 24 points and compare with actual
-        if len(historical_data) > 48:
-            train_data = historical_data[:-24]
-            test_data = historical_data[-24:]
+        # Simple validation: fit on all but the last 24 points, predict those and compare.
+        # The holdout model's sums are the totals minus the last 24 points' share
+        if not validate:
+            self.validation_score = None
+        elif len(consumption) > 48:
+            test_hours, test_days = hours[-24:], weekdays[-24:]
+            actual_values = consumption[-24:]
             
-            # Create temporary predictor for validation
-            temp_predictor = EnergyPredictor()
-            temp_predictor.train(train_data)
+            train_hour_sums = hour_sums - np.bincount(test_hours, weights=actual_values, minlength=24)
+            train_hour_counts = hour_counts - np.bincount(test_hours, minlength=24)
+            train_day_sums = day_sums - np.bincount(test_days, weights=actual_values, minlength=7)
+            train_day_counts = day_counts - np.bincount(test_days, minlength=7)
+            train_baseline = np.mean(consumption[:-24])
             
-            # Make predictions for test data
-            test_timestamps = [d['timestamp'] for d in test_data]
-            actual_values = [d['energy_consumed'] for d in test_data]
-            predicted_values = []
-            
-            for ts in test_timestamps:
-                hour_factor = temp_predictor.hourly_patterns.get(ts.hour, 1.0)
-                day_factor = temp_predictor.daily_patterns.get(ts.weekday(), 1.0)
-                
-                # Combine factors to predict consumption
-                prediction = temp_predictor.baseline * hour_factor * day_factor
-                predicted_values.append(prediction)
+            # Hours or weekdays missing from the training part get a factor of 1.0
+            hour_factors = _factor_array(train_hour_sums, train_hour_counts, train_baseline)
+            day_factors = _factor_array(train_day_sums, train_day_counts, train_baseline)
+            predicted_values = train_baseline * hour_factors[test_hours] * day_factors[test_days]
             
             # Calculate Mean Absolute Percentage Error
-            mape = np.mean(np.abs((np.array(actual_values) - np.array(predicted_values)) / np.array(actual_values))) * 100
+            mape = np.mean(np.abs((actual_values - predicted_values) / actual_values)) * 100
             self.validation_score = max(0, 100 - mape)  # Convert to accuracy score
         else:
             self.validation_score = 70  # Default score for limited data
         
+        self.hour_sums, self.hour_counts = hour_sums, hour_counts
+        self.day_sums, self.day_counts = day_sums, day_counts
+        self.last_timestamp = _last_timestamp(historical_data)
         self.is_trained = True
+        self.version += 1
         return self.validation_score
     
+    def update(self, reading, half_life_days=None):
+        """
+        Fold one new reading into the trained model (online mode), see update_many()
+        Returns: True if the model changed
+        """
+        return self.update_many([reading], half_life_days)
+    
+    def update_many(self, readings, half_life_days=None):
+        """
+        Fold new readings into the trained model's running sums and refresh its factors
+        Each reading is weighted by the hours elapsed since the previous one (at most 1),
+        so an hour of readings counts as much as one hourly training point; readings
+        older than the newest one seen are skipped.  Readings dated in the future (a device
+        clock running ahead) count as taken now, so they can't make later readings look old.
+        half_life_days: optional exponential decay of everything seen before, so old seasons fade
+        Returns: True if the model changed
+        """
+        if not self.is_trained or self.hour_sums is None:
+            return False
+        
+        now = datetime.utcnow()
+        changed = False
+        for reading in sorted(readings, key=lambda reading: reading['timestamp']):
+            timestamp = min(reading['timestamp'], now)
+            elapsed_hours = (timestamp - self.last_timestamp).total_seconds() / 3600
+            if elapsed_hours <= 0:
+                continue
+            
+            if half_life_days:
+                decay = 0.5 ** (elapsed_hours / (half_life_days * 24))
+                for values in (self.hour_sums, self.hour_counts, self.day_sums, self.day_counts):
+                    values *= decay
+            
+            weight = min(elapsed_hours, 1.0)
+            hour, day = timestamp.hour, timestamp.weekday()
+            self.hour_sums[hour] += weight * reading['energy_consumed']
+            self.hour_counts[hour] += weight
+            self.day_sums[day] += weight * reading['energy_consumed']
+            self.day_counts[day] += weight
+            self.last_timestamp = timestamp
+            changed = True
+        
+        if changed:
+            self.revision += 1
+            self.baseline = self.hour_sums.sum() / self.hour_counts.sum()
+            self.hourly_patterns = _factors(self.hour_sums, self.hour_counts, self.baseline)
+            self.daily_patterns = _factors(self.day_sums, self.day_counts, self.baseline)
+        return changed
+    
     def predict(self, current_data, horizon=24):
         """
         Predict energy consumption for the next 'horizon' hours
@@ -133,5 +215,45 @@ class EnergyPredictor:
         
         return predictions
 
+    def to_dict(self):
+        """Return the fitted model as JSON-serializable data"""
+        return {
+            'is_trained': self.is_trained,
+            'baseline': None if self.baseline is None else float(self.baseline),
+            'hourly_patterns': {str(hour): float(factor) for hour, factor in (self.hourly_patterns or {}).items()},
+            'daily_patterns': {str(day): float(factor) for day, factor in (self.daily_patterns or {}).items()},
+            'validation_score': None if self.validation_score is None else float(self.validation_score),
+            'version': self.version,
+            'trained_at': self.trained_at.isoformat() if self.trained_at else None,
+            'watermark': self.watermark,
+            'facility_id': self.facility_id,
+            'hour_sums': None if self.hour_sums is None else self.hour_sums.tolist(),
+            'hour_counts': None if self.hour_counts is None else self.hour_counts.tolist(),
+            'day_sums': None if self.day_sums is None else self.day_sums.tolist(),
+            'day_counts': None if self.day_counts is None else self.day_counts.tolist(),
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a predictor saved with to_dict()"""
+        model = cls()
+        model.is_trained = data['is_trained']
+        model.baseline = data['baseline']
+        model.hourly_patterns = {int(hour): factor for hour, factor in data['hourly_patterns'].items()}
+        model.daily_patterns = {int(day): factor for day, factor in data['daily_patterns'].items()}
+        model.validation_score = data['validation_score']
+        model.version = data['version']
+        model.trained_at = datetime.fromisoformat(data['trained_at']) if data['trained_at'] else None
+        model.watermark = data['watermark']
+        # Models saved before online updates have no running sums; update() skips them
+        model.facility_id = data.get('facility_id')
+        for name in ('hour_sums', 'hour_counts', 'day_sums', 'day_counts'):
+            if data.get(name) is not None:
+                setattr(model, name, np.array(data[name], dtype=np.float64))
+        if data.get('last_timestamp'):
+            model.last_timestamp = datetime.fromisoformat(data['last_timestamp'])
+        return model
+
 # Create a singleton instance
 predictor = EnergyPredictor()
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Persisted EnergyPredictor shared by the request handlers and the training job
+
+Training reads weeks of rollups, so it runs in a scheduled job instead of on
+every /ml-dashboard or /api/predictions request.  The job trains a new model
+only when the data watermark (the rollup job's last processed reading id) has
+moved since the current model was fitted, and saves it as JSON with an atomic
+rename.  Requests just return the model in memory, reloading the file when
+its mtime changes, so every gunicorn worker serves the latest model while
+only one of them (whichever holds the lock file) does the training.
+
+With online updates, each worker also folds the readings it receives into
+its in-memory model (EnergyPredictor.update_many) between trainings; a newly
+saved model replaces those updates, since it was fitted on the same readings.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from ml_predictor import EnergyPredictor
+
+logger = logging.getLogger(__name__)
+
+# Training needs more than a day of hourly points
+MIN_TRAINING_POINTS = 25
+
+
+class ModelStore:
+    """The current EnergyPredictor, backed by a JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._model = EnergyPredictor()
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current model, reloading it if another process saved a newer one"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self._model
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        with open(self.path) as f:
+                            self._model = EnergyPredictor.from_dict(json.load(f))
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.error(f"Could not load the model from {self.path}: {str(e)}")
+                    self._mtime = mtime
+        return self._model
+
+    def save(self, model):
+        """Write the model to disk atomically and make it the current one"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(model.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._model = model
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def update(self, readings, half_life_days=None):
+        """
+        Fold new readings of the model's facility into the current model
+        Returns: True if the model changed
+        """
+        model = self.get()
+        readings = [reading for reading in readings if reading['facility_id'] == model.facility_id]
+        if not readings:
+            return False
+        with self._lock:
+            return model.update_many(readings, half_life_days)
+
+    def train(self, watermark, load_data, facility_id=None):
+        """
+        Train and save a new model unless the current one already covers watermark
+        load_data(): the data points to train on; only called when training
+        facility_id: the facility load_data() reads, whose readings update() folds in
+        Returns: the new model, or None if training was skipped
+        """
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None  # another worker is training
+
+            current = self.get()
+            if current.is_trained and current.watermark == watermark:
+                return None
+
+            data_points = load_data()
+            if len(data_points) < MIN_TRAINING_POINTS:
+                return None
+
+            model = EnergyPredictor()
+            model.train(data_points)
+            model.version = current.version + 1
+            model.trained_at = datetime.utcnow()
+            # The last hourly point covers readings up to now; update() continues from here
+            model.last_timestamp = max(model.last_timestamp, model.trained_at)
+            model.watermark = watermark
+            model.facility_id = facility_id
+            self.save(model)
+            return model
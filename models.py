@@ -3,7 +3,9 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from storage import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -38,6 +40,8 @@ class Facility(db.Model):
 
 class EnergyData(db.Model):
     __tablename__ = 'energy_data'
+    # Never hand out the id of a deleted row again: the background jobs track readings by id
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -60,4 +64,106 @@ class EnergyData(db.Model):
     alert_message = db.Column(db.String(255), nullable=True)
     alert_level = db.Column(db.String(50), nullable=True)  # "info", "warning", "critical"
 
-    facility = db.relationship('Facility', back_populates='energy_records')
\ No newline at end of file
+    facility = db.relationship('Facility', back_populates='energy_records')
+
+
+# Hot queries filter readings by facility and/or a timestamp window and order by time;
+# the descending index serves the "latest reading" lookups
+db.Index('ix_energy_data_facility_timestamp', EnergyData.facility_id, EnergyData.timestamp)
+db.Index('ix_energy_data_timestamp_desc', EnergyData.timestamp.desc())
+
+
+class IngestCheckpoint(db.Model):
+    __tablename__ = 'ingest_checkpoint'
+
+    # One row per ingest log writer directory
+    name = db.Column(db.String(100), primary_key=True)
+    segment = db.Column(db.Integer, nullable=False, default=0)
+    position = db.Column(db.BigInteger, nullable=False, default=0)  # byte offset within segment
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Metrics aggregated into EnergyRollup buckets
+ROLLUP_METRICS = [
+    'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'frequency', 'power_factor'
+]
+
+
+class EnergyRollup(db.Model):
+    __tablename__ = 'energy_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # bucket width in seconds
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)  # readings in the bucket
+
+    __table_args__ = (
+        db.UniqueConstraint('facility_id', 'resolution', 'bucket_start', name='uq_energy_rollup_bucket'),
+    )
+
+    def mean(self, metric):
+        """Mean of a metric over the bucket, or None if it was never reported"""
+        count = getattr(self, f'{metric}_count')
+        return getattr(self, f'{metric}_sum') / count if count else None
+
+
+# Per-metric aggregates: <metric>_count (non-null readings), _sum, _min, _max and _sumsq
+for _metric in ROLLUP_METRICS:
+    setattr(EnergyRollup, f'{_metric}_count', db.Column(db.Integer, nullable=False, default=0))
+    setattr(EnergyRollup, f'{_metric}_sum', db.Column(db.Float, nullable=False, default=0.0))
+    setattr(EnergyRollup, f'{_metric}_min', db.Column(db.Float, nullable=True))
+    setattr(EnergyRollup, f'{_metric}_max', db.Column(db.Float, nullable=True))
+    setattr(EnergyRollup, f'{_metric}_sumsq', db.Column(db.Float, nullable=False, default=0.0))
+
+
+class EnergyDayStats(db.Model):
+    __tablename__ = 'energy_day_stats'
+
+    # Running statistics of one facility's readings on one UTC day, updated on ingest (see day_stats.py)
+    id = db.Column(db.Integer, primary_key=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    hour_counts = db.Column(db.LargeBinary, nullable=False)  # 24 int64 readings per hour of day
+    hour_consumed = db.Column(db.LargeBinary, nullable=False)  # 24 float64 energy_consumed sums per hour
+
+    __table_args__ = (
+        db.UniqueConstraint('facility_id', 'day', name='uq_energy_day_stats_day'),
+    )
+
+
+# Welford state per metric: _mean, _m2 (sum of squared deviations), _min and _max
+for _key in ('production', 'consumption'):
+    setattr(EnergyDayStats, f'{_key}_mean', db.Column(db.Float, nullable=False, default=0.0))
+    setattr(EnergyDayStats, f'{_key}_m2', db.Column(db.Float, nullable=False, default=0.0))
+    setattr(EnergyDayStats, f'{_key}_min', db.Column(db.Float, nullable=True))
+    setattr(EnergyDayStats, f'{_key}_max', db.Column(db.Float, nullable=True))
+
+
+class JobWatermark(db.Model):
+    __tablename__ = 'job_watermark'
+
+    # Highest EnergyData.id processed by a background job (e.g. "rollup")
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EnergyBlock(db.Model):
+    __tablename__ = 'energy_block'
+
+    # Compressed readings of one facility over a closed time window (see block_encoding.py)
+    id = db.Column(db.Integer, primary_key=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
+    block_start = db.Column(db.DateTime, nullable=False)
+    block_end = db.Column(db.DateTime, nullable=False)
+    reading_count = db.Column(db.Integer, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)  # EnergyData id range packed into the block
+    last_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_energy_block_facility_start', 'facility_id', 'block_start'),
+    )
@@ -0,0 +1,106 @@
+"""
+Retention and tiering policy for energy data
+
+Raw readings are kept for a configurable number of days, 1-minute rollups
+for a configurable number of months, and hourly/daily rollups forever.
+Deletes run in small chunks with a commit after each one so the SQLite
+write lock is only ever held briefly and ingest can continue in between.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, text
+
+from models import db, EnergyData, EnergyRollup, JobWatermark
+from rollups import MINUTE, WATERMARK_NAME as ROLLUP_WATERMARK
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_chunks(model, conditions, chunk_size, pause):
+    """Delete rows matching conditions chunk_size at a time; returns rows deleted"""
+    deleted = 0
+    while True:
+        chunk = select(model.id).where(*conditions).limit(chunk_size)
+        result = db.session.execute(delete(model).where(model.id.in_(chunk)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+        # Give ingest a chance to take the write lock between chunks
+        time.sleep(pause)
+
+
+def _sqlite_pragma(name):
+    return db.session.execute(text(f'PRAGMA {name}')).scalar()
+
+
+def incremental_vacuum(max_pages_per_step=1000, pause=0.05):
+    """
+    Return free SQLite pages to the filesystem in small steps
+    Returns: bytes reclaimed (0 when the database is not SQLite or not in incremental mode)
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return 0  # PostgreSQL autovacuum reclaims dead tuples on its own
+
+    if _sqlite_pragma('auto_vacuum') != 2:  # 2 = INCREMENTAL
+        logger.info("SQLite auto_vacuum is not INCREMENTAL; freed pages will be reused but "
+                    "the file will only shrink after a manual VACUUM")
+        return 0
+
+    page_size = _sqlite_pragma('page_size')
+    before = _sqlite_pragma('page_count')
+    free_pages = _sqlite_pragma('freelist_count')
+    while free_pages:
+        db.session.execute(text(f'PRAGMA incremental_vacuum({max_pages_per_step})'))
+        db.session.commit()
+        remaining = _sqlite_pragma('freelist_count')
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+        time.sleep(pause)
+    return (before - _sqlite_pragma('page_count')) * page_size
+
+
+def apply_retention(raw_days, minute_rollup_days, chunk_size=5000, pause=0.05, watermarks=None):
+    """
+    Delete aged raw readings and 1-minute rollups, then reclaim space
+    Raw readings are only deleted once every job in watermarks (default: the rollups)
+    has processed them.
+    Must be called inside an application context.
+    Returns: report dict with rows removed and bytes reclaimed
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    report = {
+        'raw_rows_deleted': 0,
+        'minute_rollups_deleted': 0,
+        'bytes_reclaimed': 0
+    }
+
+    if raw_days:
+        processed_id = min(
+            getattr(db.session.get(JobWatermark, name), 'last_id', 0)
+            for name in (watermarks or [ROLLUP_WATERMARK])
+        )
+        report['raw_rows_deleted'] = delete_in_chunks(
+            EnergyData,
+            [EnergyData.timestamp < now - timedelta(days=raw_days), EnergyData.id <= processed_id],
+            chunk_size,
+            pause
+        )
+
+    if minute_rollup_days:
+        report['minute_rollups_deleted'] = delete_in_chunks(
+            EnergyRollup,
+            [EnergyRollup.resolution == MINUTE, EnergyRollup.bucket_start < now - timedelta(days=minute_rollup_days)],
+            chunk_size,
+            pause
+        )
+
+    if report['raw_rows_deleted'] or report['minute_rollups_deleted']:
+        report['bytes_reclaimed'] = incremental_vacuum(pause=pause)
+
+    report['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return report
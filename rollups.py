@@ -0,0 +1,309 @@
+"""
+Incrementally maintained rollups of energy_data
+
+Readings are aggregated per facility into 1-minute, 1-hour and 1-day buckets
+holding count, sum, min, max and sum of squares for each metric, so means,
+extremes and standard deviations of any window can be computed without
+touching the raw rows.  A scheduled job folds in only the rows inserted since
+the last run (tracked by EnergyData.id in job_watermark, up to
+watermarks.settled_id() so ids committed out of order are not skipped).
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, select, update
+
+from models import db, EnergyData, EnergyRollup, JobWatermark, ROLLUP_METRICS
+from watermarks import settled_id
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = [MINUTE, HOUR, DAY]
+
+# Charts should have at least this many points before a coarser rollup is used
+MIN_CHART_POINTS = 48
+
+WATERMARK_NAME = 'rollup'
+
+_update_lock = threading.Lock()
+
+
+def choose_resolution(window, min_points=MIN_CHART_POINTS):
+    """
+    Pick the coarsest rollup resolution that still gives min_points buckets over window
+    Returns: resolution in seconds, or None if raw readings should be used
+    """
+    seconds = window.total_seconds()
+    for resolution in sorted(RESOLUTIONS, reverse=True):
+        if seconds / resolution >= min_points:
+            return resolution
+    return None
+
+
+def aggregate_columns(facility_ids, epoch_seconds, metrics, resolution):
+    """
+    Aggregate readings into buckets of the given resolution
+    facility_ids and epoch_seconds are int64 arrays; metrics maps names to float arrays (NaN = missing)
+    Returns: dict of arrays keyed like the EnergyRollup columns, one entry per bucket
+    """
+    buckets = epoch_seconds // resolution * resolution
+    # Facility ids and bucket starts both fit in 32 bits, so pack them into one sort key
+    keys = (facility_ids.astype(np.int64) << 32) | buckets.astype(np.int64)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    size = len(unique_keys)
+
+    result = {
+        'facility_id': unique_keys >> 32,
+        'bucket_start': unique_keys & 0xFFFFFFFF,
+        'count': np.bincount(inverse, minlength=size).astype(np.int64)
+    }
+
+    for metric, values in metrics.items():
+        valid = ~np.isnan(values)
+        clean = np.where(valid, values, 0.0)
+        result[f'{metric}_count'] = np.bincount(inverse, weights=valid, minlength=size).astype(np.int64)
+        result[f'{metric}_sum'] = np.bincount(inverse, weights=clean, minlength=size)
+        result[f'{metric}_sumsq'] = np.bincount(inverse, weights=clean * clean, minlength=size)
+
+        minimum = np.full(size, np.inf)
+        maximum = np.full(size, -np.inf)
+        np.minimum.at(minimum, inverse[valid], values[valid])
+        np.maximum.at(maximum, inverse[valid], values[valid])
+        result[f'{metric}_min'] = minimum
+        result[f'{metric}_max'] = maximum
+
+    return result
+
+
+def _empty_bucket(facility_id, resolution, bucket_start):
+    """Column values of a new, empty EnergyRollup row"""
+    bucket = {'facility_id': facility_id, 'resolution': resolution, 'bucket_start': bucket_start, 'count': 0}
+    for metric in ROLLUP_METRICS:
+        bucket.update({
+            f'{metric}_count': 0,
+            f'{metric}_sum': 0.0,
+            f'{metric}_min': None,
+            f'{metric}_max': None,
+            f'{metric}_sumsq': 0.0
+        })
+    return bucket
+
+
+def _merge_bucket(bucket, aggregates, i):
+    """Fold bucket i of an aggregate_columns() result into a dict of EnergyRollup column values"""
+    bucket['count'] += int(aggregates['count'][i])
+    for metric in ROLLUP_METRICS:
+        count = int(aggregates[f'{metric}_count'][i])
+        if not count:
+            continue
+        bucket[f'{metric}_count'] += count
+        bucket[f'{metric}_sum'] += float(aggregates[f'{metric}_sum'][i])
+        bucket[f'{metric}_sumsq'] += float(aggregates[f'{metric}_sumsq'][i])
+
+        low = float(aggregates[f'{metric}_min'][i])
+        high = float(aggregates[f'{metric}_max'][i])
+        if bucket[f'{metric}_min'] is None or low < bucket[f'{metric}_min']:
+            bucket[f'{metric}_min'] = low
+        if bucket[f'{metric}_max'] is None or high > bucket[f'{metric}_max']:
+            bucket[f'{metric}_max'] = high
+
+
+def apply_readings(facility_ids, timestamps, metrics):
+    """
+    Fold a block of readings into the rollup tables of the current session (no commit)
+    timestamps may be datetimes or a datetime64 array
+    """
+    if len(facility_ids) == 0:
+        return
+
+    facility_ids = np.asarray(facility_ids, dtype=np.int64)
+    epoch_seconds = np.asarray(timestamps, dtype='datetime64[s]').astype(np.int64)
+    metrics = {name: np.asarray(values, dtype=np.float64) for name, values in metrics.items()}
+    table = EnergyRollup.__table__
+
+    for resolution in RESOLUTIONS:
+        aggregates = aggregate_columns(facility_ids, epoch_seconds, metrics, resolution)
+        starts = [datetime.utcfromtimestamp(int(ts)) for ts in aggregates['bucket_start']]
+
+        # Load the existing buckets this block touches in one query
+        rows = db.session.execute(
+            select(table).where(
+                table.c.resolution == resolution,
+                table.c.facility_id.in_({int(f) for f in aggregates['facility_id']}),
+                table.c.bucket_start >= min(starts),
+                table.c.bucket_start <= max(starts)
+            )
+        ).mappings()
+        existing = {(row['facility_id'], row['bucket_start']): dict(row) for row in rows}
+
+        inserts = []
+        updates = []
+        for i, start in enumerate(starts):
+            facility_id = int(aggregates['facility_id'][i])
+            bucket = existing.get((facility_id, start))
+            if bucket is None:
+                bucket = _empty_bucket(facility_id, resolution, start)
+                inserts.append(bucket)
+            else:
+                updates.append(bucket)
+            _merge_bucket(bucket, aggregates, i)
+
+        # Bulk statements rather than ORM objects; a backfill can touch thousands of buckets
+        if inserts:
+            db.session.execute(insert(EnergyRollup), inserts)
+        if updates:
+            db.session.execute(update(EnergyRollup), updates)
+
+
+def update_rollups(batch_size=50000, max_batches=None, wait=True):
+    """
+    Fold readings inserted since the last run into the rollups
+    max_batches caps the work (e.g. on a request); the scheduled job catches up on the rest
+    wait=False returns None at once if this process is already updating the rollups
+    Must be called inside an application context
+    Returns: number of readings processed
+    """
+    if not _update_lock.acquire(blocking=wait):
+        return None
+    try:
+        processed = 0
+        batches = 0
+        upper_id = settled_id()
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            watermark = db.session.get(JobWatermark, WATERMARK_NAME)
+            if watermark is None:
+                watermark = JobWatermark(name=WATERMARK_NAME, last_id=0)
+                db.session.add(watermark)
+                db.session.flush()
+            last_id = watermark.last_id
+
+            columns = [EnergyData.id, EnergyData.facility_id, EnergyData.timestamp] + \
+                [getattr(EnergyData, metric) for metric in ROLLUP_METRICS]
+            conditions = [EnergyData.id > last_id]
+            if upper_id is not None:
+                conditions.append(EnergyData.id <= upper_id)
+            rows = db.session.execute(
+                select(*columns).where(*conditions).order_by(EnergyData.id).limit(batch_size)
+            ).all()
+            if not rows:
+                db.session.commit()
+                return processed
+
+            ids, facility_ids, timestamps, *metric_values = zip(*rows)
+            metrics = {
+                metric: np.array(values, dtype=np.float64)  # None becomes NaN
+                for metric, values in zip(ROLLUP_METRICS, metric_values)
+            }
+            apply_readings(facility_ids, timestamps, metrics)
+
+            # Compare-and-set the watermark so concurrent workers never fold the same rows twice
+            moved = db.session.execute(
+                update(JobWatermark)
+                .where(JobWatermark.name == WATERMARK_NAME, JobWatermark.last_id == last_id)
+                .values(last_id=ids[-1], updated_at=datetime.utcnow())
+            ).rowcount
+            if not moved:
+                db.session.rollback()
+                logger.info("Rollup watermark moved by another worker; skipping this run")
+                return processed
+
+            db.session.commit()
+            processed += len(rows)
+        return processed
+    finally:
+        _update_lock.release()
+
+
+def get_rollups(resolution, start, end=None, facility_id=None):
+    """Return the rollup buckets of a resolution covering [start, end), oldest first"""
+    query = EnergyRollup.query.filter(
+        EnergyRollup.resolution == resolution,
+        EnergyRollup.bucket_start >= start - timedelta(seconds=resolution - 1)
+    )
+    if end is not None:
+        query = query.filter(EnergyRollup.bucket_start < end)
+    if facility_id is not None:
+        query = query.filter(EnergyRollup.facility_id == facility_id)
+    return query.order_by(EnergyRollup.bucket_start).all()
+
+
+def rollup_data_points(rollups):
+    """Convert rollup buckets into the per-reading dicts used by the analysis and ML code"""
+    return [
+        {
+            'timestamp': rollup.bucket_start,
+            'count': rollup.count,
+            'energy_produced': rollup.mean('energy_produced'),
+            'energy_consumed': rollup.mean('energy_consumed'),
+            'efficiency': rollup.mean('efficiency'),
+            'current_load': rollup.mean('current_load')
+        }
+        for rollup in rollups
+    ]
+
+
+def analyze_rollup_trends(rollups, peak_rollups=None):
+    """
+    Equivalent of utils.analyze_trends computed from rollup buckets
+    peak_rollups (hourly or finer) drive the peak-hour counts; defaults to rollups
+    """
+    if peak_rollups is None:
+        peak_rollups = rollups
+
+    statistics = {}
+    for key, metric in (('production', 'energy_produced'), ('consumption', 'energy_consumed')):
+        count = sum(getattr(r, f'{metric}_count') for r in rollups)
+        if not count:
+            statistics[key] = {'mean': 0, 'max': 0, 'min': 0, 'std': 0}
+            continue
+        mean = sum(getattr(r, f'{metric}_sum') for r in rollups) / count
+        variance = sum(getattr(r, f'{metric}_sumsq') for r in rollups) / count - mean * mean
+        statistics[key] = {
+            'mean': mean,
+            'max': max(getattr(r, f'{metric}_max') for r in rollups if getattr(r, f'{metric}_count')),
+            'min': min(getattr(r, f'{metric}_min') for r in rollups if getattr(r, f'{metric}_count')),
+            'std': float(np.sqrt(max(variance, 0.0)))
+        }
+
+    # Trend: compare consumption before and after the bucket holding the median reading
+    trend = 'neutral'
+    total = sum(r.energy_consumed_count for r in rollups)
+    if total > 1:
+        seen = 0
+        first = [0, 0.0]
+        second = [0, 0.0]
+        for r in rollups:
+            half = first if seen < total // 2 else second
+            half[0] += r.energy_consumed_count
+            half[1] += r.energy_consumed_sum
+            seen += r.energy_consumed_count
+        if first[0] and second[0]:
+            first_mean = first[1] / first[0]
+            second_mean = second[1] / second[0]
+            if second_mean > first_mean * 1.05:
+                trend = 'increasing'
+            elif first_mean > second_mean * 1.05:
+                trend = 'decreasing'
+
+    # Peak hours: readings in buckets whose mean consumption is above the overall mean
+    peak_hours = {}
+    overall_mean = statistics['consumption']['mean']
+    for r in peak_rollups:
+        hour = r.bucket_start.hour
+        if hour not in peak_hours:
+            peak_hours[hour] = 0
+        bucket_mean = r.mean('energy_consumed')
+        if bucket_mean is not None and bucket_mean > overall_mean:
+            peak_hours[hour] += r.energy_consumed_count
+
+    return {
+        'statistics': statistics,
+        'trend': trend,
+        'peak_hours': peak_hours
+    }
@@ -0,0 +1,406 @@
+"""
+Shared-memory ring buffer of recent readings
+
+Every gunicorn worker maps the same file, so a reading ingested by one worker
+is immediately visible to the dashboard, latest-reading and hardware-status
+routes of all the others.  Each facility owns a fixed-size slot holding its
+last `capacity` readings (float64 timestamps, int64 ids and float32 columns).
+
+Writers are serialized with flock plus a thread lock.  Readers never lock:
+each slot has a seqlock counter that is odd while a write is in progress, so
+a reader copies what it needs and retries if the counter moved.  (This relies
+on stores reaching the mapping in program order, as on x86-64.)  A generation
+counter in the file header changes whenever the ring is rebuilt, telling
+every process to drop its cached facility -> slot map.
+
+The ring is rebuilt from the database on startup unless another worker has
+already filled it and it holds the newest stored reading of every facility.
+That is checked by timestamp: readings queued by write-behind or the ingest
+log have no id yet when they reach the ring.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, EnergyData, Facility
+from ingest import describe_voltage
+from latest_cache import ALL_FACILITIES, reading_to_dict
+
+logger = logging.getLogger(__name__)
+
+MAGIC = int.from_bytes(b'ERING001', 'little')
+COLUMNS = [
+    'energy_produced', 'energy_consumed', 'efficiency', 'current_load',
+    'voltage', 'current', 'current1', 'current2', 'current3', 'frequency', 'power_factor'
+]
+EPOCH = datetime(1970, 1, 1)
+
+# File header (int64 words); H_RESERVED is unused
+HEADER_WORDS = 8
+H_MAGIC, H_CAPACITY, H_SLOTS, H_COLUMNS, H_READY, H_GENERATION, H_RESERVED, H_OVERFLOW = range(HEADER_WORDS)
+
+# Slot header (int64 words); facility id 0 marks a free slot
+SLOT_WORDS = 4
+S_FACILITY, S_SEQ, S_HEAD, S_LATEST = range(SLOT_WORDS)
+
+# Reads interrupted this many times by writers fall back to taking the lock
+SEQLOCK_RETRIES = 50
+
+
+def _epoch_seconds(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _from_epoch(seconds):
+    return EPOCH + timedelta(microseconds=round(seconds * 1e6))
+
+
+def _float(value):
+    """float32 -> float without the binary noise (230.1, not 230.10000610351562)"""
+    return None if np.isnan(value) else float(str(value))
+
+
+class SharedReadingRing:
+    """
+    Drop-in replacement for LatestReadingCache backed by a shared memory-mapped file
+    fallback: LatestReadingCache used while the ring is being rebuilt, when it ran out of slots and
+    for facilities it holds no readings of yet; without one, those lookups query the database
+    """
+
+    def __init__(self, path, capacity=17280, slots=16, fallback=None):
+        self.path = path
+        self.capacity = capacity
+        self.slots = slots
+        self.fallback = fallback
+        self.slot_bytes = -(-(SLOT_WORDS * 8 + capacity * 16 + len(COLUMNS) * capacity * 4) // 8) * 8
+        self.size = HEADER_WORDS * 8 + slots * self.slot_bytes
+
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._write_lock():
+            if os.fstat(self._fd).st_size != self.size:
+                # New file or a different layout: start empty, the startup rebuild fills it
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self._mm = mmap.mmap(self._fd, self.size)
+            self._map_arrays()
+            if not self._layout_matches():
+                self._header[:] = 0
+                self._header[[H_MAGIC, H_CAPACITY, H_SLOTS, H_COLUMNS]] = [MAGIC, capacity, slots, len(COLUMNS)]
+
+        self._generation = None
+        self._slot_of = {}
+        self.hits = 0
+        self.fallbacks = 0
+        self.retries = 0
+        self._overflow_logged = False
+
+    def _map_arrays(self):
+        self._header = np.ndarray((HEADER_WORDS,), np.int64, buffer=self._mm, offset=0)
+        self._slot_headers, self._timestamps, self._ids, self._values = [], [], [], []
+        for slot in range(self.slots):
+            base = HEADER_WORDS * 8 + slot * self.slot_bytes
+            self._slot_headers.append(np.ndarray((SLOT_WORDS,), np.int64, buffer=self._mm, offset=base))
+            base += SLOT_WORDS * 8
+            self._timestamps.append(np.ndarray((self.capacity,), np.float64, buffer=self._mm, offset=base))
+            base += self.capacity * 8
+            self._ids.append(np.ndarray((self.capacity,), np.int64, buffer=self._mm, offset=base))
+            base += self.capacity * 8
+            self._values.append(np.ndarray((len(COLUMNS), self.capacity), np.float32, buffer=self._mm, offset=base))
+
+    def _layout_matches(self):
+        return (self._header[[H_MAGIC, H_CAPACITY, H_SLOTS, H_COLUMNS]] ==
+                [MAGIC, self.capacity, self.slots, len(COLUMNS)]).all()
+
+    def _write_lock(self):
+        return _FileLock(self._lock, self._fd)
+
+    @property
+    def ready(self):
+        return bool(self._header[H_READY])
+
+    # Slot lookup
+
+    def _slot(self, facility_id, allocate=False):
+        """Slot index of a facility, or None; allocating requires the write lock"""
+        generation = int(self._header[H_GENERATION])
+        if generation != self._generation:
+            # Rebuilt by some process since we last looked: slots may have moved
+            self._slot_of = {}
+            self._generation = generation
+        slot = self._slot_of.get(facility_id)
+        if slot is not None:
+            return slot
+
+        for index, header in enumerate(self._slot_headers):
+            owner = int(header[S_FACILITY])
+            if owner == facility_id:
+                self._slot_of[facility_id] = index
+                return index
+            if owner == 0:
+                if not allocate:
+                    return None
+                header[:] = [facility_id, 0, 0, -1]
+                self._slot_of[facility_id] = index
+                return index
+
+        if allocate:
+            self._header[H_OVERFLOW] = 1
+            if not self._overflow_logged:
+                logger.warning(f"Shared reading ring is full ({self.slots} facilities); "
+                               f"facility {facility_id} is served from the database")
+                self._overflow_logged = True
+        return None
+
+    # Writing
+
+    def _append(self, reading):
+        """Store one reading; the caller holds the write lock"""
+        slot = self._slot(reading['facility_id'], allocate=True)
+        if slot is None:
+            return
+        header = self._slot_headers[slot]
+        timestamp = _epoch_seconds(reading['timestamp'])
+        reading_id = reading.get('id') or 0
+
+        header[S_SEQ] += 1  # odd: readers retry
+        position = int(header[S_HEAD]) % self.capacity
+        self._timestamps[slot][position] = timestamp
+        self._ids[slot][position] = reading_id
+        self._values[slot][:, position] = [np.nan if reading.get(name) is None else reading[name]
+                                           for name in COLUMNS]
+        header[S_HEAD] += 1
+
+        latest = int(header[S_LATEST])
+        if latest < 0:
+            header[S_LATEST] = position
+        elif latest == position:
+            # The newest reading was overwritten (e.g. by a late backfill): find the newest one left
+            count = min(int(header[S_HEAD]), self.capacity)
+            header[S_LATEST] = np.lexsort((self._ids[slot][:count], self._timestamps[slot][:count]))[-1]
+        elif (timestamp, reading_id) >= (self._timestamps[slot][latest], self._ids[slot][latest]):
+            header[S_LATEST] = position
+        header[S_SEQ] += 1  # even again
+
+    def update(self, reading):
+        """Record a stored reading (a dict of EnergyData columns; id may be None when queued)"""
+        self.update_many([reading])
+
+    def update_many(self, readings):
+        readings = list(readings)
+        if self.fallback:
+            self.fallback.update_many(readings)
+        with self._write_lock():
+            for reading in readings:
+                self._append(reading)
+
+    # Lock-free reading
+
+    def _read(self, slot, copy):
+        """Run copy(slot) until no write overlapped it"""
+        header = self._slot_headers[slot]
+        for _ in range(SEQLOCK_RETRIES):
+            seq = int(header[S_SEQ])
+            if not seq & 1:
+                result = copy(slot)
+                if int(header[S_SEQ]) == seq:
+                    return result
+            self.retries += 1
+            time.sleep(0)
+        with self._write_lock():
+            return copy(slot)
+
+    def _copy_latest(self, slot):
+        position = int(self._slot_headers[slot][S_LATEST])
+        if position < 0:
+            return None
+        return (int(self._slot_headers[slot][S_FACILITY]), float(self._timestamps[slot][position]),
+                int(self._ids[slot][position]), self._values[slot][:, position].copy())
+
+    def _latest(self, slot):
+        copied = self._read(slot, self._copy_latest)
+        if copied is None:
+            return None
+        facility_id, timestamp, reading_id, values = copied
+        reading = {'id': reading_id or None, 'timestamp': _from_epoch(timestamp), 'facility_id': facility_id}
+        reading.update((name, _float(value)) for name, value in zip(COLUMNS, values))
+        reading['alert_message'], reading['alert_level'] = describe_voltage(reading['voltage'])
+        return reading
+
+    def get(self, facility_id=ALL_FACILITIES):
+        """Latest reading dict of a facility (or of any facility), or None if there is none"""
+        overflow = bool(self._header[H_OVERFLOW])
+        if not self.ready or (overflow and facility_id is ALL_FACILITIES):
+            return self._fall_back(facility_id)
+
+        if facility_id is ALL_FACILITIES:
+            candidates = [self._latest(slot) for slot, header in enumerate(self._slot_headers)
+                          if header[S_FACILITY]]
+            candidates = [reading for reading in candidates if reading]
+            self.hits += 1
+            if not candidates:
+                return None
+            return max(candidates, key=lambda reading: (reading['timestamp'], reading['id'] or 0))
+
+        slot = self._slot(facility_id)
+        if slot is None:
+            if overflow:
+                return self._fall_back(facility_id)
+            # No slot yet: readings stored without passing through the ring (e.g. by the import
+            # command), or none at all.  Look it up once and keep what was found in the ring.
+            reading = self._fall_back(facility_id)
+            if reading:
+                with self._write_lock():
+                    if self._slot(facility_id) is None:
+                        self._append(reading)
+            return reading
+        self.hits += 1
+        return self._latest(slot)
+
+    def _fall_back(self, facility_id):
+        """Latest stored reading from the fallback cache, or from the database without one"""
+        self.fallbacks += 1
+        if self.fallback:
+            return self.fallback.get(facility_id)
+        query = select(EnergyData).order_by(EnergyData.timestamp.desc(), EnergyData.id.desc()).limit(1)
+        if facility_id is not ALL_FACILITIES:
+            query = query.where(EnergyData.facility_id == facility_id)
+        row = db.session.execute(query).scalar()
+        return reading_to_dict(row) if row else None
+
+    def _copy_window(self, slot):
+        count = min(int(self._slot_headers[slot][S_HEAD]), self.capacity)
+        return (int(self._slot_headers[slot][S_HEAD]), self._timestamps[slot][:count].copy(),
+                self._values[slot][:, :count].copy())
+
+    def window(self, start, names=None):
+        """
+        Readings of all facilities since start, sorted by time
+        Returns: (datetime64[us] timestamps, dict of float64 columns), or None if the ring
+        can't cover the whole window (not built yet, out of slots, or start is older than a full slot)
+        """
+        if not self.ready or self._header[H_OVERFLOW]:
+            return None
+        names = names or COLUMNS
+        rows = [COLUMNS.index(name) for name in names]
+        since = _epoch_seconds(start)
+
+        stamps, values = [], []
+        for slot, header in enumerate(self._slot_headers):
+            if not header[S_FACILITY]:
+                continue
+            head, slot_stamps, slot_values = self._read(slot, self._copy_window)
+            if head >= self.capacity and slot_stamps.min() > since:
+                # Readings in the window were already overwritten
+                return None
+            keep = slot_stamps >= since
+            stamps.append(slot_stamps[keep])
+            values.append(slot_values[rows][:, keep])
+
+        if not stamps:
+            return np.array([], dtype='datetime64[us]'), {name: np.array([]) for name in names}
+        stamps = np.concatenate(stamps)
+        values = np.concatenate(values, axis=1).astype(np.float64)
+        order = np.argsort(stamps, kind='stable')
+        timestamps = np.round(stamps[order] * 1e6).astype(np.int64).astype('datetime64[us]')
+        return timestamps, {name: values[i][order] for i, name in enumerate(names)}
+
+    # Rebuilding
+
+    def rebuild_if_stale(self, hours=24):
+        """
+        Reload the ring from the database unless it is already filled and up to date
+        Must be called inside an application context.  Returns True if it was rebuilt.
+        """
+        with self._write_lock():
+            if self.ready and not self._behind_database():
+                return False
+            self._rebuild(hours)
+            return True
+
+    def _behind_database(self):
+        """True if the database has a reading newer than a facility's latest one in the ring"""
+        overflow = bool(self._header[H_OVERFLOW])
+        for facility_id in db.session.execute(select(Facility.id).order_by(Facility.id)).scalars():
+            newest = db.session.execute(
+                select(func.max(EnergyData.timestamp)).where(EnergyData.facility_id == facility_id)
+            ).scalar()
+            if newest is None:
+                continue
+            slot = self._slot(facility_id)
+            if slot is None:
+                if overflow:
+                    continue  # served from the database anyway
+                return True
+            copied = self._copy_latest(slot)
+            # Newer readings in the ring are queued ones the database has yet to store
+            if copied is None or copied[1] < _epoch_seconds(newest):
+                return True
+        return False
+
+    def _rebuild(self, hours):
+        """Refill every slot from the database; the caller holds the write lock"""
+        self._header[H_READY] = 0
+        self._header[H_GENERATION] += 1
+        self._header[H_OVERFLOW] = 0
+        for header in self._slot_headers:
+            header[:] = [0, 0, 0, -1]
+
+        fields = [EnergyData.id, EnergyData.timestamp, EnergyData.facility_id] + \
+                 [getattr(EnergyData, name) for name in COLUMNS]
+        since = datetime.utcnow() - timedelta(hours=hours)
+        loaded = 0
+        for facility_id in db.session.execute(select(Facility.id).order_by(Facility.id)).scalars():
+            newest_first = (EnergyData.timestamp.desc(), EnergyData.id.desc())
+            rows = db.session.execute(
+                select(*fields).where(EnergyData.facility_id == facility_id, EnergyData.timestamp >= since)
+                .order_by(*newest_first).limit(self.capacity)
+            ).all()
+            if not rows:
+                # Nothing recent: keep the last reading so "latest" lookups still find it
+                rows = db.session.execute(
+                    select(*fields).where(EnergyData.facility_id == facility_id).order_by(*newest_first).limit(1)
+                ).all()
+            for row in reversed(rows):
+                self._append(row._asdict())
+            loaded += len(rows)
+
+        self._header[H_READY] = 1
+        self._mm.flush()
+        logger.info(f"Rebuilt shared reading ring from the database: {loaded} readings")
+
+    def get_stats(self):
+        return {
+            'shared': True,
+            'ready': self.ready,
+            'facilities': sum(1 for header in self._slot_headers if header[S_FACILITY]),
+            'capacity': self.capacity,
+            'generation': int(self._header[H_GENERATION]),
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+            'seqlock_retries': self.retries
+        }
+
+
+class _FileLock:
+    """Thread lock plus an exclusive flock on the ring file (flock alone doesn't exclude threads)"""
+
+    def __init__(self, lock, fd):
+        self.lock = lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
@@ -0,0 +1,98 @@
+"""
+SQLite storage profile and reader/writer engine routing
+
+With the high-throughput profile enabled the database runs in WAL mode, so
+readers never block the writer and vice versa.  All writes go through one
+serialized writer engine (a single pooled connection per process) while the
+dashboard, historical and ML routes read from a pool of read-only engines.
+"""
+import functools
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+READER_BIND = 'reader'
+
+
+def sqlite_pragmas(cache_mb=64, mmap_mb=256, busy_timeout_ms=5000, read_only=False):
+    """PRAGMA statements applied to every new connection of the profile"""
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f'PRAGMA cache_size=-{cache_mb * 1024}',  # negative = KiB
+        f'PRAGMA mmap_size={mmap_mb * 1024 * 1024}',
+        f'PRAGMA busy_timeout={busy_timeout_ms}',
+        'PRAGMA temp_store=MEMORY',
+    ]
+    if read_only:
+        # journal_mode can't be changed on a read-only connection; the writer has set it already
+        pragmas = pragmas[1:] + ['PRAGMA query_only=ON']
+    return pragmas
+
+
+def apply_sqlite_profile(engine, **kwargs):
+    """Run the profile pragmas on every connection the engine opens"""
+    pragmas = sqlite_pragmas(**kwargs)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def reader_url(path):
+    """URL of a read-only connection to the SQLite file at path"""
+    return f'sqlite:///file:{path}?mode=ro&uri=true'
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the reader engine while the read_only flag is set
+    Flushes and INSERT/UPDATE/DELETE statements always go to the writer.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_app_context() and g.get('read_only') and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            reader = self._db.engines.get(READER_BIND)
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_reader(f):
+    """Route decorator: serve the view's queries from the read-only engines"""
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return decorated_function
+
+
+def stream_from_reader(body):
+    """Keep a streamed response body on the read-only engines (use_reader ends when the view returns)"""
+    g.read_only = True
+    try:
+        yield from body
+    finally:
+        g.read_only = False
+
+
+@contextmanager
+def using_writer():
+    """Temporarily send a read-only view's queries to the writer (e.g. to fold in fresh rollups)"""
+    previous = g.get('read_only', False)
+    g.read_only = False
+    try:
+        yield
+    finally:
+        g.read_only = previous
@@ -0,0 +1,112 @@
+"""
+Shared fixtures: a Flask app with the models on a temporary SQLite database
+
+PostgreSQL cases use the database in TEST_DATABASE_URL and are skipped when
+it is not set or the server cannot be reached.
+"""
+import importlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, Facility, EnergyData
+
+
+def make_app(database_url, **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config.update(config)
+    db.init_app(app)
+    return app
+
+
+def add_facility():
+    facility = Facility(name='Test Plant', location='Lab', capacity=100.0, solar_panels=10)
+    db.session.add(facility)
+    db.session.commit()
+    return facility.id
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App context on a fresh SQLite database with one facility"""
+    app = make_app(f'sqlite:///{tmp_path / "test.db"}')
+    with app.app_context():
+        db.create_all()
+        app.config['FACILITY_ID'] = add_facility()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def pg_app():
+    """App context on the PostgreSQL database in TEST_DATABASE_URL, emptied before and after"""
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url or not url.startswith('postgresql'):
+        pytest.skip('TEST_DATABASE_URL does not point to a PostgreSQL database')
+    app = make_app(url)
+    with app.app_context():
+        try:
+            db.session.execute(text('SELECT 1'))
+        except Exception as e:
+            pytest.skip(f'PostgreSQL is not available: {e}')
+        db.drop_all()
+        db.create_all()
+        app.config['FACILITY_ID'] = add_facility()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def make_readings(facility_id, start, count, step=timedelta(minutes=1), **values):
+    """Reading dicts every step from start; metric values default to simple ramps"""
+    return [
+        {
+            'facility_id': facility_id,
+            'timestamp': start + step * i,
+            'energy_produced': values.get('energy_produced', 10.0 + i % 7),
+            'energy_consumed': values.get('energy_consumed', 20.0 + i % 5),
+            'efficiency': 50.0,
+            'current_load': 40.0,
+            'voltage': values.get('voltage', 230.0)
+        }
+        for i in range(count)
+    ]
+
+
+def insert(readings):
+    """Insert reading dicts through the ORM and return their ids"""
+    rows = [EnergyData(**reading) for reading in readings]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def hours_ago(hours):
+    return datetime.utcnow().replace(microsecond=0) - timedelta(hours=hours)
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The application module on its own temporary SQLite database"""
+    directory = tmp_path_factory.mktemp('server')
+    os.environ['DATABASE_URL'] = f'sqlite:///{directory / "app.db"}'
+    os.environ['MODEL_PATH'] = str(directory / 'model.json')
+    # Configured from the environment at import time, so this is done once per session
+    return importlib.import_module('app')
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    """Test client of the application module, inserting directly and starting from no readings"""
+    monkeypatch.setattr(server, 'ingest_log', None)
+    monkeypatch.setattr(server, 'ingest_buffer', None)
+    with server.app.app_context():
+        EnergyData.query.delete()
+        server.db.session.commit()
+    return server.app.test_client()
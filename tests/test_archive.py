@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from archive import ARCHIVE_COLUMNS, ArchiveSegment, archive_cold_data, history_summary, iter_history_chunks, \
+    list_segments, load_history_columns, segment_path, write_segment
+from conftest import hours_ago, insert, make_readings
+from models import EnergyData
+from retention import apply_retention
+from rollups import update_rollups
+
+
+def cold_month_start():
+    """Start of a month the archive moves with older_than_days=60"""
+    day = datetime.utcnow() - timedelta(days=150)
+    return datetime(day.year, day.month, 2)
+
+
+def test_segment_round_trip_sorts_by_timestamp(tmp_path):
+    timestamps = np.datetime64('2024-03-01T00:00:00', 'us') + np.array([30, 10, 20], dtype='timedelta64[m]')
+    columns = {name: np.zeros(3, dtype=dtype) for name, dtype in ARCHIVE_COLUMNS}
+    columns.update(timestamp=timestamps, id=np.array([3, 1, 2]), energy_consumed=np.array([3.5, 1.5, 2.5]))
+    path = segment_path(str(tmp_path), 1, 2024, 3)
+    write_segment(path, 1, columns)
+
+    segment = ArchiveSegment(path)
+    assert segment.rows == 3
+    assert segment.columns['id'].tolist() == [1, 2, 3]
+    assert segment.columns['energy_consumed'].tolist() == [1.5, 2.5, 3.5]
+    window = segment.time_slice(datetime(2024, 3, 1, 0, 15), datetime(2024, 3, 1, 0, 30))
+    assert window['id'].tolist() == [2]
+
+
+def test_archived_readings_read_back_with_the_live_ones(app, tmp_path):
+    facility_id = app.config['FACILITY_ID']
+    cold = make_readings(facility_id, cold_month_start(), 60)
+    insert(cold + make_readings(facility_id, hours_ago(2), 10))
+    update_rollups()
+
+    assert archive_cold_data(str(tmp_path), older_than_days=60) == 60
+    assert EnergyData.query.count() == 10
+
+    start = cold_month_start() - timedelta(days=1)
+    columns = load_history_columns(str(tmp_path), facility_id, start)
+    assert len(columns['timestamp']) == 70
+    assert np.all(np.diff(columns['timestamp']) > np.timedelta64(0))
+    assert columns['energy_consumed'][:60].tolist() == [reading['energy_consumed'] for reading in cold]
+
+
+def test_rows_left_by_an_interrupted_run_are_not_archived_twice(app, tmp_path):
+    facility_id = app.config['FACILITY_ID']
+    readings = make_readings(facility_id, cold_month_start(), 40)
+    ids = insert(readings)
+    update_rollups()
+    assert archive_cold_data(str(tmp_path), older_than_days=60) == 40
+
+    # The run died after writing the segment but before deleting these rows
+    insert([dict(reading, id=reading_id) for reading_id, reading in zip(ids[:15], readings)])
+    assert archive_cold_data(str(tmp_path), older_than_days=60) == 0
+    assert EnergyData.query.count() == 0
+    path, = list_segments(str(tmp_path), facility_id)
+    assert ArchiveSegment(path).columns['id'].tolist() == ids
+
+
+def test_history_reads_cover_archive_and_live_after_retention(app, tmp_path):
+    facility_id = app.config['FACILITY_ID']
+    insert(make_readings(facility_id, cold_month_start(), 50, energy_consumed=10.0))
+    insert(make_readings(facility_id, datetime.utcnow() - timedelta(days=40), 20, energy_consumed=40.0))
+    insert(make_readings(facility_id, hours_ago(2), 30, energy_consumed=20.0))
+    update_rollups()
+    archive_cold_data(str(tmp_path), older_than_days=60)
+
+    # Retention removes the 40-day-old readings; the archived month is untouched
+    assert apply_retention(raw_days=30, minute_rollup_days=0, pause=0)['raw_rows_deleted'] == 20
+
+    start = cold_month_start() - timedelta(days=1)
+    assert history_summary(str(tmp_path), facility_id, start) == (80, (50 * 10.0 + 30 * 20.0) / 80)
+    chunks = list(iter_history_chunks(str(tmp_path), facility_id, start, chunk_size=16))
+    consumed = np.concatenate([chunk['energy_consumed'] for chunk in chunks])
+    assert consumed.tolist() == [10.0] * 50 + [20.0] * 30
+    assert len(load_history_columns(str(tmp_path), facility_id, start)['timestamp']) == 80
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from conftest import insert, make_readings
+from day_stats import aggregate_days, rebuild_day_stats, record_day_stats, _merge_state, _empty_state, _day
+from models import db, EnergyData, EnergyDayStats
+
+
+def test_aggregate_days_matches_numpy():
+    start = np.datetime64('2024-03-01T00:00:00')
+    timestamps = start + np.arange(0, 3 * 86400, 600).astype('timedelta64[s]')
+    produced = np.cos(np.arange(len(timestamps)) / 10.0) * 5 + 20
+    consumed = np.sin(np.arange(len(timestamps)) / 7.0) * 3 + 30
+    result = aggregate_days(np.ones(len(timestamps)), timestamps, produced, consumed)
+
+    days = timestamps.astype('datetime64[D]')
+    for i, day in enumerate(np.unique(days)):
+        selected = days == day
+        assert result['count'][i] == selected.sum()
+        assert np.isclose(result['production_mean'][i], produced[selected].mean())
+        assert np.isclose(result['consumption_m2'][i], ((consumed[selected] - consumed[selected].mean()) ** 2).sum())
+        assert result['consumption_min'][i] == consumed[selected].min()
+        assert result['production_max'][i] == produced[selected].max()
+        hours = timestamps[selected].astype('datetime64[h]').astype(np.int64) % 24
+        assert np.array_equal(result['hour_counts'][i], np.bincount(hours, minlength=24))
+
+
+def test_merged_halves_equal_the_whole():
+    timestamps = np.datetime64('2024-03-01T00:00:00') + np.arange(0, 86400, 300).astype('timedelta64[s]')
+    consumed = np.linspace(10, 50, len(timestamps)) ** 1.5
+    produced = np.linspace(5, 8, len(timestamps))
+    facility_ids = np.ones(len(timestamps))
+    whole = aggregate_days(facility_ids, timestamps, produced, consumed)
+
+    state = _empty_state(1, _day(whole['day'][0]))
+    for half in (slice(None, 100), slice(100, None)):
+        _merge_state(state, aggregate_days(facility_ids[half], timestamps[half], produced[half], consumed[half]), 0)
+
+    assert state['count'] == whole['count'][0]
+    assert np.isclose(state['consumption_mean'], whole['consumption_mean'][0])
+    assert np.isclose(state['consumption_m2'], whole['consumption_m2'][0])
+    assert state['production_min'] == whole['production_min'][0]
+
+
+def stats_rows():
+    return {
+        (row.facility_id, row.day): (row.count, round(row.consumption_mean, 9), round(row.consumption_m2, 6))
+        for row in EnergyDayStats.query.all()
+    }
+
+
+def test_recorded_stats_equal_a_rebuild(app):
+    app.config['DAY_STATS_ENABLED'] = True
+    facility_id = app.config['FACILITY_ID']
+    readings = make_readings(facility_id, datetime.utcnow() - timedelta(days=2), 400, step=timedelta(minutes=9))
+    for offset in range(0, len(readings), 150):
+        insert(readings[offset:offset + 150])
+        record_day_stats(readings[offset:offset + 150])
+        db.session.commit()
+    recorded = stats_rows()
+
+    assert rebuild_day_stats(chunk_size=64) == 400
+    assert stats_rows() == recorded
+
+
+def test_rebuild_keeps_partly_deleted_days(app):
+    app.config['DAY_STATS_ENABLED'] = True
+    facility_id = app.config['FACILITY_ID']
+    start = datetime(2024, 3, 1)
+    readings = make_readings(facility_id, start, 3 * 24, step=timedelta(hours=1))
+    insert(readings)
+    record_day_stats(readings)
+    db.session.commit()
+    recorded = stats_rows()
+
+    # Retention removed the first day and a half
+    cutoff = start + timedelta(hours=36)
+    EnergyData.query.filter(EnergyData.timestamp < cutoff).delete()
+    db.session.commit()
+
+    assert rebuild_day_stats(complete_from=cutoff) == 24
+    assert stats_rows() == recorded
@@ -0,0 +1,20 @@
+from models import EnergyData, EnergyDayStats
+
+
+def test_debug_readings_reach_the_day_stats_cache_and_stream(server, client, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'DAY_STATS_ENABLED', True)
+    with server.app.app_context():
+        EnergyDayStats.query.delete()
+        server.db.session.commit()
+    published = server.live_events.get_stats()['published']
+
+    created = client.get('/api/debug/test-hardware').get_json()['data']
+    demo = client.get('/api/debug/voltage-demo?condition=high_critical').get_json()
+    assert demo['alert']['level'] == 'critical'
+
+    # One reading event each, plus the alert of the demo reading
+    assert server.live_events.get_stats()['published'] == published + 3
+    with server.app.app_context():
+        latest = server.latest_readings.get()
+        assert latest['id'] > created['id'] and latest['alert_level'] == 'critical'
+        assert sum(stats.count for stats in EnergyDayStats.query) == EnergyData.query.count() == 2
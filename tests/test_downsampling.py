@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from downsampling import BucketAccumulator, downsample_columns, lttb_indices, minmax_indices
+
+
+def noisy_series(n, seed=3):
+    rng = np.random.default_rng(seed)
+    return np.sin(np.arange(n) / 50.0) * 10 + rng.normal(0, 1, n)
+
+
+def test_lttb_keeps_the_endpoints_and_the_size():
+    x = np.arange(1000, dtype=np.float64)
+    y = noisy_series(1000)
+    indices = lttb_indices(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert np.array_equal(lttb_indices(x, y, 2000), np.arange(1000))
+
+
+def test_minmax_keeps_every_bucket_extreme():
+    y = noisy_series(1000)
+    y[123], y[777] = 500.0, -500.0  # spikes
+    indices = minmax_indices(y, 50)
+    assert indices[0] == 0 and indices[-1] == 999
+    assert len(indices) <= 50 + 2
+    assert {123, 777} <= set(indices.tolist())
+
+    buckets = np.arange(1000) * 25 // 1000
+    for bucket in range(25):
+        members = np.flatnonzero(buckets == bucket)
+        assert members[np.argmin(y[members])] in indices
+        assert members[np.argmax(y[members])] in indices
+
+
+def test_missing_readings_are_never_picked_as_extremes():
+    y = noisy_series(400)
+    y[10:20] = np.nan
+    timestamps = np.datetime64('2024-03-01T00:00:00', 'us') + np.arange(400).astype('timedelta64[m]')
+    kept_timestamps, kept = downsample_columns(timestamps, {'consumption': y}, 40, method='minmax')
+    assert len(kept_timestamps) == len(kept['consumption']) < 400
+    assert None not in kept['consumption']
+
+
+def test_bucket_means_do_not_depend_on_the_chunking():
+    start = datetime(2024, 3, 1)
+    timestamps = np.datetime64(start, 'us') + np.arange(600).astype('timedelta64[m]')
+    values = noisy_series(600)
+    values[::7] = np.nan
+
+    whole = BucketAccumulator(start, start + timedelta(hours=10), 20, ['value'])
+    whole.update({'timestamp': timestamps, 'value': values})
+    chunked = BucketAccumulator(start, start + timedelta(hours=10), 20, ['value'])
+    for offset in range(0, 600, 77):
+        chunked.update({'timestamp': timestamps[offset:offset + 77], 'value': values[offset:offset + 77]})
+
+    points = whole.data_points()
+    assert len(points) == 20
+    assert np.allclose([p['value'] for p in points], [p['value'] for p in chunked.data_points()])
+    assert np.isclose(points[0]['value'], np.nanmean(values[:30]))
+    assert points[1]['timestamp'] == start + timedelta(minutes=30)
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from block_encoding import WATERMARK_NAME as BLOCK_WATERMARK, pack_closed_blocks
+from conftest import insert, make_readings
+from energy_query import query_energy
+from retention import apply_retention
+from rollups import WATERMARK_NAME as ROLLUP_WATERMARK, update_rollups
+
+
+def numbered(readings):
+    """Give every reading a distinct energy_produced to identify it in the pages"""
+    for i, reading in enumerate(readings):
+        reading['energy_produced'] = float(i)
+    return readings
+
+
+def walk(facility_id, start, end, limit, packed_before=None):
+    """(timestamp, energy_produced) of every row, following the cursors; also returns the page count"""
+    rows, cursor, pages = [], None, 0
+    while True:
+        data, cursor = query_energy(facility_id, start, end, fields=['energy_produced'], limit=limit,
+                                    cursor=cursor, packed_before=packed_before)
+        rows += list(zip(data['timestamp'], data['energy_produced']))
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+
+def test_pages_cover_the_window_without_gaps_or_duplicates(app):
+    facility_id = app.config['FACILITY_ID']
+    start = datetime(2024, 3, 1)
+    insert(numbered(make_readings(facility_id, start, 95)))
+
+    rows, pages = walk(facility_id, start, start + timedelta(hours=2), 10)
+    assert pages == 10
+    assert [value for _, value in rows] == [float(i) for i in range(95)]
+
+    # The window bounds are [start, end)
+    rows, _ = walk(facility_id, start + timedelta(minutes=5), start + timedelta(minutes=15), 4)
+    assert [value for _, value in rows] == [float(i) for i in range(5, 15)]
+
+
+def test_rows_sharing_a_timestamp_are_paged_by_id(app):
+    facility_id = app.config['FACILITY_ID']
+    start = datetime(2024, 3, 1)
+    insert(numbered(make_readings(facility_id, start, 25, step=timedelta(0))))
+
+    rows, pages = walk(facility_id, start, start + timedelta(minutes=1), 10)
+    assert pages == 3
+    assert [value for _, value in rows] == [float(i) for i in range(25)]
+
+
+def test_packed_readings_merge_into_the_pages(app):
+    facility_id = app.config['FACILITY_ID']
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=100)
+    readings = make_readings(facility_id, start, 200, step=timedelta(hours=12))
+    insert(numbered(readings))
+    end = readings[-1]['timestamp'] + timedelta(seconds=1)
+    before, _ = walk(facility_id, start, end, 7)
+
+    while pack_closed_blocks():
+        pass
+    update_rollups()
+    deleted = apply_retention(raw_days=90, minute_rollup_days=0, pause=0,
+                              watermarks=[ROLLUP_WATERMARK, BLOCK_WATERMARK])['raw_rows_deleted']
+    assert 0 < deleted < len(readings)
+
+    after, _ = walk(facility_id, start, end, 7, packed_before=datetime.utcnow() - timedelta(days=90))
+    assert after == before
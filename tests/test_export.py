@@ -0,0 +1,56 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+from conftest import insert, make_readings
+from export import EXPORT_FIELDS, iter_export
+
+START = datetime(2024, 3, 1)
+
+
+def export(facility_id, fmt='csv', compress=False, end=None):
+    return b''.join(iter_export(facility_id, START, end, fmt=fmt, compress=compress, chunk_size=7))
+
+
+def test_csv_has_a_header_and_one_row_per_reading(app):
+    facility_id = app.config['FACILITY_ID']
+    ids = insert(make_readings(facility_id, START, 20))
+
+    rows = list(csv.reader(io.StringIO(export(facility_id).decode())))
+    assert rows[0] == EXPORT_FIELDS
+    assert [int(row[0]) for row in rows[1:]] == ids
+    first = dict(zip(EXPORT_FIELDS, rows[1]))
+    assert first['timestamp'] == START.isoformat()
+    assert float(first['energy_consumed']) == 20.0
+    assert first['current1'] == ''  # NULL
+
+
+def test_ndjson_has_one_record_per_reading(app):
+    facility_id = app.config['FACILITY_ID']
+    ids = insert(make_readings(facility_id, START, 20))
+
+    lines = export(facility_id, fmt='ndjson').decode().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [record['id'] for record in records] == ids
+    assert list(records[0]) == EXPORT_FIELDS
+    assert records[3]['timestamp'] == (START + timedelta(minutes=3)).isoformat()
+    assert records[0]['current1'] is None
+
+
+def test_empty_export_is_the_header_only(app):
+    facility_id = app.config['FACILITY_ID']
+    insert(make_readings(facility_id, START - timedelta(days=1), 5))
+
+    assert export(facility_id, end=START + timedelta(days=1)).decode() == ','.join(EXPORT_FIELDS) + '\n'
+    assert export(facility_id, fmt='ndjson', end=START + timedelta(days=1)) == b''
+    assert gzip.decompress(export(facility_id, compress=True, end=START + timedelta(days=1))) == \
+        export(facility_id, end=START + timedelta(days=1))
+
+
+def test_gzip_decompresses_to_the_same_csv(app):
+    facility_id = app.config['FACILITY_ID']
+    insert(make_readings(facility_id, START, 50))
+
+    assert gzip.decompress(export(facility_id, compress=True)) == export(facility_id)
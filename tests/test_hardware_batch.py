@@ -0,0 +1,62 @@
+from ingest import IngestBuffer
+from ingest_log import IngestLog, LogReplayer, list_segments, read_records, segment_path
+from models import EnergyData
+
+HEADERS = {'X-API-Key': 'dev_hardware_key'}
+BATCH = {'readings': [
+    {'timestamp': '2025-04-23T10:00:00Z', 'energy_produced': 75.5, 'energy_consumed': 62.3, 'current_load': 35.8},
+    {'timestamp': '2025-04-23T10:00:05Z', 'energy_produced': 75.1, 'energy_consumed': 61.9, 'current_load': 35.6},
+    {'energy_produced': 'n/a'}
+]}
+
+
+def stored_count(server):
+    with server.app.app_context():
+        return EnergyData.query.count()
+
+
+def test_batch_is_bulk_inserted_without_a_queue_or_log(server, client):
+    response = client.post('/api/hardware/data/batch', json=BATCH, headers=HEADERS)
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['accepted'], body['rejected']) == (2, 1)
+    assert all(result['data_id'] for result in body['results'][:2])
+    assert stored_count(server) == 2
+
+
+def test_batch_is_fsynced_to_the_ingest_log_before_the_response(server, client, monkeypatch, tmp_path):
+    log = IngestLog(str(tmp_path), fsync_interval_ms=5)
+    monkeypatch.setattr(server, 'ingest_log', log)
+    try:
+        response = client.post('/api/hardware/data/batch', json=BATCH, headers=HEADERS)
+        assert response.status_code == 200
+        assert response.get_json()['results'][0]['data_id'] is None
+
+        # Durable but not stored yet; the replayer loads it
+        segments = list_segments(log.directory)
+        records = [record for index in segments for record, _ in read_records(segment_path(log.directory, index))]
+        assert [record['energy_produced'] for record in records] == [75.5, 75.1]
+        assert log.durable_position() == log._written
+        assert stored_count(server) == 0
+        assert LogReplayer(server.app, log.directory, log=log).replay() == 2
+    finally:
+        log.close()
+    assert stored_count(server) == 2
+
+
+def test_batch_is_queued_whole_or_refused_with_write_behind(server, client, monkeypatch):
+    buffer = IngestBuffer(server.app, max_size=3)
+    monkeypatch.setattr(server, 'ingest_buffer', buffer)
+
+    response = client.post('/api/hardware/data/batch', json=BATCH, headers=HEADERS)
+    assert response.status_code == 200
+    assert buffer.queue.qsize() == 2
+    assert stored_count(server) == 0
+
+    # One slot left: the whole batch is refused rather than half of it queued
+    response = client.post('/api/hardware/data/batch', json=BATCH, headers=HEADERS)
+    assert response.status_code == 429
+    assert buffer.queue.qsize() == 2
+
+    buffer.flush()
+    assert stored_count(server) == 2
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from flask import Flask
+from flask_login import LoginManager
+
+from http_cache import ResponseCache, conditional_get, reading_watermark
+
+READING = {'id': 7, 'facility_id': 1, 'timestamp': datetime(2024, 5, 1, 12, 0)}
+
+
+def make_client(model):
+    """App with one view rendering model['version'], which the view may bump while it renders"""
+    app = Flask(__name__)
+    LoginManager(app).user_loader(lambda user_id: None)
+    cache = ResponseCache()
+
+    @app.route('/predictions')
+    @conditional_get(lambda: reading_watermark(READING), version=lambda: model['version'])
+    @cache.cached(lambda: reading_watermark(READING), version=lambda: model['version'])
+    def predictions():
+        body = f"model {model['version']}"
+        model['version'] += model.pop('swap', 0)
+        return body
+
+    return app.test_client()
+
+
+def test_etag_names_the_version_the_body_was_rendered_with():
+    model = {'version': 1, 'swap': 1}  # the training job swaps the model during the first render
+    client = make_client(model)
+
+    first = client.get('/predictions')
+    assert first.get_data(as_text=True) == 'model 1'
+    assert first.headers['ETag'].endswith('.m1"')
+
+    # The old tag is stale now, and the cached page of the old model is not served for the new one
+    second = client.get('/predictions', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.get_data(as_text=True) == 'model 2'
+    assert client.get('/predictions', headers={'If-None-Match': second.headers['ETag']}).status_code == 304
+
+
+def test_if_modified_since_cannot_validate_a_versioned_view():
+    model = {'version': 1}
+    client = make_client(model)
+    first = client.get('/predictions')
+    model['version'] = 2
+
+    again = client.get('/predictions', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 200
+    assert again.get_data(as_text=True) == 'model 2'
+
+
+def test_if_modified_since_cannot_validate_a_reading_in_the_same_second():
+    app = Flask(__name__)
+    LoginManager(app).user_loader(lambda user_id: None)
+    latest = dict(READING)
+
+    @app.route('/data')
+    @conditional_get(lambda: reading_watermark(latest))
+    def data():
+        return f"reading {latest['id']}"
+
+    client = app.test_client()
+    first = client.get('/data')
+    latest.update(id=8, timestamp=READING['timestamp'].replace(microsecond=500000))
+
+    again = client.get('/data', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 200
+    assert again.get_data(as_text=True) == 'reading 8'
+    assert client.get('/data', headers={'If-None-Match': again.headers['ETag']}).status_code == 304
@@ -0,0 +1,42 @@
+from conftest import hours_ago, make_readings
+from ingest import IngestBuffer
+from ingest_log import IngestLog, LogReplayer, REJECT_FILE, read_records
+from models import db, EnergyData, IngestCheckpoint
+
+
+def test_buffer_dead_letters_only_the_bad_reading(app):
+    readings = make_readings(app.config['FACILITY_ID'], hours_ago(1), 9)
+    readings[5]['efficiency'] = None  # NOT NULL
+    buffer = IngestBuffer(app, max_batch=100)
+    for reading in readings:
+        buffer.submit(reading)
+
+    buffer.flush()
+
+    stats = buffer.get_stats()
+    assert stats['flushed'] == 8
+    assert stats['dead_lettered'] == 1
+    assert stats['queue_depth'] == 0
+    assert EnergyData.query.count() == 8
+
+
+def test_replayer_quarantines_rejected_records(app, tmp_path):
+    readings = make_readings(app.config['FACILITY_ID'], hours_ago(1), 6)
+    readings[2]['efficiency'] = None
+    log = IngestLog(str(tmp_path / 'log'))
+    for reading in readings:
+        log.append(reading)
+    log.close()
+
+    replayer = LogReplayer(app, log.directory, batch_size=4)
+    assert replayer.replay() == 5
+    assert replayer.rejected == 1
+    assert EnergyData.query.count() == 5
+
+    rejects = [record for record, _ in read_records(f'{log.directory}/{REJECT_FILE}')]
+    assert [record['timestamp'] for record in rejects] == [readings[2]['timestamp']]
+    assert 'reject_reason' in rejects[0]
+
+    # The checkpoint moved past the rejected record, so nothing is applied twice
+    assert db.session.get(IngestCheckpoint, replayer.name).segment == 1
+    assert replayer.replay() == 0
@@ -0,0 +1,18 @@
+import time
+
+from conftest import hours_ago, insert, make_readings
+from latest_cache import LatestReadingCache
+
+
+def test_refresh_picks_up_readings_stored_by_other_processes(app):
+    facility_id = app.config['FACILITY_ID']
+    insert(make_readings(facility_id, hours_ago(2), 1))
+    cache = LatestReadingCache(refresh_seconds=0.05)
+    first = cache.get(facility_id)
+
+    # Stored without going through this cache, like a reading ingested by another worker
+    newer_id, = insert(make_readings(facility_id, hours_ago(1), 1))
+    assert cache.get(facility_id)['id'] == first['id']
+    time.sleep(0.06)
+    assert cache.get(facility_id)['id'] == newer_id
+    assert cache.get()['id'] == newer_id
@@ -0,0 +1,31 @@
+import pytest
+
+from live_stream import DROPPED, LiveEventHub, StreamFull
+
+
+def test_refuses_clients_above_the_cap_until_one_leaves():
+    hub = LiveEventHub(max_clients=2)
+    first = hub.subscribe(1)
+    hub.subscribe(2)
+    with pytest.raises(StreamFull):
+        hub.subscribe(1)
+
+    hub.unsubscribe(first)
+    hub.unsubscribe(first)  # closing twice frees one slot only
+    hub.subscribe(1)
+    stats = hub.get_stats()
+    assert stats['clients'] == 2
+    assert stats['refused_clients'] == 1
+
+
+def test_dropped_slow_client_frees_its_slot():
+    hub = LiveEventHub(client_queue_size=2, max_clients=1)
+    slow = hub.subscribe(1)
+    for i in range(3):
+        hub.publish(1, 'reading', {'i': i})
+
+    assert slow.dropped
+    assert list(slow.queue.queue)[-1] is DROPPED
+    hub.subscribe(1)
+    hub.unsubscribe(slow)  # the stream generator still unsubscribes when it ends
+    assert hub.get_stats()['clients'] == 1
@@ -0,0 +1,61 @@
+from meter_import import file_key, import_readings
+from models import EnergyData
+
+HEADER = 'timestamp,energy_produced,energy_consumed,current_load\n'
+
+
+def rows(start, stop):
+    return ''.join(f'2024-01-01T{i // 60:02d}:{i % 60:02d}:00,1.5,2.5,30\n' for i in range(start, stop))
+
+
+def test_appended_rows_resume_from_the_rows_consumed(app, tmp_path):
+    path = tmp_path / 'meter.csv'
+    path.write_text(HEADER + rows(0, 100))
+    assert import_readings(str(path), chunk_size=30) == (100, 0, 0)
+
+    key = file_key(str(path))
+    with open(path, 'a') as f:
+        f.write(rows(100, 150))
+    assert file_key(str(path)) == key
+
+    assert import_readings(str(path), chunk_size=30) == (50, 0, 100)
+    assert import_readings(str(path), chunk_size=30) == (0, 0, 150)
+    assert EnergyData.query.count() == 150
+
+
+def test_other_files_get_their_own_key(tmp_path):
+    first, second = tmp_path / 'a.csv', tmp_path / 'b.csv'
+    first.write_text(HEADER + rows(0, 10))
+    second.write_text(HEADER + rows(0, 10))
+    assert file_key(str(first)) != file_key(str(second))
+
+    # A different export written over the same path starts a new import
+    key = file_key(str(first))
+    first.write_text(HEADER + rows(5, 10))
+    assert file_key(str(first)) != key
+
+
+def test_resume_counts_parsed_rows_not_file_lines(app, tmp_path):
+    # Blank lines are dropped by the parser and a quoted note spans two lines
+    lines = [f'{row.rstrip()},"note {i}"\n' for i, row in enumerate(rows(0, 100).splitlines())]
+    lines[3] = lines[3].replace('"note 3"', '"note\nover two lines"')
+    for i in range(90, 0, -10):
+        lines.insert(i, '\n')
+    path = tmp_path / 'meter.csv'
+    path.write_text(HEADER.replace('\n', ',note\n') + ''.join(lines))
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(rows_done, accepted, rejected):
+        raise Interrupted
+
+    try:
+        import_readings(str(path), chunk_size=30, progress=interrupt)
+    except Interrupted:
+        pass
+    assert EnergyData.query.count() == 30
+
+    assert import_readings(str(path), chunk_size=30) == (70, 0, 30)
+    timestamps = [reading.timestamp for reading in EnergyData.query.order_by(EnergyData.timestamp)]
+    assert len(set(timestamps)) == len(timestamps) == 100
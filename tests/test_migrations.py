@@ -0,0 +1,44 @@
+from sqlalchemy import inspect, text
+
+from conftest import hours_ago, insert, make_readings
+from migrations import ensure_sqlite_autoincrement, run_migrations
+from models import db, EnergyData, JobWatermark
+
+
+def drop_autoincrement():
+    """Recreate energy_data the way older versions did, without AUTOINCREMENT"""
+    ddl = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'energy_data'")).scalar()
+    db.session.execute(text('ALTER TABLE energy_data RENAME TO energy_data_autoincrement'))
+    db.session.execute(text(ddl.replace('AUTOINCREMENT', '')))
+    db.session.execute(text('INSERT INTO energy_data SELECT * FROM energy_data_autoincrement'))
+    db.session.execute(text('DROP TABLE energy_data_autoincrement'))
+    db.session.commit()
+
+
+def test_rebuilt_table_never_reuses_processed_ids(app):
+    ids = insert(make_readings(app.config['FACILITY_ID'], hours_ago(2), 10))
+    db.session.add(JobWatermark(name='rollup', last_id=ids[-1]))
+    db.session.commit()
+    drop_autoincrement()
+    # Retention removed every processed reading
+    EnergyData.query.delete()
+    db.session.commit()
+    db.session.remove()
+
+    run_migrations(db.engine)
+    assert not ensure_sqlite_autoincrement(db.engine)
+    new_id, = insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 1))
+    assert new_id > ids[-1]
+
+    index_names = {index['name'] for index in inspect(db.engine).get_indexes('energy_data')}
+    assert {index.name for index in EnergyData.__table__.indexes} <= index_names
+
+
+def test_rebuild_keeps_the_readings(app):
+    ids = insert(make_readings(app.config['FACILITY_ID'], hours_ago(2), 10))
+    drop_autoincrement()
+    db.session.remove()
+
+    assert ensure_sqlite_autoincrement(db.engine)
+    assert [reading.id for reading in EnergyData.query.order_by(EnergyData.id)] == ids
+    assert 'energy_data_rebuilt' not in inspect(db.engine).get_table_names()
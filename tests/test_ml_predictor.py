@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ml_predictor import EnergyPredictor
+
+
+def hourly_points(hours, start=datetime(2024, 1, 1)):
+    return [
+        {'timestamp': start + timedelta(hours=i), 'energy_consumed': 50 + 20 * np.sin(i / 24 * 2 * np.pi) + i % 7}
+        for i in range(hours)
+    ]
+
+
+def test_factors_are_group_means_over_the_baseline():
+    points = hourly_points(24 * 21)
+    model = EnergyPredictor()
+    model.train(points)
+
+    consumption = np.array([point['energy_consumed'] for point in points])
+    hours = np.array([point['timestamp'].hour for point in points])
+    weekdays = np.array([point['timestamp'].weekday() for point in points])
+    assert np.isclose(model.baseline, consumption.mean())
+    for hour in range(24):
+        assert np.isclose(model.hourly_patterns[hour], consumption[hours == hour].mean() / consumption.mean())
+    for day in range(7):
+        assert np.isclose(model.daily_patterns[day], consumption[weekdays == day].mean() / consumption.mean())
+
+
+def test_holdout_score_matches_a_model_fitted_without_the_last_day():
+    points = hourly_points(24 * 10)
+    model = EnergyPredictor()
+    model.train(points)
+
+    holdout = EnergyPredictor()
+    holdout.train(points[:-24], validate=False)
+    actual = np.array([point['energy_consumed'] for point in points[-24:]])
+    predicted = np.array([
+        holdout.baseline * holdout.hourly_patterns[p['timestamp'].hour] * holdout.daily_patterns[p['timestamp'].weekday()]
+        for p in points[-24:]
+    ])
+    assert np.isclose(model.validation_score, max(0, 100 - np.mean(np.abs((actual - predicted) / actual)) * 100))
+
+
+def test_columns_and_dicts_train_the_same_model():
+    points = hourly_points(24 * 8)
+    columns = {
+        'timestamp': np.array([point['timestamp'] for point in points], dtype='datetime64[us]'),
+        'energy_consumed': np.array([point['energy_consumed'] for point in points])
+    }
+    from_dicts, from_columns = EnergyPredictor(), EnergyPredictor()
+    from_dicts.train(points)
+    from_columns.train(columns)
+    assert np.isclose(from_dicts.baseline, from_columns.baseline)
+    assert from_dicts.hourly_patterns == from_columns.hourly_patterns
+
+
+def test_hourly_updates_equal_training_on_the_extra_points():
+    points = hourly_points(24 * 14)
+    updated = EnergyPredictor()
+    updated.train(points[:-24])
+    assert updated.update_many(points[-24:])
+
+    trained = EnergyPredictor()
+    trained.train(points)
+    assert np.isclose(updated.baseline, trained.baseline)
+    for hour in range(24):
+        assert np.isclose(updated.hourly_patterns[hour], trained.hourly_patterns[hour])
+
+
+def test_updates_weight_by_elapsed_time_and_skip_old_readings():
+    model = EnergyPredictor()
+    model.train(hourly_points(48))
+    before = model.hour_counts.sum()
+    last = model.last_timestamp
+
+    assert not model.update_many([{'timestamp': last - timedelta(minutes=5), 'energy_consumed': 999}])
+    assert model.update_many([
+        {'timestamp': last + timedelta(minutes=15), 'energy_consumed': 40},
+        {'timestamp': last + timedelta(minutes=30), 'energy_consumed': 40}
+    ])
+    assert np.isclose(model.hour_counts.sum(), before + 0.5)
+    assert model.last_timestamp == last + timedelta(minutes=30)
+
+
+def test_round_trip_through_dict():
+    model = EnergyPredictor()
+    model.train(hourly_points(24 * 3))
+    model.trained_at = datetime(2024, 1, 4)
+    restored = EnergyPredictor.from_dict(model.to_dict())
+    assert restored.to_dict() == model.to_dict()
+    assert restored.update_many(hourly_points(2, start=model.last_timestamp + timedelta(hours=1)))
+
+
+def test_updates_bump_the_revision_and_clamp_future_readings():
+    model = EnergyPredictor()
+    model.train(hourly_points(48, start=datetime.utcnow() - timedelta(hours=50)))
+    assert model.revision == 0
+
+    future = datetime.utcnow() + timedelta(days=2)
+    assert model.update_many([{'timestamp': future, 'energy_consumed': 40}])
+    assert model.revision == 1
+    assert model.last_timestamp <= datetime.utcnow()
+
+    # A reading taken now still counts after the future-dated one
+    time.sleep(0.01)
+    assert model.update_many([{'timestamp': datetime.utcnow(), 'energy_consumed': 40}])
+    assert model.revision == 2
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from conftest import insert, make_readings
+from models import db, EnergyData, EnergyRollup, JobWatermark
+from retention import apply_retention
+from rollups import MINUTE, HOUR, WATERMARK_NAME, update_rollups
+
+
+def test_deletes_only_processed_aged_readings(app):
+    facility_id = app.config['FACILITY_ID']
+    old = datetime.utcnow() - timedelta(days=100)
+    old_ids = insert(make_readings(facility_id, old, 20))
+    update_rollups()
+    # Inserted after the rollup run: aged, but not processed yet
+    late_ids = insert(make_readings(facility_id, old, 5))
+    recent_ids = insert(make_readings(facility_id, datetime.utcnow() - timedelta(hours=1), 5))
+
+    report = apply_retention(raw_days=90, minute_rollup_days=0, chunk_size=7, pause=0)
+
+    assert report['raw_rows_deleted'] == 20
+    remaining = set(db.session.execute(db.select(EnergyData.id)).scalars())
+    assert remaining == set(late_ids + recent_ids)
+    assert not remaining & set(old_ids)
+
+
+def test_waits_for_every_watermark(app):
+    facility_id = app.config['FACILITY_ID']
+    ids = insert(make_readings(facility_id, datetime.utcnow() - timedelta(days=100), 10))
+    update_rollups()
+    db.session.add(JobWatermark(name='block_pack', last_id=ids[3]))
+    db.session.commit()
+
+    report = apply_retention(raw_days=90, minute_rollup_days=0, pause=0, watermarks=[WATERMARK_NAME, 'block_pack'])
+    assert report['raw_rows_deleted'] == 4
+
+
+def test_prunes_minute_rollups_only(app):
+    insert(make_readings(app.config['FACILITY_ID'], datetime.utcnow() - timedelta(days=10), 90))
+    update_rollups()
+
+    report = apply_retention(raw_days=0, minute_rollup_days=5, pause=0)
+
+    assert report['raw_rows_deleted'] == 0
+    assert report['minute_rollups_deleted'] == 90
+    assert EnergyRollup.query.filter_by(resolution=MINUTE).count() == 0
+    assert EnergyRollup.query.filter_by(resolution=HOUR).count() > 0
+    assert EnergyData.query.count() == 90
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+import numpy as np
+
+from conftest import hours_ago, insert, make_readings
+from models import db, EnergyRollup, JobWatermark
+from rollups import DAY, HOUR, MINUTE, WATERMARK_NAME, aggregate_columns, choose_resolution, update_rollups, _update_lock
+
+
+def bucket_rows(resolution):
+    return {
+        rollup.bucket_start: rollup
+        for rollup in EnergyRollup.query.filter_by(resolution=resolution).order_by(EnergyRollup.bucket_start)
+    }
+
+
+def test_aggregate_columns_matches_numpy():
+    epoch = np.arange(0, 7200, 30, dtype=np.int64)
+    facility_ids = np.where(epoch % 60 == 0, 1, 2)
+    values = np.sin(epoch / 500.0) * 10
+    values[::7] = np.nan
+    result = aggregate_columns(facility_ids, epoch, {'energy_consumed': values}, HOUR)
+
+    for i, (facility_id, bucket) in enumerate(zip(result['facility_id'], result['bucket_start'])):
+        selected = (facility_ids == facility_id) & (epoch // HOUR * HOUR == bucket)
+        valid = values[selected][~np.isnan(values[selected])]
+        assert result['count'][i] == selected.sum()
+        assert result['energy_consumed_count'][i] == len(valid)
+        assert np.isclose(result['energy_consumed_sum'][i], valid.sum())
+        assert np.isclose(result['energy_consumed_sumsq'][i], (valid ** 2).sum())
+        assert result['energy_consumed_min'][i] == valid.min()
+        assert result['energy_consumed_max'][i] == valid.max()
+
+
+def test_incremental_updates_equal_one_pass(app):
+    facility_id = app.config['FACILITY_ID']
+    readings = make_readings(facility_id, hours_ago(3), 150)
+    insert(readings[:70])
+    assert update_rollups(batch_size=25) == 70
+    insert(readings[70:])
+    assert update_rollups() == 80
+    assert update_rollups() == 0
+
+    consumed = np.array([reading['energy_consumed'] for reading in readings])
+    hours = np.array([reading['timestamp'].replace(minute=0, second=0) for reading in readings])
+    buckets = bucket_rows(HOUR)
+    assert sum(bucket.count for bucket in buckets.values()) == 150
+    for start, bucket in buckets.items():
+        selected = consumed[hours == start]
+        assert bucket.count == len(selected)
+        assert np.isclose(bucket.mean('energy_consumed'), selected.mean())
+        assert bucket.energy_consumed_min == selected.min()
+        assert bucket.energy_consumed_max == selected.max()
+    assert len(bucket_rows(MINUTE)) == 150
+
+
+def test_max_batches_and_busy_lock(app):
+    ids = insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 30))
+    assert update_rollups(batch_size=10, max_batches=1) == 10
+    assert db.session.get(JobWatermark, WATERMARK_NAME).last_id == ids[9]
+
+    with _update_lock:
+        assert update_rollups(wait=False) is None
+    assert update_rollups(wait=False) == 20
+
+
+def test_choose_resolution():
+    assert choose_resolution(timedelta(minutes=30)) is None
+    assert choose_resolution(timedelta(hours=1)) == MINUTE
+    assert choose_resolution(timedelta(days=3)) == HOUR
+    assert choose_resolution(timedelta(days=100)) == DAY
@@ -0,0 +1,35 @@
+from conftest import hours_ago, insert, make_readings
+from shared_ring import SharedReadingRing
+
+
+def test_queued_readings_do_not_make_the_ring_stale(app, tmp_path):
+    facility_id = app.config['FACILITY_ID']
+    insert(make_readings(facility_id, hours_ago(2), 3))
+    path = str(tmp_path / 'readings.ring')
+    ring = SharedReadingRing(path, capacity=16, slots=2)
+    assert ring.rebuild_if_stale()
+
+    # Write-behind hands the ring a reading before the database assigns its id
+    queued, = make_readings(facility_id, hours_ago(1), 1)
+    ring.update(dict(queued, id=None))
+    insert([queued])
+
+    # A worker starting later finds the ring up to date
+    assert not SharedReadingRing(path, capacity=16, slots=2).rebuild_if_stale()
+
+    # Readings stored without reaching the ring do trigger a rebuild
+    insert(make_readings(facility_id, hours_ago(0.5), 1))
+    assert SharedReadingRing(path, capacity=16, slots=2).rebuild_if_stale()
+
+
+def test_facilities_missing_from_the_ring_are_looked_up_and_kept(app, tmp_path):
+    ring = SharedReadingRing(str(tmp_path / 'readings.ring'), capacity=16, slots=4)
+    ring.rebuild_if_stale()
+    assert ring.get(app.config['FACILITY_ID']) is None
+
+    # Imported without passing through the ring
+    reading_id, = insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 1))
+    assert ring.get(app.config['FACILITY_ID'])['id'] == reading_id
+    fallbacks = ring.fallbacks
+    assert ring.get(app.config['FACILITY_ID'])['id'] == reading_id
+    assert ring.fallbacks == fallbacks
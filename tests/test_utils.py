@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from utils import TrendAccumulator, analyze_trend_columns, analyze_trends
+
+
+def reference_analyze_trends(data_points):
+    """analyze_trends as it was before the columnar rewrite: one pass over the reading dicts"""
+    production_values = [d['energy_produced'] for d in data_points]
+    consumption_values = [d['energy_consumed'] for d in data_points]
+    stats = {
+        key: {'mean': np.mean(values), 'max': np.max(values), 'min': np.min(values), 'std': np.std(values)}
+        for key, values in (('production', production_values), ('consumption', consumption_values))
+    }
+
+    trend = 'neutral'
+    if len(data_points) > 1:
+        first_half = consumption_values[:len(consumption_values) // 2]
+        second_half = consumption_values[len(consumption_values) // 2:]
+        if np.mean(second_half) > np.mean(first_half) * 1.05:
+            trend = 'increasing'
+        elif np.mean(first_half) > np.mean(second_half) * 1.05:
+            trend = 'decreasing'
+
+    peak_hours = {}
+    for d in data_points:
+        peak_hours.setdefault(d['timestamp'].hour, 0)
+        if d['energy_consumed'] > stats['consumption']['mean']:
+            peak_hours[d['timestamp'].hour] += 1
+    return {'statistics': stats, 'trend': trend, 'peak_hours': peak_hours}
+
+
+def readings(count, growth):
+    start = datetime(2024, 3, 1, 5, 30)
+    rng = np.random.default_rng(11)
+    return [
+        {
+            'timestamp': start + timedelta(minutes=20 * i),
+            'energy_produced': float(40 + 10 * np.sin(i / 9) + rng.normal()),
+            'energy_consumed': float(30 + growth * i + 5 * np.cos(i / 5) + rng.normal())
+        }
+        for i in range(count)
+    ]
+
+
+def to_columns(points):
+    return {
+        'timestamp': np.array([p['timestamp'] for p in points], dtype='datetime64[us]'),
+        'energy_produced': np.array([p['energy_produced'] for p in points]),
+        'energy_consumed': np.array([p['energy_consumed'] for p in points])
+    }
+
+
+def assert_same_analysis(result, expected):
+    assert result['trend'] == expected['trend']
+    assert result['peak_hours'] == expected['peak_hours']
+    for key, stats in expected['statistics'].items():
+        for name, value in stats.items():
+            assert result['statistics'][key][name] == pytest.approx(value), (key, name)
+
+
+@pytest.mark.parametrize('growth', [0.01, 0.0, -0.01])
+def test_columnar_and_streaming_analysis_match_the_original(growth):
+    points = readings(1001, growth)
+    expected = reference_analyze_trends(points)
+
+    assert_same_analysis(analyze_trends(points), expected)
+    columns = to_columns(points)
+    assert_same_analysis(analyze_trend_columns(columns), expected)
+
+    accumulator = TrendAccumulator(len(points), float(np.mean(columns['energy_consumed'])))
+    for offset in range(0, len(points), 97):
+        accumulator.update({name: values[offset:offset + 97] for name, values in columns.items()})
+    assert_same_analysis(accumulator.result(), expected)
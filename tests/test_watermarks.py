@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from conftest import hours_ago, insert, make_readings
+from models import db, JobWatermark
+import rollups
+import watermarks
+
+
+def backdate_sample(seconds):
+    sample = db.session.get(JobWatermark, watermarks.SAMPLE_NAME)
+    sample.updated_at -= timedelta(seconds=seconds)
+    db.session.commit()
+
+
+def test_sqlite_needs_no_window(app):
+    insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 5))
+    assert watermarks.settled_id(60) is None
+
+
+def test_sample_is_promoted_once_old_enough(app, monkeypatch):
+    monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+    ids = insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 5))
+
+    assert watermarks.settled_id(60) == 0  # first sample taken now
+    insert(make_readings(app.config['FACILITY_ID'], hours_ago(1), 3))
+    assert watermarks.settled_id(60) == 0  # sample too recent
+
+    backdate_sample(61)
+    assert watermarks.settled_id(60) == ids[-1]
+    # The new sample holds the readings inserted since
+    assert db.session.get(JobWatermark, watermarks.SAMPLE_NAME).last_id == ids[-1] + 3
+
+
+def test_rollups_stop_at_the_settled_id(app, monkeypatch):
+    ids = insert(make_readings(app.config['FACILITY_ID'], hours_ago(2), 10))
+    monkeypatch.setattr(rollups, 'settled_id', lambda: ids[3])
+
+    assert rollups.update_rollups() == 4
+    assert db.session.get(JobWatermark, rollups.WATERMARK_NAME).last_id == ids[3]
+
+
+def test_sqlite_ids_are_not_reused(app):
+    facility_id = app.config['FACILITY_ID']
+    ids = insert(make_readings(facility_id, hours_ago(1), 3))
+    db.session.execute(db.delete(rollups.EnergyData).where(rollups.EnergyData.id == ids[-1]))
+    db.session.commit()
+
+    assert insert(make_readings(facility_id, hours_ago(1), 1)) == [ids[-1] + 1]
+
+
+def test_postgres_sample_settles(pg_app):
+    ids = insert(make_readings(pg_app.config['FACILITY_ID'], hours_ago(1), 5))
+    assert watermarks.settled_id(60) == 0
+    db.session.commit()
+    backdate_sample(61)
+    assert watermarks.settled_id(60) == ids[-1]
@@ -79,7 +79,11 @@ def get_ai_recommendations(data):
 def analyze_trends(data_points):
     """
     Analyze historical energy data to identify trends
+    Accepts a list of reading dicts or a dict of column arrays (see analyze_trend_columns)
     """
+    if isinstance(data_points, dict):
+        return analyze_trend_columns(data_points)
+
     if not data_points:
         return {
             'statistics': {
@@ -89,12 +93,38 @@ def analyze_trends(data_points):
             'trend': 'neutral',
             'peak_hours': {}
         }
-    
-    # Extract production and consumption values
-    production_values = [d['energy_produced'] for d in data_points]
-    consumption_values = [d['energy_consumed'] for d in data_points]
-    
-    # Calculate basic statistics
+
+    # Transpose once and analyze the columns (hours straight from the datetimes, converting them is slower)
+    count = len(data_points)
+    return analyze_trend_columns({
+        'hour': np.fromiter((d['timestamp'].hour for d in data_points), np.int64, count),
+        'energy_produced': np.fromiter((d['energy_produced'] for d in data_points), np.float64, count),
+        'energy_consumed': np.fromiter((d['energy_consumed'] for d in data_points), np.float64, count)
+    })
+
+def _hours_by_first_appearance(hours):
+    """Distinct hours of day in order of first appearance (the order analyze_trends has always listed them)"""
+    wanted = np.count_nonzero(np.bincount(hours, minlength=24))
+    # Time-ordered data shows every hour within its first day, so a short prefix is usually enough
+    size = 4096
+    while True:
+        present, first_seen = np.unique(hours[:size], return_index=True)
+        if len(present) == wanted or size >= len(hours):
+            return present[np.argsort(first_seen)]
+        size *= 16
+
+def analyze_trend_columns(columns):
+    """
+    Analyze historical energy data held in column arrays (e.g. memory-mapped archive segments)
+    Expects 'timestamp' as datetime64 (or 'hour' of day as integers) plus 'energy_produced' and
+    'energy_consumed' arrays
+    """
+    production_values = np.asarray(columns['energy_produced'], dtype=np.float64)
+    consumption_values = np.asarray(columns['energy_consumed'], dtype=np.float64)
+
+    if not len(consumption_values):
+        return analyze_trends([])
+
     stats = {
         'production': {
             'mean': np.mean(production_values),
@@ -109,38 +139,109 @@ def analyze_trends(data_points):
             'std': np.std(consumption_values)
         }
     }
-    
+
     # Determine trend (increasing, decreasing, or neutral)
-    if len(data_points) > 1:
-        first_half = consumption_values[:len(consumption_values)//2]
-        second_half = consumption_values[len(consumption_values)//2:]
-        
-        if np.mean(second_half) > np.mean(first_half) * 1.05:
+    trend = 'neutral'
+    if len(consumption_values) > 1:
+        half = len(consumption_values) // 2
+        first_mean = np.mean(consumption_values[:half])
+        second_mean = np.mean(consumption_values[half:])
+        if second_mean > first_mean * 1.05:
             trend = 'increasing'
-        elif np.mean(first_half) > np.mean(second_half) * 1.05:
+        elif first_mean > second_mean * 1.05:
             trend = 'decreasing'
-        else:
-            trend = 'neutral'
+
+    # Identify peak hours: readings above average consumption per hour of day
+    if 'hour' in columns:
+        hours = np.asarray(columns['hour'], dtype=np.int64)
     else:
-        trend = 'neutral'
-    
-    # Identify peak hours
-    peak_hours = {}
-    for d in data_points:
-        hour = d['timestamp'].hour
-        if hour not in peak_hours:
-            peak_hours[hour] = 0
-        
-        # Count as peak if consumption is above average
-        if d['energy_consumed'] > stats['consumption']['mean']:
-            peak_hours[hour] += 1
-    
+        hours = np.asarray(columns['timestamp'], dtype='datetime64[us]').astype('datetime64[h]').astype(np.int64) % 24
+    above_mean = np.bincount(hours[consumption_values > stats['consumption']['mean']], minlength=24)
+    peak_hours = {int(hour): int(above_mean[hour]) for hour in _hours_by_first_appearance(hours)}
+
     return {
         'statistics': stats,
         'trend': trend,
         'peak_hours': peak_hours
     }
 
+class TrendAccumulator:
+    """
+    Streaming equivalent of analyze_trend_columns for readings fed in timestamp-ordered chunks
+    The total count and mean consumption must be known up front (e.g. from SQL COUNT/AVG)
+    so the trend halves and the above-mean peak counts are found in a single pass.
+    """
+
+    def __init__(self, total, consumption_mean):
+        self.total = total
+        self.half = total // 2
+        self.consumption_mean = consumption_mean
+        self.seen = 0
+        # count, mean, sum of squared deviations, min, max (combined with Chan's parallel update)
+        self.moments = {key: [0, 0.0, 0.0, np.inf, -np.inf] for key in ('production', 'consumption')}
+        self.halves = [[0, 0.0], [0, 0.0]]
+        self.above_mean = np.zeros(24, dtype=np.int64)
+        self.hours_seen = np.zeros(24, dtype=bool)
+
+    def update(self, columns):
+        """Fold in one chunk of column arrays ('timestamp', 'energy_produced', 'energy_consumed')"""
+        consumption = np.asarray(columns['energy_consumed'], dtype=np.float64)
+        n = len(consumption)
+        if not n:
+            return
+
+        for key, values in (('production', np.asarray(columns['energy_produced'], dtype=np.float64)),
+                            ('consumption', consumption)):
+            moments = self.moments[key]
+            count, mean, m2 = moments[0], moments[1], moments[2]
+            chunk_mean = values.mean()
+            chunk_m2 = ((values - chunk_mean) ** 2).sum()
+            delta = chunk_mean - mean
+            moments[0] = count + n
+            moments[1] = mean + delta * n / moments[0]
+            moments[2] = m2 + chunk_m2 + delta * delta * count * n / moments[0]
+            moments[3] = min(moments[3], values.min())
+            moments[4] = max(moments[4], values.max())
+
+        # Readings before the overall midpoint go to the first half
+        split = min(max(self.half - self.seen, 0), n)
+        self.halves[0][0] += split
+        self.halves[0][1] += consumption[:split].sum()
+        self.halves[1][0] += n - split
+        self.halves[1][1] += consumption[split:].sum()
+        self.seen += n
+
+        hours = np.asarray(columns['timestamp']).astype('datetime64[h]').astype(np.int64) % 24
+        self.above_mean += np.bincount(hours[consumption > self.consumption_mean], minlength=24)
+        self.hours_seen[hours] = True
+
+    def result(self):
+        """Return the analysis in the same shape as analyze_trends"""
+        if not self.seen:
+            return analyze_trends([])
+
+        stats = {}
+        for key, (count, mean, m2, low, high) in self.moments.items():
+            stats[key] = {'mean': mean, 'max': high, 'min': low, 'std': float(np.sqrt(m2 / count))}
+
+        trend = 'neutral'
+        (first_count, first_sum), (second_count, second_sum) = self.halves
+        if self.seen > 1 and first_count and second_count:
+            first_mean = first_sum / first_count
+            second_mean = second_sum / second_count
+            if second_mean > first_mean * 1.05:
+                trend = 'increasing'
+            elif first_mean > second_mean * 1.05:
+                trend = 'decreasing'
+
+        peak_hours = {int(hour): int(self.above_mean[hour]) for hour in np.flatnonzero(self.hours_seen)}
+
+        return {
+            'statistics': stats,
+            'trend': trend,
+            'peak_hours': peak_hours
+        }
+
 def get_trend_insights(trend_analysis):
     """
     Generate insights based on trend analysis
@@ -0,0 +1,62 @@
+"""
+Upper bound for the id watermarks of the background jobs
+
+The rollup and block packing jobs read energy_data in id order and remember
+the highest id they have processed; retention and the cold archive only
+remove readings below those watermarks.  On PostgreSQL an id is taken from
+the sequence when a row is inserted (or reserved with nextval before a COPY,
+see ingest._copy_readings), not when its transaction commits, so a reading
+with a lower id can become visible after one with a higher id.  A job that
+had already moved past the higher id would never process it, and retention
+would later delete it unprocessed.
+
+Jobs therefore only process ids up to settled_id(): the highest id that was
+already handed out WATERMARK_SETTLE_SECONDS ago, which every transaction
+shorter than that has committed (or rolled back) since.  The highest id is
+sampled into job_watermark ('id_sample') and promoted to 'id_settled' once
+the sample is old enough.  SQLite serializes writers and assigns rowids
+inside the write transaction, so ids become visible in order there and no
+window is needed.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, func
+
+from models import db, EnergyData, JobWatermark
+
+DEFAULT_SETTLE_SECONDS = 60
+
+SAMPLE_NAME = 'id_sample'
+SETTLED_NAME = 'id_settled'
+
+
+def settled_id(settle_seconds=None):
+    """
+    Highest energy_data id whose transaction has certainly finished
+    Must be called inside an application context; the caller commits.
+    Returns: the id, or None when every visible id is safe to process (SQLite or no window)
+    """
+    if settle_seconds is None:
+        settle_seconds = current_app.config.get('WATERMARK_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS)
+    if db.engine.dialect.name == 'sqlite' or settle_seconds <= 0:
+        return None
+
+    now = datetime.utcnow()
+    settled = db.session.get(JobWatermark, SETTLED_NAME)
+    if settled is None:
+        settled = JobWatermark(name=SETTLED_NAME, last_id=0, updated_at=now)
+        db.session.add(settled)
+
+    sample = db.session.get(JobWatermark, SAMPLE_NAME)
+    if sample is None or sample.updated_at <= now - timedelta(seconds=settle_seconds):
+        if sample is None:
+            sample = JobWatermark(name=SAMPLE_NAME, last_id=0)
+            db.session.add(sample)
+        else:
+            settled.last_id = max(settled.last_id, sample.last_id)
+            settled.updated_at = now
+        sample.last_id = db.session.execute(select(func.max(EnergyData.id))).scalar() or 0
+        sample.updated_at = now
+    db.session.flush()
+    return settled.last_id